@@ -1,49 +1,647 @@
 # api/cross_stitch.py
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import traceback
+from functools import partial
 
-from .utils.images import fetch_image, read_upload, resize_keep_ratio
-from .utils.quantize import map_palette_lab, HAS_NUMPY
-from .utils.chart import render_chart
-from .utils.encode import png_b64
-from .palette_dmc import DMC
+from .utils.images import fetch_bytes, upload_bytes, load_image, resize_keep_ratio, BadImage, ImageTooLarge, MAX_CELLS
+from .utils.fetch import FETCHER, FetchError, FetchTimeout, BadImageURL
+from .utils.quantize import HAS_NUMPY, COLOR_METRICS
+from .utils.dither import DITHER_MODES
+from .utils.pipeline import build_pattern, build_patterns, render_result
+from .utils.edit import edit_pattern, parse_edits
+from .utils.export import export_chart, EXPORT_FORMATS, PAPER, OVERLAP
+from .utils.chart import chart_size
+from .utils.encode import png_data_uri, encode_labels, decode_labels, LABEL_FORMATS, PNG_MODE, PNG_LEVEL
+from .utils.cache import RESULT_CACHE, result_key, labels_key
+from .utils.workers import POOL, PoolBusy, JobTimeout
+from .utils.admission import ADMISSION, Overloaded, image_cost
+from .utils.jobs import JOBS, JOBS_ENABLED, Job, QueueFull
+from .utils.lut import get_lut
+from .utils.palettes import DEFAULT_PALETTE, UnknownPalette, get_palette, palette_names, parse_threads
+from .utils.metrics import (METRICS, REQUESTS, ERRORS, REQUEST_SECONDS, CACHE_LOOKUPS, BYTES_IN, BYTES_OUT,
+                            StageTimer, stage, timed_call, observe_stages)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    await JOBS.stop()
+    POOL.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+BATCH_MAX_ITEMS = int(os.environ.get("CROSS_STITCH_BATCH_MAX_ITEMS", 24))
+
+async def _count_out(body, route: str):
+    n = 0
+    try:
+        async for chunk in body:
+            n += len(chunk)
+            yield chunk
+    finally:
+        # also when the client goes away mid-stream: what was sent is counted
+        BYTES_OUT.inc(route, amount=n)
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # templated path, so per-result URLs share one series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUESTS.inc(route, request.method, status)
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, route)
+        if status >= 400:
+            ERRORS.inc(route, status)
+        BYTES_IN.inc(route, amount=int(request.headers.get("content-length") or 0))
+    # counted as the body goes out, so streamed responses (NDJSON, SSE, exports) are included
+    response.body_iterator = _count_out(response.body_iterator, route)
+    return response
+
+def _key(img, max_size: int, opts: Dict) -> str:
+    # the palette (or subset) enters the key through its version
+    params = {k: v for k, v in opts.items() if k not in ("palette", "threads")}
+    pal = get_palette(opts.get("palette"), opts.get("threads"))
+    return result_key(img, palette_version=pal.version, max_size=max_size, png=(PNG_MODE, PNG_LEVEL), **params)
+
+def _read(source, sizes: List[int]):
+    """Raw bytes of an upload, URL or bytes, and their (decode, render) memory
+    estimate from the header alone."""
+    if isinstance(source, bytes):
+        data = source
+    else:
+        data = fetch_bytes(source) if isinstance(source, str) else upload_bytes(source)
+    with stage("probe"):
+        return data, image_cost(data, sizes)
+
+def _load(data: bytes, max_size: int, opts: Dict):
+    img = load_image(data, max_size)
+    with stage("resize"):
+        img = resize_keep_ratio(img, max_size)
+    with stage("key"):
+        return img, _key(img, max_size, opts)
+
+def _format_error(labels_format: str, chart: str, opts: Dict) -> Optional[JSONResponse]:
+    try:
+        pal = get_palette(opts.get("palette"), opts.get("threads"))
+    except UnknownPalette as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    max_colors = opts.get("max_colors")
+    if max_colors is not None and not 1 <= max_colors <= len(pal):
+        return JSONResponse({"error": f"max_colors must be between 1 and {len(pal)}."}, status_code=400)
+    if opts.get("metric", "cie76") not in COLOR_METRICS:
+        return JSONResponse({"error": f"metric must be one of {', '.join(COLOR_METRICS)}."}, status_code=400)
+    if opts.get("dither", "none") not in DITHER_MODES:
+        return JSONResponse({"error": f"dither must be one of {', '.join(DITHER_MODES)}."}, status_code=400)
+    if opts.get("dither", "none") != "none" and not HAS_NUMPY:
+        return JSONResponse({"error": "dithering requires NumPy on the server."}, status_code=400)
+    if labels_format not in LABEL_FORMATS:
+        return JSONResponse({"error": f"labels_format must be one of {', '.join(LABEL_FORMATS)}."}, status_code=400)
+    if chart not in ("inline", "url"):
+        return JSONResponse({"error": "chart must be 'inline' or 'url'."}, status_code=400)
+    return None
+
+def _body(key: str, result: Dict, labels_format: str, chart: str) -> Dict:
+    body = {
+        "result_id": key,
+        "width": result["width"],
+        "height": result["height"],
+        "palette_used": result["palette_used"],   # includes stable "idx"
+        "labels": encode_labels(result["labels"], labels_format),  # HxW palette indices
+    }
+    body["chart_width"], body["chart_height"] = chart_size(result["width"], result["height"],
+                                                           len(result["palette_used"]))
+    if chart == "url":
+        body["chart_url"] = f"/api/cross_stitch/chart/{key}.png"
+    else:
+        body["image_png_base64"] = png_data_uri(result["png"])
+    return body
+
+def _error_status(e: Exception) -> int:
+    if isinstance(e, ImageTooLarge):
+        return 413
+    if isinstance(e, (BadImage, BadImageURL)):
+        return 400
+    if isinstance(e, FetchTimeout):
+        return 504
+    if isinstance(e, FetchError):
+        return 502
+    if isinstance(e, Overloaded):
+        return e.status
+    if isinstance(e, QueueFull):
+        return 429
+    if isinstance(e, PoolBusy):
+        return 503
+    if isinstance(e, JobTimeout):
+        return 504
+    return 500
+
+def _error(e: Exception) -> JSONResponse:
+    resp = JSONResponse({"error": str(e)}, status_code=_error_status(e))
+    if isinstance(e, (Overloaded, PoolBusy, QueueFull)):
+        retry = e.retry_after if isinstance(e, Overloaded) else ADMISSION.retry_after()
+        resp.headers["Retry-After"] = str(retry)
+    return resp
+
+async def _admit(timer: StageTimer, cost: int, patient: bool = False):
+    """Admission ticket; a patient caller (a background job) waits out overload instead of failing."""
+    with timer.time("admit"):
+        while True:
+            try:
+                return await ADMISSION.acquire(cost, POOL.timeout if patient else None)
+            except Overloaded as e:
+                if not patient:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+async def _timed_job(timer: StageTimer, fn, *args):
+    """Run fn on the pool with its stage marks merged into timer; queueing shows up as "wait"."""
+    t0 = time.perf_counter()
+    # stage hooks cannot cross into a process pool; there they fire once the job is back
+    live = timer.on_stage if POOL.kind == "thread" else None
+    result, durations = await POOL.run(partial(timed_call, fn, on_stage=live), *args)
+    if timer.on_stage is not None and live is None:
+        for name in durations:
+            timer.on_stage(name)
+    timer.merge(durations)
+    timer.add("wait", max(0.0, time.perf_counter() - t0 - sum(durations.values())))
+    return result
+
+async def _cache_get(key: str) -> Optional[Dict]:
+    # a memory miss falls through to the disk tier: file reads, so off the event loop
+    if RESULT_CACHE.disk_dir is None:
+        return RESULT_CACHE.get(key)
+    return await asyncio.to_thread(RESULT_CACHE.get, key)
+
+async def _cache_put(key: str, entry: Dict) -> None:
+    if RESULT_CACHE.disk_dir is None:
+        RESULT_CACHE.put(key, entry)
+    else:
+        await asyncio.to_thread(RESULT_CACHE.put, key, entry)
+
+async def _cached(timer: StageTimer, key: str) -> Optional[Dict]:
+    with timer.time("cache"):
+        result = await _cache_get(key)
+    CACHE_LOOKUPS.inc("miss" if result is None else "hit")
+    return result
+
+def _timed_json(timer: StageTimer, body: Dict) -> JSONResponse:
+    with timer.time("json"):
+        resp = JSONResponse(body)
+    observe_stages(timer.durations)
+    resp.headers["Server-Timing"] = timer.header()
+    return resp
+
+def _palettes() -> List[Dict]:
+    out = []
+    for name in palette_names():
+        try:
+            out.append(get_palette(name).describe())
+        except ValueError:
+            # a broken palette file should not take the status route down
+            continue
+    return out
+
+def _opts(max_colors: Optional[int], dither: str, palette: str, threads: Optional[str], metric: str) -> Dict:
+    return {"max_colors": max_colors, "dither": dither.lower(), "palette": palette.lower(),
+            "threads": parse_threads(threads), "metric": metric.lower()}
 
 @app.get("/api/cross_stitch")
 def status():
-    return {"ok": True, "numpy": HAS_NUMPY, "palette_len": len(DMC)}
+    lut = get_lut()
+    return {"ok": True, "numpy": HAS_NUMPY, "palette_len": len(get_palette()), "lut_bits": lut.bits if lut else None,
+            "max_cells": MAX_CELLS, "palettes": _palettes(),
+            "cache": RESULT_CACHE.stats(), "pool": POOL.stats(), "admission": ADMISSION.stats(),
+            "jobs": JOBS.stats(), "fetch": FETCHER.stats()}
 
 @app.post("/api/cross_stitch")
 async def cross_stitch(
     image_url: Optional[str] = Form(default=None),
     max_size: int = Form(default=100),
     image: Optional[UploadFile] = File(default=None),
+    labels_format: str = Form(default="json"),
+    chart: str = Form(default="inline"),
+    max_colors: Optional[int] = Form(default=None),
+    dither: str = Form(default="none"),
+    palette: str = Form(default=DEFAULT_PALETTE),
+    threads: Optional[str] = Form(default=None),
+    metric: str = Form(default="cie76"),
 ):
+    """`palette` names a thread brand (see GET /api/cross_stitch); `threads`
+    limits it to the listed thread codes, e.g. the ones the stitcher owns.
+    `metric` is the colour difference used to match threads: cie76 (fast) or
+    ciede2000 (closer to perceived difference, notably for blues and skin tones)."""
+    opts = _opts(max_colors, dither, palette, threads, metric)
+    timer = StageTimer()
     try:
         if not image_url and not image:
             return JSONResponse({"error": "Provide image_url or file upload 'image'."}, status_code=400)
+        bad = _format_error(labels_format, chart, opts)
+        if bad is not None:
+            return bad
 
-        img = read_upload(image) if image is not None else fetch_image(image_url)
-        img = resize_keep_ratio(img, max_size)
+        # blocking I/O and decode on a helper thread, CPU pipeline on the worker pool;
+        # nothing large is allocated until the request is admitted
+        (data, cost), durations = await asyncio.to_thread(timed_call, _read, image if image is not None else image_url, [max_size])
+        timer.merge(durations)
+        ticket = await _admit(timer, sum(cost))
+        try:
+            (img, key), durations = await asyncio.to_thread(timed_call, _load, data, max_size, opts)
+            timer.merge(durations)
+            del data
+            result = await _cached(timer, key)
+            if result is None:
+                result = await _timed_job(timer, partial(build_pattern, **opts), img)
+                await _cache_put(key, result)
+        finally:
+            ADMISSION.release(ticket)
+
+        return _timed_json(timer, _body(key, result, labels_format, chart))
+    except (BadImage, ImageTooLarge, FetchError, Overloaded, PoolBusy, JobTimeout) as e:
+        return _error(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e), "trace": traceback.format_exc()}, status_code=500)
+
+def _variants(data: bytes, sizes: List[int], opts: Dict):
+    """Decode once at the largest requested size and derive every size from that base."""
+    base = load_image(data, max(sizes))
+    out = []
+    for s in sizes:
+        with stage("resize"):
+            img = resize_keep_ratio(base, s)
+        with stage("key"):
+            out.append((s, img, _key(img, s, opts)))
+    return out
+
+async def _build_all(variants, opts: Dict, timer: StageTimer) -> Dict[str, Dict]:
+    """Results by key; cache misses across all variants go to the pool as one job."""
+    results: Dict[str, Dict] = {}
+    todo: Dict[str, object] = {}
+    for _, img, key in variants:
+        if key in results or key in todo:
+            continue
+        hit = await _cached(timer, key)
+        if hit is None:
+            todo[key] = img
+        else:
+            results[key] = hit
+    if todo:
+        built = await _timed_job(timer, partial(build_patterns, **opts), list(todo.values()))
+        for key, result in zip(todo, built):
+            await _cache_put(key, result)
+            results[key] = result
+    return results
+
+def _items(i: int, variants, results: Dict[str, Dict], labels_format: str, chart: str) -> List[Dict]:
+    return [{"image": i, "max_size": s, **_body(key, results[key], labels_format, chart)}
+            for s, _, key in variants]
+
+def _failed(i: int, e: Exception, sizes: List[int]) -> List[Dict]:
+    return [{"image": i, "max_size": s, "error": str(e), "status": _error_status(e)} for s in sizes]
+
+async def _read_all(sources: List, sizes: List[int], timer: StageTimer, patient: bool = False):
+    """Read every source and admit them as one request: every source may be decoded
+    at once, and their builds share one job, so only the largest render counts.
+    Returns the reads (bytes and cost, or the exception) and the admission ticket."""
+    async def read(source):
+        out, durations = await asyncio.to_thread(timed_call, _read, source, sizes, on_stage=timer.on_stage)
+        timer.merge(durations)
+        return out
+
+    reads = await asyncio.gather(*[read(src) for src in sources], return_exceptions=True)
+    costs = [r[1] for r in reads if not isinstance(r, BaseException)]
+    ticket = await _admit(timer, sum(d for d, _ in costs) + max((r for _, r in costs), default=0), patient)
+    return reads, ticket
+
+async def _load_variants(read, sizes: List[int], opts: Dict, timer: StageTimer):
+    if isinstance(read, BaseException):
+        raise read
+    variants, durations = await asyncio.to_thread(timed_call, _variants, read[0], sizes, opts,
+                                                  on_stage=timer.on_stage)
+    timer.merge(durations)
+    return variants
+
+async def _generate(sources: List, sizes: List[int], opts: Dict, labels_format: str, chart: str,
+                    timer: StageTimer, patient: bool = False) -> List[Dict]:
+    """Batch results in request order: one item per source and size, failed sources as error items."""
+    reads, ticket = await _read_all(sources, sizes, timer, patient)
+    try:
+        loaded = await asyncio.gather(*[_load_variants(r, sizes, opts, timer) for r in reads],
+                                      return_exceptions=True)
+        del reads
+        ok = [v for v in loaded if not isinstance(v, BaseException)]
+        results = await _build_all([v for variants in ok for v in variants], opts, timer)
+    finally:
+        ADMISSION.release(ticket)
+    out: List[Dict] = []
+    for i, v in enumerate(loaded):
+        out += _failed(i, v, sizes) if isinstance(v, BaseException) else _items(i, v, results, labels_format, chart)
+    return out
+
+class _AdmittedStream(StreamingResponse):
+    """Streaming response that holds an admission ticket until it ends.
 
-        qimg, legend, labels = map_palette_lab(img)
-        chart = render_chart(qimg, legend)
-        w_cells, h_cells = qimg.size
-        labels_out = labels.tolist() if HAS_NUMPY else labels
-
-        return JSONResponse({
-            "width": w_cells,
-            "height": h_cells,
-            "palette_used": legend,      # includes stable "idx"
-            "labels": labels_out,        # HxW DMC indices
-            "image_png_base64": png_b64(chart),
-        })
+    A generator's own finally runs late when the client disconnects (at
+    garbage collection), so the ticket is released here, around the whole
+    response, and the generator is closed along with it.
+    """
+    def __init__(self, ticket, content, **kw):
+        super().__init__(content, **kw)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                ADMISSION.release(self.ticket)
+
+def _parse_sizes(sizes: List[str]) -> List[int]:
+    return [int(p) for s in sizes for p in str(s).split(",") if p.strip()]
+
+@app.post("/api/cross_stitch/batch")
+async def cross_stitch_batch(
+    images: Optional[List[UploadFile]] = File(default=None),
+    image_urls: Optional[List[str]] = Form(default=None),
+    sizes: List[str] = Form(default=["100"]),
+    labels_format: str = Form(default="json"),
+    chart: str = Form(default="inline"),
+    stream: bool = Form(default=False),
+    max_colors: Optional[int] = Form(default=None),
+    dither: str = Form(default="none"),
+    palette: str = Form(default=DEFAULT_PALETTE),
+    threads: Optional[str] = Form(default=None),
+    metric: str = Form(default="cie76"),
+):
+    """Several images and/or max_size values in one request.
+
+    Results come back as {"results": [...]} in request order, or with
+    stream=true as NDJSON lines in completion order, one image at a time.
+    """
+    opts = _opts(max_colors, dither, palette, threads, metric)
+    sources = list(images or []) + [u for u in image_urls or [] if u]
+    try:
+        size_list = _parse_sizes(sizes)
+    except ValueError:
+        return JSONResponse({"error": "sizes must be integers."}, status_code=400)
+    if not sources or not size_list:
+        return JSONResponse({"error": "Provide at least one image or image_urls entry and one size."}, status_code=400)
+    if len(sources) * len(size_list) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"A batch may contain at most {BATCH_MAX_ITEMS} image/size pairs."}, status_code=413)
+    bad = _format_error(labels_format, chart, opts)
+    if bad is not None:
+        return bad
+
+    timer = StageTimer()
+    try:
+        if stream:
+            reads, ticket = await _read_all(sources, size_list, timer)
+        else:
+            results = await _generate(sources, size_list, opts, labels_format, chart, timer)
+            return _timed_json(timer, {"results": results})
+    except (Overloaded, PoolBusy, JobTimeout) as e:
+        return _error(e)
     except Exception as e:
         return JSONResponse({"error": str(e), "trace": traceback.format_exc()}, status_code=500)
 
+    async def one(i: int, r):
+        try:
+            variants = await _load_variants(r, size_list, opts, timer)
+            return _items(i, variants, await _build_all(variants, opts, timer), labels_format, chart)
+        except Exception as e:
+            return _failed(i, e, size_list)
+
+    async def lines():
+        tasks = [asyncio.ensure_future(one(i, r)) for i, r in enumerate(reads)]
+        try:
+            for done in asyncio.as_completed(tasks):
+                for item in await done:
+                    yield json.dumps(item) + "\n"
+        finally:
+            for t in tasks:
+                t.cancel()
+        # headers are gone by now; stage timings still reach the histograms
+        observe_stages(timer.durations)
+
+    return _AdmittedStream(ticket, lines(), media_type="application/x-ndjson")
+
+JOBS.status_for = _error_status
+
+@JOBS.handler("pattern")
+async def _pattern_job(job: Job, payload: Dict) -> Dict:
+    timer = StageTimer(job.on_stage)
+    results = await _generate(payload["sources"], payload["sizes"], payload["opts"], payload["labels_format"],
+                              payload["chart"], timer, patient=True)
+    observe_stages(timer.durations)
+    return {"results": results}
+
+def _job_urls(job_id: str) -> Dict:
+    return {"status_url": f"/api/cross_stitch/jobs/{job_id}", "events_url": f"/api/cross_stitch/jobs/{job_id}/events"}
+
+@app.post("/api/cross_stitch/jobs", status_code=202)
+async def submit_job(
+    images: Optional[List[UploadFile]] = File(default=None),
+    image_urls: Optional[List[str]] = Form(default=None),
+    sizes: List[str] = Form(default=["100"]),
+    labels_format: str = Form(default="json"),
+    chart: str = Form(default="url"),
+    max_colors: Optional[int] = Form(default=None),
+    dither: str = Form(default="none"),
+    palette: str = Form(default=DEFAULT_PALETTE),
+    threads: Optional[str] = Form(default=None),
+    metric: str = Form(default="cie76"),
+):
+    """Queue a batch (same fields as /batch) and return its job id at once.
+
+    Follow it with GET /api/cross_stitch/jobs/{id}/events (Server-Sent
+    Events: queued, started, stage, then done or failed) or poll
+    GET /api/cross_stitch/jobs/{id}; a finished job's status carries the
+    batch body as `result`. Uploads are read now, URLs fetched by the job.
+    Off (404) unless CROSS_STITCH_JOBS is enabled, see utils/jobs.py.
+    """
+    if not JOBS_ENABLED:
+        return JSONResponse({"error": "Background jobs are not enabled on this server."}, status_code=404)
+    opts = _opts(max_colors, dither, palette, threads, metric)
+    try:
+        size_list = _parse_sizes(sizes)
+    except ValueError:
+        return JSONResponse({"error": "sizes must be integers."}, status_code=400)
+    urls = [u for u in image_urls or [] if u]
+    if not (images or urls) or not size_list:
+        return JSONResponse({"error": "Provide at least one image or image_urls entry and one size."}, status_code=400)
+    if (len(images or []) + len(urls)) * len(size_list) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"A job may contain at most {BATCH_MAX_ITEMS} image/size pairs."}, status_code=413)
+    bad = _format_error(labels_format, chart, opts)
+    if bad is not None:
+        return bad
+    try:
+        uploads = [await asyncio.to_thread(upload_bytes, f) for f in images or []]
+        job = JOBS.submit("pattern", {"sources": uploads + urls, "sizes": size_list, "opts": opts,
+                                      "labels_format": labels_format, "chart": chart})
+    except (ImageTooLarge, QueueFull) as e:
+        return _error(e)
+    body = {"job_id": job.id, "status": job.status, "position": JOBS.position(job), **_job_urls(job.id)}
+    return JSONResponse(body, status_code=202, headers={"Location": body["status_url"]})
+
+@app.get("/api/cross_stitch/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = JOBS.store.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown or expired job."}, status_code=404)
+    return {**job.describe(JOBS.position(job)), **_job_urls(job_id)}
+
+def _sse(event) -> str:
+    if event is None:
+        return ": keep-alive\n\n"
+    n, name, data = event
+    return f"id: {n}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/api/cross_stitch/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Progress as Server-Sent Events; a reconnect with Last-Event-ID resumes after that event."""
+    job = JOBS.store.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown or expired job."}, status_code=404)
+    try:
+        after = int(request.headers.get("last-event-id", -1))
+    except ValueError:
+        after = -1
+
+    async def events():
+        async for event in job.follow(after):
+            yield _sse(event)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _parse_labels(raw: str, shape):
+    with stage("labels"):
+        return decode_labels(json.loads(raw), shape)
+
+@app.post("/api/cross_stitch/edit")
+async def cross_stitch_edit(
+    result_id: str = Form(...),
+    edits: Optional[str] = Form(default=None),
+    labels: Optional[str] = Form(default=None),
+    labels_format: str = Form(default="json"),
+    chart: str = Form(default="url"),
+):
+    """Apply editor changes to a previous result.
+
+    `edits` is a JSON list of [x, y, idx] (or {"x", "y", "idx"}) cell changes;
+    `labels` a whole replacement grid, as JSON rows or an encoded labels object.
+    The response describes the new result like POST /api/cross_stitch and adds
+    `tiles`: PNG patches ({x, y, width, height, png}, chart pixels) to paste
+    over the previous chart, legend rows last; `tiles` is null when the
+    chart was re-rendered as a whole, which it is whenever the legend gained
+    or lost rows (`chart_height` then differs from the previous chart's).
+    """
+    timer = StageTimer()
+    try:
+        bad = _format_error(labels_format, chart, {})
+        if bad is not None:
+            return bad
+        if (edits is None) == (labels is None):
+            return JSONResponse({"error": "Provide exactly one of edits or labels."}, status_code=400)
+        base = await _cached(timer, result_id)
+        if base is None:
+            return JSONResponse({"error": "Unknown or expired result."}, status_code=404)
+        try:
+            cells = parse_edits(edits) if edits is not None else None
+            # sized by the base result, not by the client; off the event loop
+            grid = await asyncio.to_thread(_parse_labels, labels, (base["height"], base["width"])) \
+                if labels is not None else None
+        except (ValueError, KeyError, TypeError) as e:
+            return JSONResponse({"error": f"Invalid edit: {e}"}, status_code=400)
+
+        try:
+            entry, patches = await _timed_job(timer, partial(edit_pattern, png_mode=PNG_MODE, png_level=PNG_LEVEL),
+                                              base, cells, grid)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        version = get_palette(entry.get("palette")).version
+        key = result_id if patches == [] else labels_key(entry["labels"], entry["palette_used"], version,
+                                                         png=(PNG_MODE, PNG_LEVEL))
+        if chart == "inline" and entry["png"] is None:
+            entry = await _timed_job(timer, partial(render_result, png_mode=PNG_MODE, png_level=PNG_LEVEL), entry)
+        await _cache_put(key, entry)
+
+        body = _body(key, entry, labels_format, chart)
+        body["tiles"] = None if patches is None else [{**p, "png": png_data_uri(p["png"])} for p in patches]
+        return _timed_json(timer, body)
+    except (PoolBusy, JobTimeout) as e:
+        return _error(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e), "trace": traceback.format_exc()}, status_code=500)
+
+@app.get("/api/cross_stitch/metrics")
+def metrics():
+    cache, pool, admission, jobs = RESULT_CACHE.stats(), POOL.stats(), ADMISSION.stats(), JOBS.stats()
+    gauges = {
+        "cross_stitch_cache_entries": ("Results held in the in-memory cache.", cache["entries"]),
+        "cross_stitch_cache_bytes": ("Approximate size of the in-memory cache.", cache["bytes"]),
+        "cross_stitch_pool_inflight": ("Jobs running or queued on the worker pool.", pool["inflight"]),
+        "cross_stitch_pool_rejected": ("Jobs turned away because the pool queue was full.", pool["rejected"]),
+        "cross_stitch_pool_timeouts": ("Jobs whose caller stopped waiting.", pool["timeouts"]),
+        "cross_stitch_admission_active": ("Requests admitted and generating.", admission["active"]),
+        "cross_stitch_admission_queued": ("Requests waiting for admission.", admission["queued"]),
+        "cross_stitch_admission_memory_bytes": ("Estimated memory held by admitted requests.", admission["memory_used"]),
+        "cross_stitch_admission_rejected": ("Requests turned away with 429 or 503.",
+                                            admission["rejected_full"] + admission["rejected_wait"]),
+        "cross_stitch_jobs_queued": ("Background jobs waiting to run.", jobs["queued"]),
+        "cross_stitch_jobs_running": ("Background jobs running.", jobs["running"]),
+    }
+    return Response(METRICS.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/cross_stitch/chart/{result_id}.png")
+async def chart_png(result_id: str):
+    result = await _cache_get(result_id)
+    if result is None:
+        return JSONResponse({"error": "Unknown or expired result."}, status_code=404)
+    if result["png"] is None:
+        # edited result: the full chart is rendered on first request
+        try:
+            result = await POOL.run(partial(render_result, png_mode=PNG_MODE, png_level=PNG_LEVEL), result)
+        except (PoolBusy, JobTimeout) as e:
+            return _error(e)
+        await _cache_put(result_id, result)
+    # content-addressed, so the bytes behind a URL never change
+    return Response(result["png"], media_type="image/png", headers={
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{result_id}"',
+    })
+
+@app.get("/api/cross_stitch/export/{result_id}.{fmt}")
+def export(result_id: str, fmt: str, paper: str = "a4", overlap: int = OVERLAP):
+    """Vector chart for a result: .svg, or a .pdf split into printable pages."""
+    if fmt not in EXPORT_FORMATS:
+        return JSONResponse({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}."}, status_code=400)
+    if paper not in PAPER:
+        return JSONResponse({"error": f"paper must be one of {', '.join(PAPER)}."}, status_code=400)
+    if not 0 <= overlap <= 10:
+        return JSONResponse({"error": "overlap must be between 0 and 10 cells."}, status_code=400)
+    result = RESULT_CACHE.get(result_id)
+    if result is None:
+        return JSONResponse({"error": "Unknown or expired result."}, status_code=404)
+    kw = {"paper": paper, "overlap": overlap} if fmt == "pdf" else {}
+    media = {"svg": "image/svg+xml", "pdf": "application/pdf"}[fmt]
+    # written as it is generated; the full chart is never held in memory
+    return StreamingResponse(export_chart(result, fmt, **kw), media_type=media, headers={
+        "Content-Disposition": f'attachment; filename="pattern-{result_id[:12]}.{fmt}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    })
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("api.cross_stitch:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,12 +1,7 @@
 # api/palette_dmc.py
+import hashlib
 from typing import List, Dict
 
-try:
-    import numpy as np
-    HAS_NUMPY = True
-except Exception:
-    HAS_NUMPY = False
-
 # ---- DMC palette (paste your big list here) ----
 DMC: List[Dict] = [
     {"code": "Ecru", "name": "Ecru", "r": 240, "g": 234, "b": 218},
@@ -465,7 +460,24 @@ DMC: List[Dict] = [
     {"code": "3866", "name": "Mocha Brn Ult Vy Lt", "r": 250, "g": 246, "b": 240},
 ]
 
-# Precompute an RGB array when NumPy is available (handy for fast quantization)
-PALETTE_RGB = None
-if HAS_NUMPY:
-    PALETTE_RGB = np.array([[c["r"], c["g"], c["b"]] for c in DMC], dtype=np.float32)
+def __getattr__(name: str):
+    # PALETTE_RGB is built on first access so importing the palette stays cheap;
+    # the pipeline itself uses the prebuilt arrays in api.utils.palette
+    if name == "PALETTE_RGB":
+        global PALETTE_RGB
+        try:
+            import numpy as np
+            PALETTE_RGB = np.array([[c["r"], c["g"], c["b"]] for c in DMC], dtype=np.float32)
+        except Exception:
+            PALETTE_RGB = None
+        return PALETTE_RGB
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def palette_checksum(palette: List[Dict]) -> str:
+    """Stable digest of a palette's contents and order (used to detect stale artifacts)."""
+    h = hashlib.sha256()
+    for c in palette:
+        h.update(f'{c["code"]}\t{c["name"]}\t{c["r"]},{c["g"]},{c["b"]}\n'.encode("utf-8"))
+    return h.hexdigest()
+
+PALETTE_VERSION = palette_checksum(DMC)
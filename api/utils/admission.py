@@ -0,0 +1,130 @@
+# api/utils/admission.py
+"""Admission control for pattern generation, per server process.
+
+A request is admitted while fewer than ADMIT_CONCURRENCY are running and
+its estimated peak memory (decode plus render, see images.decode_cost and
+pipeline.render_cost) fits in what is left of ADMIT_MEMORY. Otherwise it
+waits in a short FIFO queue; the queue is strict, so a large request at
+the head is not starved by small ones behind it. A full queue answers
+429 at once, a wait longer than ADMIT_WAIT seconds 503, both with a
+Retry-After derived from recent hold times.
+
+CROSS_STITCH_ADMIT_CONCURRENCY  requests generating at once (default 2 x workers)
+CROSS_STITCH_ADMIT_MEMORY       estimated bytes they may use together (default 1 GB)
+CROSS_STITCH_ADMIT_QUEUE        requests allowed to wait (default 4 x workers)
+CROSS_STITCH_ADMIT_WAIT         seconds a request may wait (default 2)
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Optional, Sequence, Tuple
+
+from .images import ImageTooLarge, decode_cost, fit_size, probe
+from .pipeline import render_cost
+from .workers import WORKERS
+
+ADMIT_CONCURRENCY = int(os.environ.get("CROSS_STITCH_ADMIT_CONCURRENCY", 2 * WORKERS))
+ADMIT_MEMORY = int(os.environ.get("CROSS_STITCH_ADMIT_MEMORY", 1 << 30))
+ADMIT_QUEUE = int(os.environ.get("CROSS_STITCH_ADMIT_QUEUE", 4 * WORKERS))
+ADMIT_WAIT = float(os.environ.get("CROSS_STITCH_ADMIT_WAIT", 2))
+
+class Overloaded(RuntimeError):
+    def __init__(self, message: str, status: int, retry_after: int):
+        super().__init__(message)
+        self.status, self.retry_after = status, retry_after
+
+def image_cost(data: bytes, sizes: Sequence[int]) -> Tuple[int, int]:
+    """(decode, render) peak bytes for building `data` at each of `sizes`.
+
+    The sizes of one image are built one after another in a single job, so
+    render is the largest of them, not the sum.
+    """
+    try:
+        w, h, fmt = probe(data)
+    except ImageTooLarge:
+        raise
+    except Exception:
+        return 0, 0  # not an image; decoding fails straight away
+    return decode_cost(w, h, fmt, max(sizes)), max(render_cost(*fit_size(w, h, s)) for s in sizes)
+
+class Admission:
+    def __init__(self, concurrency: int = ADMIT_CONCURRENCY, memory: int = ADMIT_MEMORY,
+                 queue_size: int = ADMIT_QUEUE, wait: float = ADMIT_WAIT):
+        self.concurrency = max(1, concurrency)
+        self.memory = max(1, memory)
+        self.queue_size = max(0, queue_size)
+        self.wait = wait
+        # only touched from the event loop
+        self._waiters: "deque[list]" = deque()
+        self.active = self.used = 0
+        self.admitted = self.rejected_full = self.rejected_wait = 0
+        self._hold = 1.0  # EWMA of seconds between acquire and release
+
+    def _fits(self, cost: int) -> bool:
+        return self.active < self.concurrency and self.used + cost <= self.memory
+
+    def _grant(self, cost: int) -> Tuple[int, float]:
+        self.active += 1
+        self.used += cost
+        self.admitted += 1
+        return cost, time.monotonic()
+
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(self._grant(cost))
+
+    def retry_after(self) -> int:
+        """Seconds until a request would likely get in: the queue ahead of it drained at the recent pace."""
+        backlog = len(self._waiters) + self.active + 1
+        return min(60, max(1, math.ceil(self._hold * backlog / self.concurrency)))
+
+    async def acquire(self, cost: int, wait: Optional[float] = None) -> Tuple[int, float]:
+        """Ticket for release(); raises Overloaded when the queue is full or the wait
+        (default ADMIT_WAIT) runs out."""
+        # larger than the whole budget: admitted only when running alone
+        cost = min(max(0, int(cost)), self.memory)
+        if not self._waiters and self._fits(cost):
+            return self._grant(cost)
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_full += 1
+            raise Overloaded("Server busy, try again shortly.", 429, self.retry_after())
+        fut = asyncio.get_running_loop().create_future()
+        entry = [cost, fut]
+        self._waiters.append(entry)
+        try:
+            return await asyncio.wait_for(fut, self.wait if wait is None else wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # granted just as the wait ended
+                if isinstance(e, asyncio.TimeoutError):
+                    return fut.result()
+                self.release(fut.result())
+                raise
+            try:
+                self._waiters.remove(entry)
+            except ValueError:
+                pass
+            self._wake()  # a big request leaving the head may let smaller ones in
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected_wait += 1
+            raise Overloaded("Server busy, timed out waiting for capacity.", 503, self.retry_after()) from None
+
+    def release(self, ticket: Tuple[int, float]) -> None:
+        cost, t0 = ticket
+        self.active -= 1
+        self.used -= cost
+        self._hold += 0.2 * (time.monotonic() - t0 - self._hold)
+        self._wake()
+
+    def stats(self) -> Dict:
+        return {"concurrency": self.concurrency, "memory": self.memory, "queue_size": self.queue_size,
+                "active": self.active, "memory_used": self.used, "queued": len(self._waiters),
+                "admitted": self.admitted, "rejected_full": self.rejected_full,
+                "rejected_wait": self.rejected_wait, "retry_after": self.retry_after()}
+
+ADMISSION = Admission()
@@ -0,0 +1,216 @@
+# api/utils/cache.py
+"""Content-addressed cache for finished patterns.
+
+Entries are keyed by the pixels the pipeline actually consumes plus every
+parameter that affects the result and the palette version. The in-process
+tier is an LRU bounded by bytes; the optional disk tier (CROSS_STITCH_CACHE_DIR)
+survives restarts, is shared by workers on the same host, and is kept under
+CROSS_STITCH_CACHE_DISK_BYTES by evicting the least recently read entries.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from PIL import Image
+
+from ..palette_dmc import PALETTE_VERSION
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
+
+CACHE_BYTES = int(os.environ.get("CROSS_STITCH_CACHE_BYTES", 64 << 20))
+CACHE_DIR = os.environ.get("CROSS_STITCH_CACHE_DIR") or None
+CACHE_DISK_BYTES = int(os.environ.get("CROSS_STITCH_CACHE_DISK_BYTES", 512 << 20))
+
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
+# a directory over its budget is pruned to this share of it, so the listing
+# is not repeated on every following write
+PRUNE_TO = 0.9
+
+def result_key(img: Image.Image, palette_version: str = PALETTE_VERSION, **params) -> str:
+    h = hashlib.sha256()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:{palette_version}:".encode("ascii"))
+    h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+def labels_key(labels, legend, palette_version: str = PALETTE_VERSION, **params) -> str:
+    """Key for a result defined by its grid and symbol assignment (edited patterns)."""
+    h = hashlib.sha256()
+    h.update(f"labels:{palette_version}:".encode("ascii"))
+    h.update(json.dumps([params, sorted((u["idx"], u["symbol"]) for u in legend)],
+                        sort_keys=True, default=str).encode("utf-8"))
+    if HAS_NUMPY and isinstance(labels, np.ndarray):
+        h.update(f"{labels.shape}".encode("ascii"))
+        h.update(labels.astype("<i4").tobytes())
+    else:
+        h.update(json.dumps(labels).encode("ascii"))
+    return h.hexdigest()
+
+def _labels_nbytes(labels) -> int:
+    if HAS_NUMPY and isinstance(labels, np.ndarray):
+        return int(labels.nbytes)
+    return 8 * sum(len(row) for row in labels)
+
+def entry_nbytes(entry: Dict) -> int:
+    return len(entry["png"] or b"") + _labels_nbytes(entry["labels"]) + 160 * len(entry["palette_used"]) + 256
+
+class DiskBudget:
+    """Byte budget of a cache directory, evicting least recently used files.
+
+    The directory is listed once; after that the total is kept from this
+    process's own writes, and only going over the budget lists it again (and
+    picks up what other processes wrote). Readers refresh a file's mtime on
+    every hit, so the oldest mtime is the least recently used.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.path, self.max_bytes = path, max_bytes
+        self._total: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def added(self, nbytes: int) -> None:
+        with self._lock:
+            if self._total is not None:
+                self._total += nbytes
+                if self._total <= self.max_bytes:
+                    return
+            self._total = self._prune()
+
+    def _prune(self) -> int:
+        files = []
+        for name in os.listdir(self.path):
+            p = os.path.join(self.path, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(f[1] for f in files)
+        if total <= self.max_bytes:
+            return total
+        for _, size, p in sorted(files):
+            if total <= self.max_bytes * PRUNE_TO:
+                break
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            total -= size
+        return total
+
+def touch(*paths: str) -> None:
+    for p in paths:
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+
+class ResultCache:
+    def __init__(self, max_bytes: int = CACHE_BYTES, disk_dir: Optional[str] = CACHE_DIR,
+                 disk_bytes: int = CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = 0
+        self._disk = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk = DiskBudget(disk_dir, disk_bytes)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return item[0]
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._mem_put(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Dict) -> None:
+        self._mem_put(key, entry)
+        self._disk_put(key, entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "disk_hits": self.disk_hits,
+                "entries": len(self._mem), "bytes": self._size, "max_bytes": self.max_bytes,
+                "disk": bool(self.disk_dir),
+            }
+
+    def _mem_put(self, key: str, entry: Dict) -> None:
+        n = entry_nbytes(entry)
+        if n > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._mem[key] = (entry, n)
+            self._size += n
+            while self._size > self.max_bytes:
+                _, (_, m) = self._mem.popitem(last=False)
+                self._size -= m
+
+    def _paths(self, key: str):
+        base = os.path.join(self.disk_dir, key)
+        return base + ".json", base + ".png"
+
+    def _disk_get(self, key: str) -> Optional[Dict]:
+        # keys also arrive from URLs; never let one name a path outside the cache
+        if not self.disk_dir or not _KEY_RE.fullmatch(key):
+            return None
+        meta_p, png_p = self._paths(key)
+        try:
+            with open(meta_p, "r", encoding="utf-8") as fh:
+                entry = json.load(fh)
+            with open(png_p, "rb") as fh:
+                entry["png"] = fh.read()
+        except (OSError, ValueError):
+            return None
+        touch(meta_p, png_p)
+        if HAS_NUMPY:
+            entry["labels"] = np.asarray(entry["labels"], dtype=np.int32)
+        return entry
+
+    def _disk_put(self, key: str, entry: Dict) -> None:
+        # entries whose chart is not rendered yet stay in memory until it is
+        if not self.disk_dir or entry["png"] is None:
+            return
+        meta_p, png_p = self._paths(key)
+        labels = entry["labels"]
+        meta = {k: v for k, v in entry.items() if k != "png"}
+        meta["labels"] = labels.tolist() if HAS_NUMPY and isinstance(labels, np.ndarray) else labels
+        try:
+            # png first: a readable .json implies a complete entry
+            written = 0
+            for path, data, mode in ((png_p, entry["png"], "wb"), (meta_p, json.dumps(meta), "w")):
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, mode) as fh:
+                    fh.write(data)
+                os.replace(tmp, path)
+                written += len(data)
+            self._disk.added(written)
+        except OSError:
+            pass
+
+RESULT_CACHE = ResultCache()
@@ -1,11 +1,21 @@
-from typing import Dict, Tuple, List
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, Tuple, List, Optional
 from PIL import Image, ImageDraw, ImageFont
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
+
+from .metrics import stage
 
 SYMBOLS = list("X/\\+-•◇△#=%@~<>¶✚✕❖✱")
 
 def _symbol(i: int) -> str:
     return SYMBOLS[i % len(SYMBOLS)]
 
+@lru_cache(maxsize=16)
 def _font(px: int) -> ImageFont.FreeTypeFont:
     try:
         return ImageFont.truetype("DejaVuSansMono.ttf", px)
@@ -16,6 +26,18 @@ def _tint(rgb: Tuple[int,int,int], amt: float = 0.22) -> Tuple[int,int,int]:
     r,g,b = rgb
     return (int(r+(255-r)*amt), int(g+(255-g)*amt), int(b+(255-b)*amt))
 
+GRID_THIN, GRID_BOLD = (200,200,200), (140,140,140)
+CELL, PAD = 20, 30
+TILE = 10  # cells per side of an edit tile, aligned with the bold grid lines
+
+def chart_colors(legend: List[Dict]) -> List[Tuple[int,int,int]]:
+    """Solid fills render_chart uses for this legend (kept exact by indexed PNG output)."""
+    cols = [(255,255,255), (0,0,0), (20,20,20), (120,120,120), GRID_THIN, GRID_BOLD]
+    for u in legend:
+        rgb = (u["r"], u["g"], u["b"])
+        cols += [rgb, _tint(rgb, 0.22)]
+    return cols
+
 def _measure(drw: ImageDraw.ImageDraw, text: str, font: ImageFont.ImageFont):
     try:
         l, t, r, b = drw.textbbox((0,0), text, font=font)
@@ -23,55 +45,241 @@ def _measure(drw: ImageDraw.ImageDraw, text: str, font: ImageFont.ImageFont):
         l, t, r, b = font.getbbox(text)
     return (r - l, b - t)
 
-def render_chart(quantized: Image.Image, legend: List[Dict]) -> Image.Image:
-    w, h = quantized.size
-    qpx = quantized.load()
-    for idx, item in enumerate(legend):
-        item["symbol"] = _symbol(idx)
+@lru_cache(maxsize=2048)
+def _glyph_tile(sym: str, rgb: Tuple[int,int,int], cell: int, font: ImageFont.ImageFont) -> Image.Image:
+    """One chart cell: tinted square with its symbol centred, as render_chart draws it.
 
-    rgb_to_sym = {(u["r"], u["g"], u["b"]): u["symbol"] for u in legend}
+    Cached across charts; callers must not draw on the returned tile.
+    """
+    tile = Image.new("RGB", (cell, cell), _tint(rgb, 0.22))
+    drw = ImageDraw.Draw(tile)
+    tw, th = _measure(drw, sym, font)
+    c = cell // 2
+    drw.text((c - tw/2, c - th/2 - 1), sym, fill=(0,0,0), font=font)
+    return tile
 
-    CELL, PAD = 20, 30
-    LEGEND_H = 48 + 22 * len(legend)
-    W = PAD*2 + w*CELL
-    H = PAD*2 + h*CELL + LEGEND_H
-    img = Image.new("RGB", (W, H), (255, 255, 255))
+@lru_cache(maxsize=4096)
+def _text_mask(text: str, px: int) -> Tuple[Image.Image, int, int, int]:
+    """Coverage mask of `text`, its offset from the drawing origin and its advance.
+
+    Legend labels repeat across charts (the same threads keep turning up), so
+    each is rasterized once and pasted after that.
+    """
+    font = _font(px)
+    l, t, r, b = font.getbbox(text)
+    mask = Image.new("L", (max(1, r - l), max(1, b - t)), 0)
+    ImageDraw.Draw(mask).text((-l, -t), text, fill=255, font=font)
+    return mask, l, t, round(font.getlength(text))
+
+def _paste_text(img: Image.Image, x: int, y: int, text: str, fill: Tuple[int,int,int], px: int = 16) -> int:
+    """Draw `text` at (x, y) like ImageDraw.text; returns its advance."""
+    mask, l, t, advance = _text_mask(text, px)
+    img.paste(fill, (x + l, y + t), mask)
+    return advance
+
+@lru_cache(maxsize=1024)
+def _legend_key(rgb: Tuple[int,int,int], sym: str) -> Image.Image:
+    """Colour swatch and symbol box that start a legend row; callers must not draw on it."""
+    img = Image.new("RGB", (45, 19), (255, 255, 255))
     drw = ImageDraw.Draw(img)
-    ftxt = _font(int(CELL*0.6))
+    drw.rectangle([0, 0, 18, 18], fill=rgb, outline=(120,120,120))
+    drw.rectangle([26, 0, 44, 18], fill=(255,255,255), outline=(120,120,120))
+    _paste_text(img, 30, 1, sym, (0,0,0))
+    return img
 
-    # squares
-    for y in range(h):
-        for x in range(w):
-            rgb = qpx[x, y]
-            x0, y0 = PAD + x*CELL, PAD + y*CELL
-            drw.rectangle([x0, y0, x0+CELL, y0+CELL], fill=_tint(rgb, 0.22))
+def _grid_np(quantized: Image.Image, rgb_to_sym: Dict, cell: int, font,
+             index: Optional[Callable] = None) -> "np.ndarray":
+    """Cell squares as an RGB array, or as palette indices when `index` maps colours to them."""
+    arr = np.asarray(quantized.convert("RGB"), dtype=np.uint8)
+    h, w, _ = arr.shape
+    packed = (arr[..., 0].astype(np.uint32) << 16) | (arr[..., 1].astype(np.uint32) << 8) | arr[..., 2]
+    keys, inv = np.unique(packed.reshape(-1), return_inverse=True)
+    atlas = np.empty((len(keys), cell, cell, 3), dtype=np.uint8)
+    for i, k in enumerate(keys.tolist()):
+        rgb = (k >> 16, (k >> 8) & 255, k & 255)
+        atlas[i] = np.asarray(_glyph_tile(rgb_to_sym.get(rgb, "X"), rgb, cell, font))
+    if index is not None:
+        atlas = index(atlas)
+    # one spare row/column for the closing grid lines
+    grid = np.empty((h*cell + 1, w*cell + 1) + atlas.shape[3:], dtype=np.uint8)
+    grid[:h*cell, :w*cell] = atlas[inv.reshape(h, w)].swapaxes(1, 2).reshape((h*cell, w*cell) + atlas.shape[3:])
+    return grid
 
-    # symbols
+def _grid_py(quantized: Image.Image, rgb_to_sym: Dict, cell: int, font) -> Image.Image:
+    w, h = quantized.size
+    qpx = quantized.load()
+    out = Image.new("RGB", (w*cell, h*cell))
+    tiles: Dict = {}
     for y in range(h):
         for x in range(w):
             rgb = qpx[x, y]
-            sym = rgb_to_sym.get(rgb, "X")
-            x0, y0 = PAD + x*CELL + CELL//2, PAD + y*CELL + CELL//2
-            tw, th = _measure(drw, sym, ftxt)
-            drw.text((x0 - tw/2, y0 - th/2 - 1), sym, fill=(0,0,0), font=ftxt)
+            tile = tiles.get(rgb)
+            if tile is None:
+                tile = tiles[rgb] = _glyph_tile(rgb_to_sym.get(rgb, "X"), rgb, cell, font)
+            out.paste(tile, (x*cell, y*cell))
+    return out
+
+def assign_symbols(legend: List[Dict]) -> None:
+    """Give every legend entry a symbol, keeping the ones it already has.
+
+    Fresh legends get symbols in legend order; entries added later (edits)
+    take the first symbol no other thread is using.
+    """
+    used = {u["symbol"] for u in legend if "symbol" in u}
+    for idx, item in enumerate(legend):
+        if "symbol" in item:
+            continue
+        if not used:
+            item["symbol"] = _symbol(idx)
+            continue
+        free = [s for s in SYMBOLS if s not in used]
+        item["symbol"] = free[0] if free else _symbol(idx)
+        used.add(item["symbol"])
+
+def _symbol_map(legend: List[Dict]) -> Dict:
+    return {(u["r"], u["g"], u["b"]): u["symbol"] for u in legend}
+
+def _cells(quantized: Image.Image, rgb_to_sym: Dict, x0: int = 0, y0: int = 0) -> Image.Image:
+    """Squares, symbols and grid lines for a block of cells whose top-left cell is
+    (x0, y0) in the full chart; includes the closing right/bottom lines."""
+    w, h = quantized.size
+    ftxt = _font(int(CELL*0.6))
+    # squares + symbols, each distinct cell rasterized once and tiled; grid lines as slices
+    thin, bold = GRID_THIN, GRID_BOLD
+    if HAS_NUMPY:
+        return Image.fromarray(_cells_np(quantized, rgb_to_sym, x0, y0))
+    out = Image.new("RGB", (w*CELL + 1, h*CELL + 1))
+    out.paste(_grid_py(quantized, rgb_to_sym, CELL, ftxt), (0, 0))
+    drw = ImageDraw.Draw(out)
+    for gx in range(w+1):
+        drw.line([(gx*CELL, 0), (gx*CELL, h*CELL)], fill=bold if (x0 + gx) % 10 == 0 else thin, width=1)
+    for gy in range(h+1):
+        drw.line([(0, gy*CELL), (w*CELL, gy*CELL)], fill=bold if (y0 + gy) % 10 == 0 else thin, width=1)
+    return out
 
-    # grid
-    thin, bold = (200,200,200), (140,140,140)
+def _cells_np(quantized: Image.Image, rgb_to_sym: Dict, x0: int = 0, y0: int = 0,
+              index: Optional[Callable] = None) -> "np.ndarray":
+    w, h = quantized.size
+    grid = _grid_np(quantized, rgb_to_sym, CELL, _font(int(CELL*0.6)), index)
+    thin, bold = GRID_THIN, GRID_BOLD
+    if index is not None:
+        thin, bold = index(np.array([thin, bold], dtype=np.uint8)).tolist()
     for gx in range(w+1):
-        X = PAD + gx*CELL
-        drw.line([(X, PAD), (X, PAD + h*CELL)], fill=bold if gx % 10 == 0 else thin, width=1)
+        grid[:, gx*CELL] = bold if (x0 + gx) % 10 == 0 else thin
     for gy in range(h+1):
-        Y = PAD + gy*CELL
-        drw.line([(PAD, Y), (PAD + w*CELL, Y)], fill=bold if gy % 10 == 0 else thin, width=1)
+        grid[gy*CELL, :] = bold if (y0 + gy) % 10 == 0 else thin
+    return grid
 
-    # legend
-    lx, ly = PAD, PAD + h*CELL + 24
-    drw.text((lx, ly-20), "Legend (DMC)", fill=(0,0,0), font=_font(16))
-    for i, u in enumerate(legend):
-        yline = ly + i*22
-        drw.rectangle([lx, yline, lx+18, yline+18], fill=(u["r"],u["g"],u["b"]), outline=(120,120,120))
-        sbx = lx + 26
-        drw.rectangle([sbx, yline, sbx+18, yline+18], fill=(255,255,255), outline=(120,120,120))
-        drw.text((sbx+4, yline+1), u["symbol"], fill=(0,0,0), font=_font(16))
-        drw.text((sbx+26, yline+2), f'{u["code"]} — {u["name"]}  ({u["count"]})', fill=(20,20,20), font=_font(16))
+def chart_size(w: int, h: int, n_legend: int) -> Tuple[int, int]:
+    return PAD*2 + w*CELL, PAD*2 + h*CELL + 48 + 22 * n_legend
+
+def render_tile(quantized: Image.Image, legend: List[Dict], x0: int, y0: int) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Chart pixels for the cells of `quantized` placed at cell (x0, y0); returns
+    the tile and its top-left pixel position in the full chart."""
+    return _cells(quantized, _symbol_map(legend), x0, y0), (PAD + x0*CELL, PAD + y0*CELL)
+
+LEGEND_ROW = 22
+
+def render_legend_rows(legend: List[Dict], w: int, h: int, start: int, stop: int) -> Tuple[Image.Image, int]:
+    """Legend rows [start, stop) of a w x h chart, blank past the end of the
+    legend and clipped to the chart; returns the band and its top pixel row."""
+    W, H = chart_size(w, h, len(legend))
+    ly = PAD + h*CELL + 24
+    top = ly + start*LEGEND_ROW
+    img = Image.new("RGB", (W, max(0, min(H, ly + stop*LEGEND_ROW) - top)), (255, 255, 255))
+    _draw_legend_rows(img, legend[start:stop], PAD, 0)
+    return img, top
+
+def chart_weights(legend: List[Dict]) -> Dict[Tuple[int, int, int], float]:
+    """Roughly how many chart pixels have each colour: the cell tiles times thread
+    counts, plus the legend drawn only as wide as its text."""
+    ftxt = _font(int(CELL*0.6))
+    out: Dict[Tuple[int, int, int], float] = {}
+    for u in legend:
+        rgb = (u["r"], u["g"], u["b"])
+        for n, c in _glyph_tile(u.get("symbol", "X"), rgb, CELL, ftxt).getcolors(CELL*CELL):
+            out[c] = out.get(c, 0.0) + n * u["count"]
+    f16 = _font(16)
+    width = PAD + 52 + max([int(f16.getlength(f'{u["code"]} — {u["name"]}  ({u["count"]})')) for u in legend] + [120])
+    img = Image.new("RGB", (width, 24 + LEGEND_ROW * len(legend)), (255, 255, 255))
+    _draw_legend(img, legend, PAD, 24)
+    for n, c in img.getcolors(img.size[0] * img.size[1]):
+        out[c] = out.get(c, 0.0) + n
+    return out
+
+def _band_array(img: Image.Image, index: Optional[Callable]):
+    if not HAS_NUMPY:
+        return img
+    arr = np.asarray(img)
+    return index(arr) if index is not None else arr
+
+def chart_bands(quantized: Image.Image, legend: List[Dict], index: Optional[Callable] = None,
+                budget: int = 8 << 20) -> Iterator:
+    """render_chart's image as horizontal bands, top to bottom, for charts too
+    large to hold whole; each band's cells are about `budget` bytes of RGB.
+
+    With NumPy the bands are uint8 arrays, RGB or (given `index`, which maps
+    colours to a palette) palette indices; without it they are RGB images.
+    """
+    w, h = quantized.size
+    assign_symbols(legend)
+    W, H = chart_size(w, h, len(legend))
+    sym = _symbol_map(legend)
+    white = (255, 255, 255)
+    yield _band_array(Image.new("RGB", (W, PAD), white), index)
+    rows = max(1, min(TILE, budget // (W * CELL * 3)))
+    for r0 in range(0, h, rows):
+        r1 = min(h, r0 + rows)
+        with stage("chart"):
+            # each band ends where the next one's top grid line starts, the last with its closing line
+            n = (r1 - r0) * CELL + (r1 == h)
+            if HAS_NUMPY:
+                cells = _cells_np(quantized.crop((0, r0, w, r1)), sym, 0, r0, index)[:n]
+                band = np.empty((n, W) + cells.shape[2:], dtype=np.uint8)
+                band[:] = index(np.array([white], dtype=np.uint8))[0] if index is not None else white
+                band[:, PAD:PAD + cells.shape[1]] = cells
+            else:
+                band = Image.new("RGB", (W, n), white)
+                band.paste(_cells(quantized.crop((0, r0, w, r1)), sym, 0, r0).crop((0, 0, w*CELL + 1, n)), (PAD, 0))
+        yield band
+    # the legend, in bands that start on legend rows so none is cut
+    ly = PAD + h*CELL + 24
+    top = PAD + h*CELL + 1
+    for stop in list(range(ly + 10*LEGEND_ROW, H, 10*LEGEND_ROW)) + [H]:
+        if stop <= top:
+            continue
+        with stage("chart"):
+            img = Image.new("RGB", (W, stop - top), white)
+            if top < ly:
+                ImageDraw.Draw(img).text((PAD, ly - 20 - top), legend_title(legend), fill=(0,0,0), font=_font(16))
+            first = max(0, (top - ly) // LEGEND_ROW)
+            last = min(len(legend), -(-(stop - ly) // LEGEND_ROW))
+            _draw_legend_rows(img, legend[first:last], PAD, ly + first*LEGEND_ROW - top)
+            band = _band_array(img, index)
+        yield band
+        top = stop
+
+def render_chart(quantized: Image.Image, legend: List[Dict]) -> Image.Image:
+    w, h = quantized.size
+    assign_symbols(legend)
+    W, H = chart_size(w, h, len(legend))
+    img = Image.new("RGB", (W, H), (255, 255, 255))
+    img.paste(_cells(quantized, _symbol_map(legend)), (PAD, PAD))
+    _draw_legend(img, legend, PAD, PAD + h*CELL + 24)
     return img
+
+def legend_title(legend: List[Dict]) -> str:
+    # results cached before brand palettes have no "brand"
+    return f'Legend ({legend[0].get("brand", "DMC") if legend else "DMC"})'
+
+def _draw_legend(img: Image.Image, legend: List[Dict], lx: int, ly: int) -> None:
+    ImageDraw.Draw(img).text((lx, ly-20), legend_title(legend), fill=(0,0,0), font=_font(16))
+    _draw_legend_rows(img, legend, lx, ly)
+
+def _draw_legend_rows(img: Image.Image, legend: List[Dict], lx: int, ly: int) -> None:
+    # rows are pasted from cached pieces: key, label, then the count, which differs per chart
+    for i, u in enumerate(legend):
+        yline = ly + i*LEGEND_ROW
+        img.paste(_legend_key((u["r"],u["g"],u["b"]), u["symbol"]), (lx, yline))
+        x = lx + 52 + _paste_text(img, lx + 52, yline + 2, f'{u["code"]} — {u["name"]}  ', (20,20,20))
+        _paste_text(img, x, yline + 2, f'({u["count"]})', (20,20,20))
@@ -1,3 +1,4 @@
+import math
 from typing import Tuple
 
 try:
@@ -45,3 +46,85 @@ def rgb_to_lab_np(rgb_u8: "np.ndarray") -> "np.ndarray":
     a = 500 * (fx - fy)
     b = 200 * (fy - fz)
     return np.stack([L, a, b], axis=-1).astype(np.float32)
+
+_POW25_7 = 25.0 ** 7
+
+def ciede2000_tuple(lab1: Tuple[float, float, float], lab2: Tuple[float, float, float]) -> float:
+    """CIEDE2000 colour difference (Sharma, Wu & Dalal 2005) of two Lab colours."""
+    L1, a1, b1 = lab1
+    L2, a2, b2 = lab2
+    cbar7 = ((math.hypot(a1, b1) + math.hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - math.sqrt(cbar7 / (cbar7 + _POW25_7)))
+    a1p, a2p = (1 + g) * a1, (1 + g) * a2
+    c1p, c2p = math.hypot(a1p, b1), math.hypot(a2p, b2)
+    h1p = math.degrees(math.atan2(b1, a1p)) % 360 if c1p else 0.0
+    h2p = math.degrees(math.atan2(b2, a2p)) % 360 if c2p else 0.0
+    dh = h2p - h1p
+    if c1p * c2p == 0:
+        dh = 0.0
+    elif dh > 180:
+        dh -= 360
+    elif dh < -180:
+        dh += 360
+    dH = 2 * math.sqrt(c1p * c2p) * math.sin(math.radians(dh / 2))
+    hbar = h1p + h2p
+    if c1p * c2p != 0:
+        if abs(h1p - h2p) > 180:
+            hbar += 360 if hbar < 360 else -360
+        hbar /= 2
+    lbar50 = ((L1 + L2) / 2 - 50) ** 2
+    cbarp = (c1p + c2p) / 2
+    t = (1 - 0.17 * math.cos(math.radians(hbar - 30)) + 0.24 * math.cos(math.radians(2 * hbar))
+         + 0.32 * math.cos(math.radians(3 * hbar + 6)) - 0.20 * math.cos(math.radians(4 * hbar - 63)))
+    rc = 2 * math.sqrt(cbarp ** 7 / (cbarp ** 7 + _POW25_7))
+    rt = -math.sin(math.radians(60 * math.exp(-((hbar - 275) / 25) ** 2))) * rc
+    dl = (L2 - L1) / (1 + 0.015 * lbar50 / math.sqrt(20 + lbar50))
+    dc = (c2p - c1p) / (1 + 0.045 * cbarp)
+    dH = dH / (1 + 0.015 * cbarp * t)
+    return math.sqrt(max(0.0, dl * dl + dc * dc + dH * dH + rt * dc * dH))
+
+_COS30, _SIN30 = math.cos(math.radians(30)), math.sin(math.radians(30))
+_COS6, _SIN6 = math.cos(math.radians(6)), math.sin(math.radians(6))
+_COS63, _SIN63 = math.cos(math.radians(63)), math.sin(math.radians(63))
+
+def ciede2000_np(lab1: "np.ndarray", lab2: "np.ndarray") -> "np.ndarray":
+    """ciede2000_tuple over broadcasting (..., 3) Lab arrays.
+
+    Same formula with fewer transcendental calls: dH' comes from the dot and
+    cross products of the two (a', b) vectors, and the mean hue from the sum
+    of their unit vectors, so the T term needs no cosines of its own.
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError("NumPy not available")
+    L1, a1, b1 = np.moveaxis(np.asarray(lab1, dtype=np.float64), -1, 0)
+    L2, a2, b2 = np.moveaxis(np.asarray(lab2, dtype=np.float64), -1, 0)
+    cbar7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) * 0.5) ** 7
+    g1 = 1.5 - 0.5 * np.sqrt(cbar7 / (cbar7 + _POW25_7))
+    a1p, a2p = g1 * a1, g1 * a2
+    c1p, c2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    # 2 sqrt(c1 c2) sin(dh / 2), signed like the wrapped hue difference
+    dH = np.sqrt(np.maximum(0.0, 2.0 * (c1p * c2p - a1p * a2p - b1 * b2)))
+    dH = np.copysign(dH, a1p * b2 - b1 * a2p)
+    # a neutral colour has no hue and leaves the other one as the mean
+    with np.errstate(divide="ignore"):
+        r1 = np.where(c1p > 0, 1.0 / c1p, 0.0)
+        r2 = np.where(c2p > 0, 1.0 / c2p, 0.0)
+    x, y = a1p * r1 + a2p * r2, b1 * r1 + b2 * r2
+    n = np.hypot(x, y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = np.where(n > 0, x / n, 1.0)
+        s = np.where(n > 0, y / n, 0.0)
+    c2, s2 = 2 * c * c - 1, 2 * s * c
+    c3, s3 = c * (4 * c * c - 3), s * (3 - 4 * s * s)
+    c4, s4 = 2 * c2 * c2 - 1, 2 * s2 * c2
+    t = (1 - 0.17 * (c * _COS30 + s * _SIN30) + 0.24 * c2 + 0.32 * (c3 * _COS6 - s3 * _SIN6)
+         - 0.20 * (c4 * _COS63 + s4 * _SIN63))
+    hbar = np.degrees(np.arctan2(s, c)) % 360
+    lbar50 = ((L1 + L2) * 0.5 - 50) ** 2
+    cbarp = (c1p + c2p) * 0.5
+    cp7 = cbarp ** 7
+    rt = -np.sin(np.radians(60 * np.exp(-((hbar - 275) / 25) ** 2))) * 2 * np.sqrt(cp7 / (cp7 + _POW25_7))
+    dl = (L2 - L1) / (1 + 0.015 * lbar50 / np.sqrt(20 + lbar50))
+    dc = (c2p - c1p) / (1 + 0.045 * cbarp)
+    dH = dH / (1 + 0.015 * cbarp * t)
+    return np.sqrt(np.maximum(0.0, dl * dl + dc * dc + dH * dH + rt * dc * dH))
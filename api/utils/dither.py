@@ -0,0 +1,94 @@
+# api/utils/dither.py
+"""Dithering engines for the palette search, all working in Lab.
+
+Each engine takes an (H, W, 3) Lab image and a `nearest(lab_rows) -> idx`
+callable over the target palette, and returns (H, W) palette indices.
+"""
+from functools import lru_cache
+from typing import Callable
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
+
+DITHER_MODES = ("none", "bayer", "bluenoise", "floyd-steinberg")
+
+# Amplitude (in Lab units) of the ordered-dither offsets.
+ORDERED_STRENGTH = 12.0
+
+Nearest = Callable[["np.ndarray"], "np.ndarray"]
+
+@lru_cache(maxsize=4)
+def bayer_matrix(n: int = 8) -> "np.ndarray":
+    """n x n Bayer threshold map scaled to [-0.5, 0.5)."""
+    m = np.zeros((1, 1), dtype=np.int64)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) / m.size - 0.5
+
+def _tile(t: "np.ndarray", H: int, W: int) -> "np.ndarray":
+    reps = (-(-H // t.shape[0]), -(-W // t.shape[1]))
+    return np.tile(t, reps)[:H, :W]
+
+def _blue_noise(H: int, W: int) -> "np.ndarray":
+    """Interleaved gradient noise: a closed-form, blue-noise-like threshold map in [-0.5, 0.5)."""
+    y, x = np.mgrid[0:H, 0:W].astype(np.float64)
+    return np.modf(52.9829189 * np.modf(0.06711056 * x + 0.00583715 * y)[0])[0] - 0.5
+
+def ordered(lab: "np.ndarray", nearest: Nearest, kind: str = "bayer",
+            strength: float = ORDERED_STRENGTH) -> "np.ndarray":
+    """Threshold-offset dithering: one shifted copy of the image, one palette search.
+
+    L, a and b get decorrelated threshold maps (the map, its transpose and its
+    mirror) so mixtures can form along all three axes.
+    """
+    H, W, _ = lab.shape
+    if kind == "bayer":
+        b = bayer_matrix(8)
+        maps = (b, b.T, b[::-1])
+        off = np.stack([_tile(m, H, W) for m in maps], axis=-1)
+    else:
+        n = _blue_noise(H + 37, W + 53)
+        off = np.stack([n[:H, :W], n[37:37 + H, 53:53 + W], n[:H, 53:53 + W]], axis=-1)
+    shifted = lab + strength * off
+    return nearest(shifted.reshape(-1, 3)).reshape(H, W)
+
+def floyd_steinberg(lab: "np.ndarray", nearest: Nearest, pal_lab: "np.ndarray") -> "np.ndarray":
+    """Exact Floyd-Steinberg error diffusion, vectorized along anti-diagonals.
+
+    Pixel (y, x) only depends on (y, x-1) and on (y-1, x-1..x+1), so all
+    pixels with the same x + 2y can be quantized together; the scan takes
+    W + 2H steps of whole-array work instead of H*W Python iterations.
+    """
+    H, W, _ = lab.shape
+    work = lab.astype(np.float64).copy()
+    out = np.empty((H, W), dtype=np.int32)
+    ys_all = np.arange(H)
+    for t in range(W + 2 * (H - 1)):
+        xs = t - 2 * ys_all
+        ok = (xs >= 0) & (xs < W)
+        ys, xs = ys_all[ok], xs[ok]
+        cur = work[ys, xs]
+        idx = nearest(cur)
+        out[ys, xs] = idx
+        err = cur - pal_lab[idx]
+        # one direction at a time: targets within a direction never collide
+        m = xs + 1 < W
+        work[ys[m], xs[m] + 1] += err[m] * (7 / 16)
+        down = ys + 1 < H
+        m = down & (xs > 0)
+        work[ys[m] + 1, xs[m] - 1] += err[m] * (3 / 16)
+        work[ys[down] + 1, xs[down]] += err[down] * (5 / 16)
+        m = down & (xs + 1 < W)
+        work[ys[m] + 1, xs[m] + 1] += err[m] * (1 / 16)
+    return out
+
+def dither(lab: "np.ndarray", mode: str, nearest: Nearest, pal_lab: "np.ndarray") -> "np.ndarray":
+    if mode in ("bayer", "bluenoise"):
+        return ordered(lab, nearest, mode)
+    if mode == "floyd-steinberg":
+        return floyd_steinberg(lab, nearest, pal_lab)
+    raise ValueError(f"dither must be one of {', '.join(DITHER_MODES)}")
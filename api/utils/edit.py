@@ -0,0 +1,145 @@
+# api/utils/edit.py
+"""Apply editor changes to a finished pattern without re-running the pipeline.
+
+An edit takes a cached result plus cell changes (or a whole replacement
+grid), recounts the legend, and re-renders only the TILE x TILE blocks of
+the chart that contain a changed cell, plus the legend rows that moved. Threads keep
+their symbols across edits, so unchanged tiles of the old chart stay valid
+and the client can patch its image in place. The full chart for the edited
+result is only rendered when someone asks for it.
+"""
+import json
+from typing import Dict, List, Optional, Tuple
+
+from .chart import TILE, assign_symbols, chart_colors, render_legend_rows, render_tile
+from .encode import png_bytes, PNG_MODE, PNG_LEVEL
+from .metrics import stage
+from .palettes import Palette, get_palette
+from .quantize import HAS_NUMPY, labels_image, legend_item, np
+
+# above this share of changed tiles, one full chart is cheaper than patches
+FULL_RENDER_SHARE = 0.5
+
+def parse_edits(raw: str) -> List[Tuple[int, int, int]]:
+    """JSON list of [x, y, idx] or {"x", "y", "idx"} items."""
+    items = json.loads(raw)
+    if not isinstance(items, list):
+        raise ValueError("edits must be a JSON list")
+    out = []
+    for it in items:
+        x, y, i = (it["x"], it["y"], it["idx"]) if isinstance(it, dict) else it
+        out.append((int(x), int(y), int(i)))
+    return out
+
+def _copy(labels):
+    return labels.copy() if HAS_NUMPY and isinstance(labels, np.ndarray) else [row[:] for row in labels]
+
+def apply_edits(base: Dict, edits: Optional[List[Tuple[int, int, int]]] = None, labels=None):
+    """New labels grid and the sorted list of changed (x, y) cells."""
+    n = len(get_palette(base.get("palette")))
+    w, h = base["width"], base["height"]
+    old = base["labels"]
+    if labels is not None:
+        if len(labels) != h or (h and len(labels[0]) != w):
+            raise ValueError(f"labels must be {h} rows of {w} cells")
+        new = labels
+    else:
+        new = _copy(old)
+        for x, y, i in edits or ():
+            if not (0 <= x < w and 0 <= y < h):
+                raise ValueError(f"cell ({x}, {y}) is outside the {w}x{h} pattern")
+            new[y][x] = i
+    if HAS_NUMPY and isinstance(new, np.ndarray):
+        new = np.asarray(new, dtype=np.int32)
+        if new.size and (new.min() < 0 or new.max() >= n):
+            raise ValueError(f"thread indices must be between 0 and {n - 1}")
+        ys, xs = np.nonzero(new != np.asarray(old))
+        return new, list(zip(xs.tolist(), ys.tolist()))
+    if any(not 0 <= i < n for row in new for i in row):
+        raise ValueError(f"thread indices must be between 0 and {n - 1}")
+    changed = [(x, y) for y in range(h) for x in range(w) if new[y][x] != old[y][x]]
+    return new, changed
+
+def edit_legend(legend: List[Dict], labels, pal: Optional[Palette] = None) -> List[Dict]:
+    """Legend for the edited grid: fresh counts, symbols carried over.
+
+    Threads keep their rows (new ones are appended, unused ones dropped) so a
+    small edit only changes the rows whose counts moved.
+    """
+    pal = pal or get_palette()
+    if HAS_NUMPY and isinstance(labels, np.ndarray):
+        counts = np.bincount(labels.reshape(-1), minlength=len(pal)).tolist()
+    else:
+        counts = [0] * len(pal)
+        for row in labels:
+            for i in row:
+                counts[i] += 1
+    out = [dict(u, count=int(counts[u["idx"]])) for u in legend if counts[u["idx"]]]
+    seen = {u["idx"] for u in legend}
+    added = [i for i, c in enumerate(counts) if c and i not in seen]
+    added.sort(key=lambda i: counts[i], reverse=True)
+    out += [legend_item(pal, i, counts[i]) for i in added]
+    assign_symbols(out)
+    return out
+
+def _region(labels, x0: int, y0: int, x1: int, y1: int):
+    if HAS_NUMPY and isinstance(labels, np.ndarray):
+        return labels[y0:y1, x0:x1]
+    return [row[x0:x1] for row in labels[y0:y1]]
+
+def _patch(img, pos, keep, png_mode: str, png_level: int) -> Dict:
+    return {"x": pos[0], "y": pos[1], "width": img.size[0], "height": img.size[1],
+            "png": png_bytes(img, png_mode, png_level, keep=keep)}
+
+def edit_pattern(base: Dict, edits=None, labels=None, png_mode: str = PNG_MODE,
+                 png_level: int = PNG_LEVEL) -> Tuple[Dict, Optional[List[Dict]]]:
+    """(new result entry, chart patches) for an edit of `base`.
+
+    Patches are chart-pixel rectangles to paste over the base chart: changed
+    tiles, then bands of the legend rows that differ. They are None when the
+    entry's full chart was rendered instead: so much changed, or the legend
+    gained or lost rows and with them the chart's height. The entry's "png" is
+    None until the full chart is needed (see pipeline.render_result).
+    """
+    w, h = base["width"], base["height"]
+    pal = get_palette(base.get("palette"))
+    with stage("edit"):
+        new, changed = apply_edits(base, edits, labels)
+        legend = edit_legend(base["palette_used"], new, pal)
+    entry = {"width": w, "height": h, "palette": pal.name, "palette_used": legend, "labels": new, "png": None}
+    if not changed:
+        return dict(base), []
+    tiles = sorted({(x // TILE, y // TILE) for x, y in changed})
+    n_tiles = -(-w // TILE) * -(-h // TILE)
+    if len(tiles) > FULL_RENDER_SHARE * n_tiles or len(legend) != len(base["palette_used"]):
+        from .pipeline import render_result
+        return render_result(entry, png_mode, png_level), None
+    keep = chart_colors(legend)
+    patches = []
+    for tx, ty in tiles:
+        x0, y0 = tx * TILE, ty * TILE
+        x1, y1 = min(w, x0 + TILE), min(h, y0 + TILE)
+        with stage("chart"):
+            img, pos = render_tile(labels_image(_region(new, x0, y0, x1, y1), pal), legend, x0, y0)
+        with stage("png"):
+            patches.append(_patch(img, pos, keep, png_mode, png_level))
+    for start, stop in _legend_runs(base["palette_used"], legend):
+        with stage("chart"):
+            band, top = render_legend_rows(legend, w, h, start, stop)
+        if band.size[1]:
+            with stage("png"):
+                patches.append(_patch(band, (0, top), keep, png_mode, png_level))
+    return entry, patches
+
+def _legend_runs(old: List[Dict], new: List[Dict]) -> List[Tuple[int, int]]:
+    """[start, stop) runs of legend rows that differ between two legends."""
+    row = lambda u: (u["idx"], u["count"], u["symbol"])
+    n = max(len(old), len(new))
+    diff = [i >= len(old) or i >= len(new) or row(old[i]) != row(new[i]) for i in range(n)]
+    runs = []
+    for i, d in enumerate(diff):
+        if d and runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        elif d:
+            runs.append([i, i + 1])
+    return [tuple(r) for r in runs]
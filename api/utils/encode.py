@@ -1,8 +1,275 @@
 from io import BytesIO
 import base64
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import deque
+from typing import Dict, Iterable, Optional, Tuple
 from PIL import Image
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
 
-def png_b64(img: Image.Image) -> str:
+PNG_MODES = ("indexed", "rgb")
+PNG_MODE = os.environ.get("CROSS_STITCH_PNG_MODE", "indexed")
+PNG_LEVEL = int(os.environ.get("CROSS_STITCH_PNG_LEVEL", 6))
+
+# "json" is a nested list; the others are base64 little-endian uint16 buffers
+LABEL_FORMATS = ("json", "u16", "u16-deflate", "u16-rle")
+
+def to_indexed(img: Image.Image, keep: Iterable[Tuple[int, int, int]] = ()) -> Optional[Image.Image]:
+    """Palette ('P') version of an RGB image, or None if it cannot keep `keep` exact.
+
+    Lossless when the image has at most 256 colours. Otherwise every colour in
+    `keep` (the chart's solid fills) stays exact, the remaining slots go to the
+    most frequent other colours (anti-aliased glyph edges), and the rest snap to
+    the nearest entry.
+    """
+    keep = set(keep)
+    # more solid fills than palette slots: none of the analysis below can help
+    if not HAS_NUMPY or len(keep) > 256:
+        return None
+    w, h = img.size
+    # RGBX bytes viewed as uint32 (R in the low byte); charts are mostly long
+    # horizontal runs, so colours are resolved per run rather than per pixel
+    flat = np.frombuffer(img.convert("RGBX").tobytes(), dtype="<u4") & 0xFFFFFF
+    starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+    runs = np.diff(np.r_[starts, flat.size])
+    uniq, inv = np.unique(flat[starts], return_inverse=True)
+    counts = np.bincount(inv, weights=runs)
+    rgb = np.stack([uniq & 255, (uniq >> 8) & 255, (uniq >> 16) & 255], axis=1).astype(np.int64)
+    if uniq.size <= 256:
+        pal, lut = rgb, np.arange(uniq.size)
+    else:
+        keep_p = np.array([r | (g << 8) | (b << 16) for r, g, b in keep], dtype=np.uint32)
+        must = np.isin(uniq, keep_p)
+        if must.sum() > 256:
+            return None
+        rest = np.flatnonzero(~must)
+        rest = rest[np.argsort(-counts[rest], kind="stable")][:256 - int(must.sum())]
+        pal = rgb[np.concatenate([np.flatnonzero(must), rest])]
+        lut = nearest_color(pal, rgb)
+    idx = np.repeat(lut[inv].astype(np.uint8), runs).reshape(h, w)
+    out = Image.fromarray(idx, mode="P")
+    out.putpalette(pal.astype(np.uint8).reshape(-1).tolist())
+    return out
+
+def png_bytes(img: Image.Image, mode: str = "rgb", compress_level: int = PNG_LEVEL,
+              keep: Iterable[Tuple[int, int, int]] = ()) -> bytes:
+    keep = set(keep)
+    if mode == "indexed" and len(keep) <= 256:
+        img = to_indexed(img, keep) or img
     buf = BytesIO()
-    img.save(buf, format="PNG")
-    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+    img.save(buf, format="PNG", compress_level=compress_level)
+    return buf.getvalue()
+
+def nearest_color(pal: "np.ndarray", rgb: "np.ndarray") -> "np.ndarray":
+    """Index of the closest `pal` entry for each colour in `rgb` (both (n, 3))."""
+    pf, uf = pal.astype(np.float64), rgb.astype(np.float64)
+    return ((pf * pf).sum(axis=1) - 2.0 * (uf @ pf.T)).argmin(axis=1)
+
+def chart_palette(keep: Iterable[Tuple[int, int, int]], weights: Dict[Tuple[int, int, int], float]):
+    """PNG palette for a chart that is encoded in bands, so to_indexed never sees it whole:
+    every colour in `keep`, then the heaviest other colours. None if `keep` alone
+    does not fit in 256 entries (the chart is then written as RGB, as png_bytes would)."""
+    keep = list(dict.fromkeys(keep))
+    if len(keep) > 256:
+        return None
+    rest = sorted((c for c in weights if c not in set(keep)), key=lambda c: -weights[c])
+    return np.array(keep + rest[:256 - len(keep)], dtype=np.uint8)
+
+class ColorIndex:
+    """Maps RGB arrays to indices into a fixed palette (exact where the colour is in it,
+    nearest otherwise), resolving each distinct colour once per call."""
+
+    def __init__(self, palette: "np.ndarray"):
+        self.palette = palette
+
+    def __call__(self, rgb: "np.ndarray") -> "np.ndarray":
+        rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+        packed = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+        flat = packed.reshape(-1)
+        if flat.size == 0:
+            return np.zeros(packed.shape, dtype=np.uint8)
+        # mostly long runs (margins, legend), so colours are resolved per run
+        starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+        runs = np.diff(np.r_[starts, flat.size])
+        uniq, inv = np.unique(flat[starts], return_inverse=True)
+        urgb = np.stack([uniq >> 16, (uniq >> 8) & 255, uniq & 255], axis=1)
+        lut = nearest_color(self.palette, urgb).astype(np.uint8)
+        return np.repeat(lut[inv], runs).reshape(packed.shape)
+
+PNG_THREADS = int(os.environ.get("CROSS_STITCH_PNG_THREADS", 0)) or None  # None: the tile threads
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def _scanlines(band, prev):
+    """Filtered scanlines of one band and its last row (the next band's "up" row).
+
+    RGB arrays use the Up filter, which turns the repeated rows inside chart cells
+    into zeros; palette indices and (without NumPy) images are left unfiltered.
+    """
+    if HAS_NUMPY and isinstance(band, np.ndarray):
+        if band.ndim == 2:
+            out = np.zeros((band.shape[0], band.shape[1] + 1), dtype=np.uint8)
+            out[:, 1:] = band
+            return out.tobytes(), None
+        rows = band.reshape(band.shape[0], -1)
+        up = np.empty_like(rows)
+        up[0] = prev if prev is not None else 0
+        up[1:] = rows[:-1]
+        out = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        out[:, 0] = 2
+        np.subtract(rows, up, out=out[:, 1:])
+        return out.tobytes(), rows[-1].copy()
+    stride = band.size[0] * 3
+    raw = band.convert("RGB").tobytes()
+    return b"".join(b"\0" + raw[i:i + stride] for i in range(0, len(raw), stride)), None
+
+def _deflate(data: bytes, level: int, zdict: bytes) -> bytes:
+    co = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict) if zdict \
+        else zlib.compressobj(level, zlib.DEFLATED, -15)
+    return co.compress(data) + co.flush(zlib.Z_SYNC_FLUSH)
+
+def png_stream(bands: Iterable, width: int, height: int, palette: Optional["np.ndarray"] = None,
+               compress_level: int = PNG_LEVEL, threads: Optional[int] = PNG_THREADS) -> bytes:
+    """PNG from horizontal bands of the image, top to bottom, deflated in parallel.
+
+    Bands are uint8 arrays ((rows, width) palette indices if `palette` is given,
+    else (rows, width, 3) RGB) or, without NumPy, RGB images. As in pigz, each
+    band is compressed on its own with the previous band's last 32 KiB as
+    dictionary and sync-flushed, so the pieces join into one zlib stream; only
+    a few bands are in flight at once.
+    """
+    from .tiles import TILE_THREADS, executor
+    threads = threads or TILE_THREADS
+    head = b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", struct.pack(
+        ">IIBBBBB", width, height, 8, 3 if palette is not None else 2, 0, 0, 0))
+    if palette is not None:
+        head += _png_chunk(b"PLTE", np.asarray(palette, dtype=np.uint8).tobytes())
+    pending: deque = deque()
+    adler, prev, tail = 1, None, b""
+    zlib_head = b"\x78\x9c" if compress_level > 5 else b"\x78\x5e" if compress_level > 1 else b"\x78\x01"
+    idat = [zlib_head]
+    for band in bands:
+        data, prev = _scanlines(band, prev)
+        adler = zlib.adler32(data, adler)
+        if threads > 1:
+            pending.append(executor().submit(_deflate, data, compress_level, tail))
+            if len(pending) > 2 * threads:
+                idat.append(pending.popleft().result())
+        else:
+            idat.append(_deflate(data, compress_level, tail))
+        tail = data[-32768:]
+    idat += [f.result() for f in pending]
+    idat += [zlib.compressobj(compress_level, zlib.DEFLATED, -15).flush(), struct.pack(">I", adler)]
+    return head + _png_chunk(b"IDAT", b"".join(idat)) + _png_chunk(b"IEND", b"")
+
+def png_data_uri(data: bytes) -> str:
+    return "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+
+def _rle_u16(flat) -> bytes:
+    """(value, run) uint16 pairs over the row-major label sequence; runs cap at 65535."""
+    if HAS_NUMPY:
+        flat = np.asarray(flat, dtype=np.uint16)
+        if flat.size == 0:
+            return b""
+        starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+        runs = np.diff(np.r_[starts, flat.size])
+        vals = flat[starts]
+        # split runs longer than the uint16 limit
+        reps = (runs + 0xFFFE) // 0xFFFF
+        vals = np.repeat(vals, reps)
+        ends = np.cumsum(reps)
+        chunks = np.full(vals.size, 0xFFFF, dtype=np.int64)
+        chunks[ends - 1] = runs - (reps - 1) * 0xFFFF
+        return np.stack([vals, chunks.astype(np.uint16)], axis=1).astype("<u2").tobytes()
+    out = array("H")
+    prev, run = None, 0
+    for v in flat:
+        if v == prev and run < 0xFFFF:
+            run += 1
+            continue
+        if prev is not None:
+            out.extend((prev, run))
+        prev, run = v, 1
+    if prev is not None:
+        out.extend((prev, run))
+    return _le(out)
+
+def _le(a: "array") -> bytes:
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+def encode_labels(labels, fmt: str = "json"):
+    """HxW DMC indices in one of LABEL_FORMATS."""
+    if fmt not in LABEL_FORMATS:
+        raise ValueError(f"labels_format must be one of {', '.join(LABEL_FORMATS)}")
+    is_np = HAS_NUMPY and isinstance(labels, np.ndarray)
+    if fmt == "json":
+        return labels.tolist() if is_np else labels
+    h = len(labels)
+    w = len(labels[0]) if h else 0
+    flat = labels.reshape(-1) if is_np else [v for row in labels for v in row]
+    if fmt == "u16-rle":
+        data, compression = _rle_u16(flat), "rle"
+    else:
+        data = np.asarray(flat, dtype="<u2").tobytes() if HAS_NUMPY else _le(array("H", flat))
+        compression = "none"
+        if fmt == "u16-deflate":
+            data, compression = zlib.compress(data, 6), "deflate"
+    return {"encoding": "uint16le", "compression": compression, "shape": [h, w],
+            "data": base64.b64encode(data).decode("ascii")}
+
+def decode_labels(obj, shape: Optional[Tuple[int, int]] = None):
+    """Inverse of encode_labels: nested lists or an encoded dict -> HxW indices
+    (int32 array with NumPy, list of rows without). With `shape` (height,
+    width) any other size is rejected before anything is expanded."""
+    if isinstance(obj, list):
+        if shape is not None and (len(obj) != shape[0] or any(not isinstance(r, list) or len(r) != shape[1] for r in obj)):
+            raise ValueError(f"labels must be {shape[0]} rows of {shape[1]}")
+        rows = [[int(v) for v in row] for row in obj]
+        if any(len(r) != len(rows[0]) for r in rows):
+            raise ValueError("labels rows must all have the same length")
+        return np.asarray(rows, dtype=np.int32).reshape(len(rows), -1) if HAS_NUMPY else rows
+    if not isinstance(obj, dict) or obj.get("encoding") != "uint16le":
+        raise ValueError("labels must be a list of rows or an encoded labels object")
+    h, w = (int(v) for v in obj["shape"])
+    if shape is not None and (h, w) != tuple(shape):
+        raise ValueError(f"labels shape {[h, w]} does not match the pattern ({shape[0]} x {shape[1]})")
+    if h <= 0 or w <= 0:
+        raise ValueError("labels shape must be positive")
+    n = h * w
+    data = base64.b64decode(obj["data"])
+    comp = obj.get("compression", "none")
+    if comp == "deflate":
+        d = zlib.decompressobj()
+        data = d.decompress(data, 2 * n)  # never inflate past what the shape allows
+        if d.unconsumed_tail:
+            raise ValueError("labels data does not match its shape")
+    elif comp not in ("none", "rle"):
+        raise ValueError(f"unknown labels compression {comp!r}")
+    pairs = array("H")
+    pairs.frombytes(data[:len(data) - len(data) % 2])
+    if sys.byteorder != "little":
+        pairs.byteswap()
+    if comp == "rle":
+        flat = array("H")
+        for v, run in zip(pairs[0::2], pairs[1::2]):
+            if len(flat) + run > n:
+                break
+            flat.extend([v] * run)
+    else:
+        flat = pairs
+    if len(flat) != n:
+        raise ValueError("labels data does not match its shape")
+    if HAS_NUMPY:
+        return np.frombuffer(flat.tobytes(), dtype=np.uint16).astype(np.int32).reshape(h, w)
+    return [list(flat[y*w:(y+1)*w]) for y in range(h)]
@@ -0,0 +1,292 @@
+# api/utils/export.py
+"""Vector chart export: SVG and multi-page PDF, written as byte streams.
+
+Both formats take a result's labels and legend and reuse chart.py's symbol
+assignment and colours, so they show the same symbols as the PNG chart.
+Each thread's cell is defined once (an SVG <g> in <defs> drawn with <use>,
+a PDF image mask drawn with Do) and the output is produced a row (SVG) or a
+page (PDF) at a time, so memory does not grow with the chart.
+
+The PDF is split into pages of whole cells. Neighbouring pages repeat
+OVERLAP cells, and each page is named by its place in the page grid
+(row letter, column number: "B3"). The last pages hold the legend.
+"""
+import os
+import zlib
+from typing import Dict, Iterator, List, Tuple
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw
+
+from .chart import (CELL, PAD, LEGEND_ROW, GRID_THIN, GRID_BOLD, assign_symbols, chart_size,
+                    legend_title, _font, _measure, _tint)
+from .quantize import HAS_NUMPY, np
+
+EXPORT_FORMATS = ("svg", "pdf")
+PAPER = {"a4": (595.28, 841.89), "letter": (612.0, 792.0)}  # points
+PDF_CELL_PT = float(os.environ.get("CROSS_STITCH_PDF_CELL_PT", 10))  # 10 pt is about 3.5 mm
+OVERLAP = 2
+MARGIN, GUTTER, HEADER = 36.0, 16.0, 24.0
+GLYPH_PX = 96  # glyph mask resolution, per cell side
+
+def _rows(labels) -> Iterator[List[int]]:
+    for row in labels:
+        yield row.tolist() if HAS_NUMPY and isinstance(row, np.ndarray) else list(row)
+
+def _legend(legend: List[Dict]) -> Tuple[List[Dict], Dict[int, int]]:
+    """Copy of the legend with symbols, and thread index -> legend position."""
+    legend = [dict(u) for u in legend]
+    assign_symbols(legend)
+    return legend, {u["idx"]: k for k, u in enumerate(legend)}
+
+def _hex(rgb) -> str:
+    return "#%02x%02x%02x" % tuple(rgb)
+
+# ---- SVG -----------------------------------------------------------------
+
+def svg_chart(labels, legend: List[Dict], w: int, h: int) -> Iterator[bytes]:
+    """The chart as SVG, with render_chart's layout: 20 px cells, grid, legend."""
+    legend, pos = _legend(legend)
+    W, H = chart_size(w, h, len(legend))
+    yield (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+           f'width="{W}" height="{H}" viewBox="0 0 {W} {H}">\n'
+           f'<rect width="{W}" height="{H}" fill="#ffffff"/>\n'
+           f'<defs><style>text{{font-family:"DejaVu Sans Mono",monospace}}</style>\n').encode("utf-8")
+    c = CELL // 2
+    yield "".join(
+        f'<g id="t{k}"><rect width="{CELL}" height="{CELL}" fill="{_hex(_tint((u["r"], u["g"], u["b"])))}"/>'
+        f'<text x="{c}" y="{c}" font-size="{int(CELL * 0.6)}" text-anchor="middle" '
+        f'dominant-baseline="central">{escape(u["symbol"])}</text></g>\n'
+        for k, u in enumerate(legend)).encode("utf-8")
+    yield b'</defs>\n<g id="cells">\n'
+    for y, row in enumerate(_rows(labels)):
+        top = PAD + y * CELL
+        yield "".join(f'<use xlink:href="#t{pos[i]}" x="{PAD + x * CELL}" y="{top}"/>'
+                      for x, i in enumerate(row)).encode("utf-8") + b"\n"
+    yield b"</g>\n"
+    # grid lines on pixel centres, bold every 10 cells, as in the PNG chart
+    right, bottom = PAD + w * CELL, PAD + h * CELL
+    for bold, col in ((False, GRID_THIN), (True, GRID_BOLD)):
+        d = "".join(f"M{PAD + gx * CELL + 0.5} {PAD}V{bottom + 1}" for gx in range(w + 1) if (gx % 10 == 0) == bold)
+        d += "".join(f"M{PAD} {PAD + gy * CELL + 0.5}H{right + 1}" for gy in range(h + 1) if (gy % 10 == 0) == bold)
+        yield f'<path d="{d}" stroke="{_hex(col)}" stroke-width="1" fill="none"/>\n'.encode("utf-8")
+    ly = PAD + h * CELL + 24
+    out = [f'<text x="{PAD}" y="{ly - 20}" font-size="16" dominant-baseline="hanging">{escape(legend_title(legend))}</text>\n']
+    for k, u in enumerate(legend):
+        yl, sbx = ly + k * LEGEND_ROW, PAD + 26
+        label = escape(f'{u["code"]} — {u["name"]}  ({u["count"]})')
+        out.append(
+            f'<rect x="{PAD + 0.5}" y="{yl + 0.5}" width="18" height="18" fill="{_hex((u["r"], u["g"], u["b"]))}" stroke="#787878"/>'
+            f'<rect x="{sbx + 0.5}" y="{yl + 0.5}" width="18" height="18" fill="#ffffff" stroke="#787878"/>'
+            f'<text x="{sbx + 9.5}" y="{yl + 9.5}" font-size="16" text-anchor="middle" '
+            f'dominant-baseline="central">{escape(u["symbol"])}</text>'
+            f'<text x="{sbx + 26}" y="{yl + 2}" font-size="16" fill="#141414" '
+            f'dominant-baseline="hanging" xml:space="preserve">{label}</text>\n')
+    yield "".join(out).encode("utf-8")
+    yield b"</svg>\n"
+
+# ---- PDF -----------------------------------------------------------------
+
+class _Pdf:
+    """Objects are written as they are made; only their offsets are kept for the xref."""
+
+    def __init__(self):
+        self.offsets: Dict[int, int] = {}
+        self.pos = 0
+        self.count = 0
+
+    def alloc(self) -> int:
+        self.count += 1
+        return self.count
+
+    def raw(self, data: bytes) -> bytes:
+        self.pos += len(data)
+        return data
+
+    def obj(self, num: int, body: bytes) -> bytes:
+        self.offsets[num] = self.pos
+        return self.raw(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+    def stream(self, num: int, data: bytes, dict_extra: bytes = b"", compress: bool = True) -> bytes:
+        if compress:
+            data = zlib.compress(data, 6)
+            dict_extra += b" /Filter /FlateDecode"
+        return self.obj(num, b"<< /Length %d%s >>\nstream\n" % (len(data), dict_extra) + data + b"\nendstream")
+
+    def trailer(self, root: int) -> bytes:
+        xref = self.pos
+        rows = [b"xref\n0 %d\n0000000000 65535 f \n" % (self.count + 1)]
+        rows += [b"%010d 00000 n \n" % self.offsets[n] for n in range(1, self.count + 1)]
+        rows.append(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.count + 1, root, xref))
+        return self.raw(b"".join(rows))
+
+def _text(s: str) -> bytes:
+    """PDF string literal in WinAnsiEncoding (standard Helvetica has no other glyphs)."""
+    b = s.encode("cp1252", "replace")
+    return b"(" + b.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+def _glyph_mask(sym: str) -> Tuple[bytes, int]:
+    """1-bit image mask of a symbol, drawn like chart._glyph_tile but at GLYPH_PX."""
+    n = GLYPH_PX
+    img = Image.new("L", (n, n), 255)
+    drw = ImageDraw.Draw(img)
+    font = _font(int(n * 0.6))
+    tw, th = _measure(drw, sym, font)
+    drw.text((n / 2 - tw / 2, n / 2 - th / 2 - n / CELL), sym, fill=0, font=font)
+    return img.point(lambda v: 255 if v >= 128 else 0).convert("1").tobytes(), n
+
+def _rgb(rgb, op: str) -> bytes:
+    return b"%.3f %.3f %.3f %s" % (rgb[0] / 255, rgb[1] / 255, rgb[2] / 255, op.encode("ascii"))
+
+def _starts(n: int, per: int, overlap: int) -> List[int]:
+    out = [0]
+    while out[-1] + per < n:
+        out.append(out[-1] + per - overlap)
+    return out
+
+def _page_name(r: int, c: int) -> str:
+    letters = ""
+    r += 1
+    while r:
+        r, m = divmod(r - 1, 26)
+        letters = chr(65 + m) + letters
+    return f"{letters}{c + 1}"
+
+def page_grid(w: int, h: int, paper: str = "a4", overlap: int = OVERLAP, cell: float = PDF_CELL_PT):
+    """(column starts, row starts, cells per page across, down) for a w x h chart."""
+    pw, ph = PAPER[paper]
+    cols = max(1, int((pw - 2 * MARGIN - GUTTER) // cell))
+    rows = max(1, int((ph - 2 * MARGIN - HEADER - GUTTER) // cell))
+    ox, oy = min(overlap, cols // 2), min(overlap, rows // 2)
+    return _starts(w, cols, ox), _starts(h, rows, oy), cols, rows
+
+def _chart_page(rows: List[List[int]], pos: Dict[int, int], legend: List[Dict], x0: int, y0: int,
+                cw: int, ch: int, name: str, where: str, neighbours: Dict[str, str],
+                overlap: Tuple[int, int], paper: Tuple[float, float], cell: float) -> bytes:
+    pw, ph = paper
+    left, top = MARGIN + GUTTER, ph - MARGIN - HEADER - GUTTER
+    ops = [b"BT /F1 11 Tf %.2f %.2f Td %s Tj ET" % (MARGIN, ph - MARGIN - 12, _text(f"Page {name}   {where}"))]
+    # tinted squares, one rectangle per run of equal cells
+    for dy in range(ch):
+        row, yb = rows[dy], top - (dy + 1) * cell
+        x = 0
+        while x < cw:
+            k = pos[row[x0 + x]]
+            run = x + 1
+            while run < cw and pos[row[x0 + run]] == k:
+                run += 1
+            u = legend[k]
+            ops.append(_rgb(_tint((u["r"], u["g"], u["b"])), "rg") +
+                       b" %.2f %.2f %.2f %.2f re f" % (left + x * cell, yb, (run - x) * cell, cell))
+            x = run
+    ops.append(b"0 g")
+    for dy in range(ch):
+        row, yb = rows[dy], top - (dy + 1) * cell
+        for dx in range(cw):
+            ops.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /G%d Do Q" % (cell, cell, left + dx * cell, yb, pos[row[x0 + dx]]))
+    # grid, bold every 10 cells of the whole chart; numbers in the gutters
+    for bold, col, lw in ((False, GRID_THIN, 0.3), (True, GRID_BOLD, 0.8)):
+        ops.append(_rgb(col, "RG") + b" %.2f w" % lw)
+        for gx in range(cw + 1):
+            if ((x0 + gx) % 10 == 0) == bold:
+                ops.append(b"%.2f %.2f m %.2f %.2f l S" % (left + gx * cell, top, left + gx * cell, top - ch * cell))
+        for gy in range(ch + 1):
+            if ((y0 + gy) % 10 == 0) == bold:
+                ops.append(b"%.2f %.2f m %.2f %.2f l S" % (left, top - gy * cell, left + cw * cell, top - gy * cell))
+    ops.append(b"0.35 g")
+    for gx in range(cw + 1):
+        if (x0 + gx) % 10 == 0:
+            ops.append(b"BT /F1 6 Tf %.2f %.2f Td %s Tj ET" % (left + gx * cell - 3, top + 4, _text(str(x0 + gx))))
+    for gy in range(ch + 1):
+        if (y0 + gy) % 10 == 0:
+            ops.append(b"BT /F1 6 Tf %.2f %.2f Td %s Tj ET" % (MARGIN, top - gy * cell - 2, _text(str(y0 + gy))))
+    # the cells repeated from the previous page, marked with a dashed line
+    ox, oy = overlap
+    ops.append(b"0.85 0.2 0.2 RG 0.8 w [3 2] 0 d")
+    if ox:
+        ops.append(b"%.2f %.2f m %.2f %.2f l S" % (left + ox * cell, top, left + ox * cell, top - ch * cell))
+    if oy:
+        ops.append(b"%.2f %.2f m %.2f %.2f l S" % (left, top - oy * cell, left + cw * cell, top - oy * cell))
+    ops.append(b"[] 0 d 0.35 g")
+    # where the chart continues
+    mid, below = left + cw * cell / 2 - 12, top - ch * cell - 12
+    marks = {"up": (mid, top + 12, "^ {}"), "left": (MARGIN, below, "< {}"),
+             "down": (mid, below, "v {}"), "right": (left + cw * cell - 30, below, "{} >")}
+    for side, other in neighbours.items():
+        x, y, fmt = marks[side]
+        ops.append(b"BT /F1 8 Tf %.2f %.2f Td %s Tj ET" % (x, y, _text(fmt.format(other))))
+    return b"\n".join(ops)
+
+def _legend_pages(legend: List[Dict], paper: Tuple[float, float]) -> Iterator[bytes]:
+    pw, ph = paper
+    row = 16.0
+    per = max(1, int((ph - 2 * MARGIN - HEADER) // row))
+    for start in range(0, max(1, len(legend)), per):
+        ops = [b"0 g BT /F1 11 Tf %.2f %.2f Td %s Tj ET" % (MARGIN, ph - MARGIN - 12, _text(legend_title(legend)))]
+        for k, u in enumerate(legend[start:start + per]):
+            y = ph - MARGIN - HEADER - (k + 1) * row
+            ops.append(_rgb((u["r"], u["g"], u["b"]), "rg") + b" 0.47 G 0.5 w %.2f %.2f 12 12 re B" % (MARGIN, y))
+            ops.append(b"1 g %.2f %.2f 12 12 re B 0 g" % (MARGIN + 18, y))
+            ops.append(b"q 12 0 0 12 %.2f %.2f cm /G%d Do Q" % (MARGIN + 18, y, start + k))
+            ops.append(b"BT /F1 9 Tf %.2f %.2f Td %s Tj ET" % (MARGIN + 38, y + 3,
+                                                            _text(f'{u["code"]} — {u["name"]}  ({u["count"]})')))
+        yield b"\n".join(ops)
+
+def pdf_chart(labels, legend: List[Dict], w: int, h: int, paper: str = "a4",
+              overlap: int = OVERLAP, cell: float = PDF_CELL_PT) -> Iterator[bytes]:
+    """The chart as a PDF: page tiles of the grid (row-major), then the legend."""
+    legend, pos = _legend(legend)
+    size = PAPER[paper]
+    xs, ys, cols, rows_per = page_grid(w, h, paper, overlap, cell)
+    pdf = _Pdf()
+    catalog, pages, font, res = pdf.alloc(), pdf.alloc(), pdf.alloc(), pdf.alloc()
+    yield pdf.raw(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    yield pdf.obj(catalog, b"<< /Type /Catalog /Pages %d 0 R >>" % pages)
+    yield pdf.obj(font, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    masks = {}
+    for u in legend:
+        if u["symbol"] not in masks:
+            data, n = _glyph_mask(u["symbol"])
+            masks[u["symbol"]] = num = pdf.alloc()
+            yield pdf.stream(num, data, b" /Type /XObject /Subtype /Image /Width %d /Height %d "
+                                        b"/ImageMask true /BitsPerComponent 1" % (n, n))
+    xobj = b" ".join(b"/G%d %d 0 R" % (k, masks[u["symbol"]]) for k, u in enumerate(legend))
+    yield pdf.obj(res, b"<< /Font << /F1 %d 0 R >> /XObject << %s >> >>" % (font, xobj))
+
+    kids = []
+    def page(content: bytes) -> Iterator[bytes]:
+        num, cnum = pdf.alloc(), pdf.alloc()
+        kids.append(num)
+        yield pdf.stream(cnum, content)
+        yield pdf.obj(num, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Resources %d 0 R /Contents %d 0 R >>"
+                      % (pages, size[0], size[1], res, cnum))
+
+    # only the label rows of the current row of pages are held
+    it, band, band_y = _rows(labels), [], 0
+    total = len(xs) * len(ys)
+    for r, y0 in enumerate(ys):
+        ch = min(rows_per, h - y0)
+        band = band[y0 - band_y:]
+        band_y = y0
+        band += [next(it) for _ in range(ch - len(band))]
+        for c, x0 in enumerate(xs):
+            cw = min(cols, w - x0)
+            where = (f"rows {y0 + 1}-{y0 + ch}, columns {x0 + 1}-{x0 + cw}   "
+                     f"(sheet {r * len(xs) + c + 1} of {total})")
+            neighbours = {side: _page_name(r + dr, c + dc) for side, dr, dc in
+                          (("up", -1, 0), ("left", 0, -1), ("right", 0, 1), ("down", 1, 0))
+                          if 0 <= r + dr < len(ys) and 0 <= c + dc < len(xs)}
+            ov = (x0 and (xs[c - 1] + cols - x0), y0 and (ys[r - 1] + rows_per - y0))
+            yield from page(_chart_page(band, pos, legend, x0, y0, cw, ch, _page_name(r, c), where,
+                                        neighbours, ov, size, cell))
+    for content in _legend_pages(legend, size):
+        yield from page(content)
+    yield pdf.obj(pages, b"<< /Type /Pages /Kids [%s] /Count %d >>"
+                  % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)))
+    yield pdf.trailer(catalog)
+
+def export_chart(entry: Dict, fmt: str, **kw) -> Iterator[bytes]:
+    if fmt == "svg":
+        return svg_chart(entry["labels"], entry["palette_used"], entry["width"], entry["height"])
+    return pdf_chart(entry["labels"], entry["palette_used"], entry["width"], entry["height"], **kw)
@@ -0,0 +1,259 @@
+# api/utils/fetch.py
+"""Image URL downloads: one pooled HTTP session, byte and time caps, and a
+disk cache revalidated with conditional GETs.
+
+Every fetch goes through a shared requests.Session, so repeated images from
+the same host reuse kept-alive connections. A download is streamed and
+stops at MAX_BYTES or after FETCH_TIMEOUT seconds in total; a watchdog
+closes the connection, so a server that trickles bytes cannot hold a
+thread past the deadline. Concurrent fetches of one URL share a single
+download.
+
+With CROSS_STITCH_FETCH_CACHE_DIR set, bodies are kept on disk with their
+ETag / Last-Modified. A body still fresh per Cache-Control max-age is
+served without a request; otherwise it is revalidated with If-None-Match /
+If-Modified-Since, and a 304 serves the stored copy.
+
+CROSS_STITCH_FETCH_TIMEOUT          seconds for a whole download (default 10)
+CROSS_STITCH_FETCH_CONNECT_TIMEOUT  seconds to connect (default 3)
+CROSS_STITCH_FETCH_POOL             connections kept per host (default 8)
+CROSS_STITCH_FETCH_CACHE_DIR        directory of cached downloads (unset: no cache)
+CROSS_STITCH_FETCH_CACHE_BYTES      disk budget of that cache (default 256 MB)
+"""
+import email.utils
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+from .cache import DiskBudget, touch
+from .images import ImageTooLarge, MAX_BYTES
+from .metrics import FETCHES
+
+FETCH_TIMEOUT = float(os.environ.get("CROSS_STITCH_FETCH_TIMEOUT", 10))
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("CROSS_STITCH_FETCH_CONNECT_TIMEOUT", 3))
+FETCH_POOL = int(os.environ.get("CROSS_STITCH_FETCH_POOL", 8))
+FETCH_CACHE_DIR = os.environ.get("CROSS_STITCH_FETCH_CACHE_DIR") or None
+FETCH_CACHE_BYTES = int(os.environ.get("CROSS_STITCH_FETCH_CACHE_BYTES", 256 << 20))
+
+_CHUNK = 1 << 16
+_MAX_AGE_RE = re.compile(r"(?:^|,)\s*(?:s-)?max-age\s*=\s*(\d+)", re.I)
+
+class FetchError(ValueError):
+    pass
+
+class BadImageURL(FetchError):
+    pass
+
+class FetchTimeout(FetchError):
+    pass
+
+def _too_large(limit: int) -> ImageTooLarge:
+    return ImageTooLarge(f"Image exceeds {limit // (1 << 20)} MB.")
+
+def _freshness(headers) -> Optional[float]:
+    """Unix time until which a response may be reused without revalidating."""
+    cc = headers.get("Cache-Control") or ""
+    if re.search(r"no-cache|no-store|private", cc, re.I):
+        return None
+    m = _MAX_AGE_RE.search(cc)
+    return time.time() + int(m.group(1)) if m else None
+
+def _abort(r) -> None:
+    """Cut a download at its deadline. Closing the response alone does not wake
+    a thread blocked in recv; shutting the socket down does."""
+    sock = getattr(getattr(r.raw, "connection", None), "sock", None)
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    r.close()
+
+class Fetcher:
+    def __init__(self, cache_dir: Optional[str] = FETCH_CACHE_DIR, cache_bytes: int = FETCH_CACHE_BYTES,
+                 timeout: float = FETCH_TIMEOUT, connect_timeout: float = FETCH_CONNECT_TIMEOUT,
+                 pool: int = FETCH_POOL, max_bytes: int = MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self.timeout, self.connect_timeout = timeout, connect_timeout
+        self.pool, self.max_bytes = pool, max_bytes
+        self._session = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.counts = {"fresh": 0, "not_modified": 0, "download": 0, "shared": 0, "error": 0}
+        self._disk = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk = DiskBudget(cache_dir, cache_bytes)
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                import requests  # ~60 ms to import; most requests are uploads
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool, pool_maxsize=self.pool, max_retries=0)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                self._session = s
+            return self._session
+
+    def fetch(self, url: str) -> bytes:
+        """Body of `url`, from the disk cache when it is still valid."""
+        if not re.match(r"https?://", url or "", re.I):
+            raise BadImageURL("image_url must be an http(s) URL.")
+        with self._lock:
+            fut = self._inflight.get(url)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[url] = Future()
+        if not owner:
+            self._count("shared")
+            return fut.result()
+        try:
+            data = self._fetch(url)
+            fut.set_result(data)
+            return data
+        except BaseException as e:
+            self._count("error")
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self.counts, "inflight": len(self._inflight), "disk": bool(self.cache_dir)}
+
+    def _count(self, result: str) -> None:
+        with self._lock:
+            self.counts[result] += 1
+        FETCHES.inc(result)
+
+    def _fetch(self, url: str) -> bytes:
+        meta, body = self._cached(url)
+        headers = {}
+        if meta is not None:
+            if (meta.get("fresh_until") or 0) > time.time():
+                self._count("fresh")
+                self._touch(url)
+                return body
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        status, resp_headers, data = self._download(url, headers)
+        if status == 304 and meta is None:
+            raise FetchError("Fetching the image failed: unexpected HTTP 304.")
+        if status == 304:
+            self._count("not_modified")
+            meta["fresh_until"] = _freshness(resp_headers) or meta.get("fresh_until")
+            self._store(url, meta, None)
+            return body
+        self._count("download")
+        if "no-store" not in (resp_headers.get("Cache-Control") or "").lower():
+            self._store(url, {
+                "url": url, "etag": resp_headers.get("ETag"), "last_modified": resp_headers.get("Last-Modified"),
+                "fresh_until": _freshness(resp_headers),
+                "fetched": email.utils.formatdate(usegmt=True),
+            }, data)
+        return data
+
+    def _download(self, url: str, headers: Dict) -> Tuple[int, Dict, Optional[bytes]]:
+        import requests
+        deadline = time.monotonic() + self.timeout
+        try:
+            r = self.session().get(url, headers=headers, stream=True,
+                                   timeout=(self.connect_timeout, self.timeout))
+        except requests.Timeout as e:
+            raise FetchTimeout(f"Fetching the image timed out after {self.timeout:g} s.") from e
+        except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                requests.exceptions.InvalidSchema) as e:
+            raise BadImageURL(f"Invalid image_url: {e}") from e
+        except requests.RequestException as e:
+            raise FetchError(f"Could not fetch the image: {e}") from e
+        watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), _abort, (r,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            with r:
+                if r.status_code == 304:
+                    r.content  # consume the empty body so the connection goes back to the pool
+                    return 304, r.headers, None
+                if r.status_code >= 400:
+                    raise FetchError(f"Fetching the image failed: HTTP {r.status_code}.")
+                if int(r.headers.get("Content-Length") or 0) > self.max_bytes:
+                    raise _too_large(self.max_bytes)
+                buf = bytearray()
+                for chunk in r.iter_content(_CHUNK):
+                    if len(buf) + len(chunk) > self.max_bytes:
+                        raise _too_large(self.max_bytes)
+                    buf += chunk
+                    if time.monotonic() > deadline:
+                        break
+                if time.monotonic() > deadline:
+                    raise FetchTimeout(f"Fetching the image took longer than {self.timeout:g} s.")
+                return r.status_code, r.headers, bytes(buf)
+        except (requests.RequestException, OSError, AttributeError, ValueError) as e:
+            if isinstance(e, (FetchError, ImageTooLarge)):
+                raise
+            if time.monotonic() > deadline:
+                raise FetchTimeout(f"Fetching the image took longer than {self.timeout:g} s.") from e
+            raise FetchError(f"Could not fetch the image: {e}") from e
+        finally:
+            watchdog.cancel()
+
+    def _paths(self, url: str) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+        return base + ".json", base + ".body"
+
+    def _cached(self, url: str) -> Tuple[Optional[Dict], Optional[bytes]]:
+        if not self.cache_dir:
+            return None, None
+        meta_p, body_p = self._paths(url)
+        try:
+            with open(meta_p, "r", encoding="utf-8") as fh:
+                meta = json.load(fh)
+            with open(body_p, "rb") as fh:
+                body = fh.read()
+        except (OSError, ValueError):
+            return None, None
+        # hash collisions are not a concern, but a reused cache dir might be
+        if meta.get("url") != url or not (meta.get("etag") or meta.get("last_modified") or meta.get("fresh_until")):
+            return None, None
+        return meta, body
+
+    def _store(self, url: str, meta: Dict, body: Optional[bytes]) -> None:
+        """Write meta (and body, unless only the meta changed); validators are needed to reuse it."""
+        if not self.cache_dir or not (meta.get("etag") or meta.get("last_modified") or meta.get("fresh_until")):
+            return
+        meta_p, body_p = self._paths(url)
+        try:
+            # body first: a readable .json implies a complete entry
+            writes = [(meta_p, json.dumps(meta), "w")]
+            if body is not None:
+                writes.insert(0, (body_p, body, "wb"))
+            else:
+                self._touch(url)
+            for path, data, mode in writes:
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, mode) as fh:
+                    fh.write(data)
+                os.replace(tmp, path)
+            if body is not None:
+                self._disk.added(len(body) + len(writes[1][1]))
+        except OSError:
+            pass
+
+    def _touch(self, url: str) -> None:
+        # recently used: pruned last
+        touch(*self._paths(url))
+
+FETCHER = Fetcher()
@@ -1,16 +1,94 @@
+import os
 from io import BytesIO
-import requests
+from typing import Optional, Tuple
 from PIL import Image, ImageFile
 
+from .metrics import stage
+
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-def fetch_image(url: str) -> Image.Image:
-    r = requests.get(url, timeout=20)
-    r.raise_for_status()
-    return _rgba_to_rgb_over_white(Image.open(BytesIO(r.content)))
+MAX_BYTES = int(os.environ.get("CROSS_STITCH_MAX_BYTES", 25 << 20))
+MAX_PIXELS = int(os.environ.get("CROSS_STITCH_MAX_PIXELS", 60_000_000))
+# longest side of a pattern, in cells; above ~100 x 100 the tiled path takes over (see tiles.py)
+MAX_CELLS = int(os.environ.get("CROSS_STITCH_MAX_CELLS", 400))
+_CHUNK = 1 << 16
+
+class ImageTooLarge(ValueError):
+    pass
+
+class BadImage(ValueError):
+    pass
+
+def _read_capped(chunks, limit: int) -> bytes:
+    buf = BytesIO()
+    for chunk in chunks:
+        if not chunk:
+            break
+        if buf.tell() + len(chunk) > limit:
+            raise ImageTooLarge(f"Image exceeds {limit // (1 << 20)} MB.")
+        buf.write(chunk)
+    return buf.getvalue()
+
+def fetch_bytes(url: str) -> bytes:
+    from .fetch import FETCHER  # pooled session and download cache, see fetch.py
+    with stage("fetch"):
+        return FETCHER.fetch(url)
+
+def upload_bytes(f) -> bytes:
+    with stage("read"):
+        return _read_capped(iter(lambda: f.file.read(_CHUNK), b""), MAX_BYTES)
+
+def probe(data: bytes) -> Tuple[int, int, Optional[str]]:
+    """(width, height, format) from the image header, without decoding pixels."""
+    with Image.open(BytesIO(data)) as img:
+        w, h = img.size
+        if w * h > MAX_PIXELS:
+            raise ImageTooLarge(f"Image has {w * h} pixels; the limit is {MAX_PIXELS}.")
+        return w, h, img.format
+
+def decode_cost(w: int, h: int, fmt: Optional[str], max_size: int) -> int:
+    """Rough peak bytes load_image needs for a w x h image (measured peak RSS:
+    ~4 bytes per decoded pixel plus codec state). JPEGs decode at the DCT
+    scale draft picks, everything else at full size."""
+    if fmt == "JPEG":
+        target, scale = clamp_size(max_size), 1
+        while scale < 8 and min(w, h) // (2 * scale) >= target:
+            scale *= 2
+        w, h = -(-w // scale), -(-h // scale)
+    return 4 * w * h + (4 << 20)
+
+def load_image(data: bytes, max_size: Optional[int] = None) -> Image.Image:
+    """Decode at roughly the size resize_keep_ratio needs instead of full resolution.
 
-def read_upload(f) -> Image.Image:
-    return _rgba_to_rgb_over_white(Image.open(BytesIO(f.file.read())))
+    JPEGs are decoded with DCT scaling (draft), other formats are box-reduced
+    by an integer factor; either way the longest side stays >= the target so
+    the final NEAREST resize still does the last step. Alpha is composited
+    only after the reduction.
+    """
+    with stage("decode"):
+        try:
+            return _load_image(data, max_size)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(f"Image has too many pixels; the limit is {MAX_PIXELS}.") from e
+        except (Image.UnidentifiedImageError, OSError, SyntaxError) as e:
+            # PIL's messages name internals (<_io.BytesIO object at ...>), not the problem
+            raise BadImage("Could not read the image; upload a PNG, JPEG, GIF or WebP file.") from e
+
+def _load_image(data: bytes, max_size: Optional[int]) -> Image.Image:
+    img = Image.open(BytesIO(data))
+    w, h = img.size
+    if w * h > MAX_PIXELS:
+        raise ImageTooLarge(f"Image has {w * h} pixels; the limit is {MAX_PIXELS}.")
+    if max_size is not None:
+        target = clamp_size(max_size)
+        if img.format == "JPEG":
+            img.draft("RGB", (target, target))
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGB")  # what _rgba_to_rgb_over_white would do, but before reducing
+        factor = max(img.size) // target
+        if factor >= 2:
+            img = img.reduce(factor)
+    return _rgba_to_rgb_over_white(img)
 
 def _rgba_to_rgb_over_white(img: Image.Image) -> Image.Image:
     if img.mode == "RGBA":
@@ -19,13 +97,20 @@ def _rgba_to_rgb_over_white(img: Image.Image) -> Image.Image:
         return bg.convert("RGB")
     return img.convert("RGB")
 
-def resize_keep_ratio(img: Image.Image, max_size: int) -> Image.Image:
-    """Cap the LONGEST side to max_size (≤100), scale the other side proportionally."""
-    w, h = img.size
-    max_size = max(16, min(100, int(max_size)))  # hard cap at 100
+def clamp_size(max_size: int) -> int:
+    return max(16, min(MAX_CELLS, int(max_size)))
+
+def fit_size(w: int, h: int, max_size: int) -> Tuple[int, int]:
+    """Size resize_keep_ratio gives a w x h image."""
+    max_size = clamp_size(max_size)
     if max(w, h) <= max_size:
-        return img
+        return w, h
     scale = max(w, h) / float(max_size)
-    new_w, new_h = int(round(w / scale)), int(round(h / scale))
-    return img.resize((new_w, new_h), Image.NEAREST)
+    return int(round(w / scale)), int(round(h / scale))
 
+def resize_keep_ratio(img: Image.Image, max_size: int) -> Image.Image:
+    """Cap the LONGEST side to max_size (≤ MAX_CELLS), scale the other side proportionally."""
+    size = fit_size(*img.size, max_size)
+    if size == img.size:
+        return img
+    return img.resize(size, Image.NEAREST)
@@ -0,0 +1,280 @@
+# api/utils/jobs.py
+"""Background jobs: submit now, follow progress, fetch the result later.
+
+A submitted job goes on a queue backend; JOB_WORKERS runner tasks in this
+process take jobs off it and hand them to the handler the app registers.
+Each job keeps a numbered event log (queued, started, one "stage" event
+the first time each pipeline stage runs, then done or failed) that can be
+polled or followed as Server-Sent Events. Jobs live in a JobStore bounded
+to JOB_MAX entries; finished ones expire JOB_TTL seconds after they end.
+
+The backend is anything with
+
+    put(job_id, payload)     enqueue, or raise QueueFull
+    async get()              -> (job_id, payload), waiting for one
+    qsize()                  jobs waiting
+
+MemoryQueue is the in-process default. CROSS_STITCH_JOB_BACKEND may name
+another as "module:factory"; the factory is called with the queue size.
+
+Job state lives in the process that took the submission, so jobs need a
+long-running server; on serverless hosts a later request may land on
+another instance and find nothing. They are therefore off unless
+CROSS_STITCH_JOBS says otherwise, which it does by default only when a
+shared backend is configured.
+
+CROSS_STITCH_JOBS         "1" to accept jobs, "0" to refuse them
+                          (default: 1 with a "module:factory" backend, else 0)
+CROSS_STITCH_JOB_BACKEND  "memory" (default) or "module:factory"
+CROSS_STITCH_JOB_WORKERS  jobs run at once (default: pool workers)
+CROSS_STITCH_JOB_QUEUE    jobs allowed to wait (default 32)
+CROSS_STITCH_JOB_TTL      seconds a finished job is kept (default 600)
+CROSS_STITCH_JOB_MAX      jobs kept at most (default 1000)
+"""
+import asyncio
+import importlib
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .workers import WORKERS
+
+JOB_BACKEND = os.environ.get("CROSS_STITCH_JOB_BACKEND", "memory")
+JOBS_ENABLED = os.environ.get("CROSS_STITCH_JOBS", "0" if JOB_BACKEND in ("", "memory") else "1") == "1"
+JOB_WORKERS = int(os.environ.get("CROSS_STITCH_JOB_WORKERS", WORKERS))
+JOB_QUEUE = int(os.environ.get("CROSS_STITCH_JOB_QUEUE", 32))
+JOB_TTL = float(os.environ.get("CROSS_STITCH_JOB_TTL", 600))
+JOB_MAX = int(os.environ.get("CROSS_STITCH_JOB_MAX", 1000))
+
+TERMINAL = ("done", "failed")
+
+class QueueFull(RuntimeError):
+    pass
+
+class MemoryQueue:
+    def __init__(self, maxsize: int = JOB_QUEUE):
+        self.maxsize = max(1, maxsize)
+        self._items: "deque[Tuple[str, Dict]]" = deque()
+        self._ready: Optional[asyncio.Event] = None
+
+    def put(self, job_id: str, payload: Dict) -> None:
+        if len(self._items) >= self.maxsize:
+            raise QueueFull("Too many jobs waiting, try again shortly.")
+        self._items.append((job_id, payload))
+        if self._ready is not None:
+            self._ready.set()
+
+    async def get(self) -> Tuple[str, Dict]:
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+def make_backend(spec: str = JOB_BACKEND, maxsize: int = JOB_QUEUE):
+    if spec in ("", "memory"):
+        return MemoryQueue(maxsize)
+    module, _, name = spec.partition(":")
+    if not name:
+        raise ValueError(f"CROSS_STITCH_JOB_BACKEND must be 'memory' or 'module:factory', not {spec!r}")
+    return getattr(importlib.import_module(module), name)(maxsize)
+
+class Job:
+    def __init__(self, job_id: str, kind: str):
+        self.id, self.kind = job_id, kind
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.created = time.time()
+        self.started = self.finished = None
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.error_status: Optional[int] = None
+        self.events: List[Tuple[int, str, Dict]] = []
+        self._stages = set()
+        self._changed = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def emit(self, event: str, data: Dict) -> None:
+        self.events.append((len(self.events), event, data))
+        self._changed.set()
+
+    def on_stage(self, name: str) -> None:
+        """Stage hook for StageTimer; called from worker threads as well."""
+        if name not in self._stages:
+            self._stages.add(name)
+            self._loop.call_soon_threadsafe(self._stage, name)
+
+    def _stage(self, name: str) -> None:
+        if self.status != "running":
+            return
+        self.stage = name
+        self.emit("stage", {"stage": name, "elapsed": round(time.time() - self.started, 3)})
+
+    def start(self) -> None:
+        self.status, self.started = "running", time.time()
+        self.emit("started", {})
+
+    def finish(self, result: Dict) -> None:
+        self.status, self.finished, self.result = "done", time.time(), result
+        self.emit("done", {"elapsed": round(self.finished - self.started, 3)})
+
+    def fail(self, error: str, status: int) -> None:
+        self.status, self.finished = "failed", time.time()
+        self.error, self.error_status = error, status
+        self.emit("failed", {"error": error, "status": status})
+
+    async def follow(self, after: int = -1, heartbeat: float = 15.0):
+        """Events numbered above `after`, as they happen, until the job ends;
+        None every `heartbeat` seconds of silence."""
+        while True:
+            self._changed.clear()
+            new = self.events[after + 1:]
+            for ev in new:
+                yield ev
+            if new:
+                after = new[-1][0]
+            if self.status in TERMINAL and after >= len(self.events) - 1:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+    def describe(self, position: Optional[int] = None) -> Dict:
+        out = {"job_id": self.id, "kind": self.kind, "status": self.status, "stage": self.stage,
+               "created": self.created, "started": self.started, "finished": self.finished}
+        if position is not None:
+            out["position"] = position
+        if self.status == "done":
+            out["result"] = self.result
+        elif self.status == "failed":
+            out["error"], out["error_status"] = self.error, self.error_status
+        return out
+
+class JobStore:
+    def __init__(self, max_jobs: int = JOB_MAX, ttl: float = JOB_TTL):
+        self.max_jobs, self.ttl = max(1, max_jobs), ttl
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def add(self, job: Job) -> None:
+        self.sweep()
+        if len(self._jobs) >= self.max_jobs:
+            # make room by dropping the oldest finished job; never an unfinished one
+            oldest = next((k for k, j in self._jobs.items() if j.status in TERMINAL), None)
+            if oldest is None:
+                raise QueueFull("Too many jobs in progress, try again shortly.")
+            del self._jobs[oldest]
+            self.expired += 1
+        self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.sweep()
+        return self._jobs.get(job_id)
+
+    def discard(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+
+    def sweep(self) -> None:
+        cutoff = time.time() - self.ttl
+        for k in [k for k, j in self._jobs.items() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[k]
+            self.expired += 1
+
+    def counts(self) -> Dict[str, int]:
+        out = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for j in self._jobs.values():
+            out[j.status] += 1
+        return out
+
+Handler = Callable[[Job, Dict], Awaitable[Dict]]
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS, backend=None, store: Optional[JobStore] = None):
+        self.workers = max(1, workers)
+        self.backend = backend if backend is not None else make_backend()
+        self.store = store if store is not None else JobStore()
+        self.handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._order: "deque[str]" = deque()  # queued job ids, for positions
+        self.completed = self.failed = 0
+        # HTTP status recorded for a job that raised; the app maps its own errors
+        self.status_for: Callable[[Exception], int] = lambda e: 500
+
+    def handler(self, kind: str):
+        def register(fn: Handler) -> Handler:
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def start(self) -> None:
+        """Start the runner tasks on the running loop; safe to call again."""
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.get_running_loop().create_task(self._run()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, payload: Dict) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job kind {kind!r}")
+        self.start()
+        job = Job(secrets.token_hex(16), kind)
+        self.store.add(job)
+        try:
+            self.backend.put(job.id, {"kind": kind, **payload})
+        except QueueFull:
+            self.store.discard(job.id)
+            raise
+        self._order.append(job.id)
+        job.emit("queued", {"position": len(self._order)})
+        return job
+
+    def position(self, job: Job) -> Optional[int]:
+        if job.status != "queued":
+            return None
+        try:
+            return self._order.index(job.id) + 1
+        except ValueError:
+            return None
+
+    async def _run(self) -> None:
+        while True:
+            job_id, payload = await self.backend.get()
+            try:
+                self._order.remove(job_id)
+            except ValueError:
+                pass
+            job = self.store.get(job_id)
+            if job is None:
+                continue  # expired or evicted while it waited
+            job.start()
+            try:
+                job.finish(await self.handlers[payload.pop("kind")](job, payload))
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.fail("Server shutting down.", 503)
+                raise
+            except Exception as e:
+                job.fail(str(e), self.status_for(e))
+                self.failed += 1
+
+    def stats(self) -> Dict:
+        return {"enabled": JOBS_ENABLED, "workers": self.workers, "backlog": self.backend.qsize(),
+                "jobs": len(self.store), **self.store.counts(), "completed": self.completed, "failed": self.failed,
+                "expired": self.store.expired}
+
+JOBS = JobRunner()
@@ -0,0 +1,137 @@
+# api/utils/lut.py
+"""Prebuilt RGB -> DMC index lookup table.
+
+The table is built offline and opened read-only with np.memmap, so every
+worker process on a host shares a single copy through the page cache.
+
+    python -m api.utils.lut build --bits 7
+
+The full search takes about 20 s, so the file is not checked in; the deploy
+build produces it (`npm run build:api`, run by `vercel-build`) and
+--if-stale skips the work when an up-to-date table is already there.
+
+bits=8 stores the exact answer for all 2^24 colors (32 MB). Smaller grids
+store one index per (2^(8-bits))^3 block of colors when the whole block maps
+to the same thread and MISS otherwise; callers refine MISS pixels with an
+exact search, so lookups always agree with the direct palette search.
+"""
+import argparse
+import os
+import sys
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
+
+from ..palette_dmc import DMC, PALETTE_VERSION
+
+MAGIC = b"DMCLUT1\0"
+HEADER = 128  # magic(8) + bits(1) + pad(7) + checksum(64 ascii) + pad
+MISS = 0xFFFF
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "dmc_lut.bin")
+LUT_PATH = os.environ.get("CROSS_STITCH_LUT", DEFAULT_PATH)
+
+class StaleLutError(ValueError):
+    pass
+
+class RGBLut:
+    def __init__(self, table: "np.ndarray", bits: int, checksum: str):
+        self.table = table
+        self.bits = bits
+        self.checksum = checksum
+
+    def lookup(self, rgb_flat: "np.ndarray") -> "np.ndarray":
+        """Palette index per RGB row; -1 where the grid cell is ambiguous."""
+        b, s = self.bits, 8 - self.bits
+        q = rgb_flat.astype(np.int32) >> s
+        cell = (q[:, 0] << (2 * b)) | (q[:, 1] << b) | q[:, 2]
+        idx = self.table[cell].astype(np.int32)
+        idx[idx == MISS] = -1
+        return idx
+
+def _write_header(fh, bits: int, checksum: str):
+    head = MAGIC + bytes([bits]) + b"\0" * 7 + checksum.encode("ascii")
+    fh.write(head.ljust(HEADER, b"\0"))
+
+def open_lut(path: str, checksum: str = PALETTE_VERSION) -> RGBLut:
+    with open(path, "rb") as fh:
+        head = fh.read(HEADER)
+    if len(head) < HEADER or head[:8] != MAGIC:
+        raise ValueError(f"{path}: not a DMC lookup table")
+    bits = head[8]
+    stored = head[16:80].decode("ascii")
+    if stored != checksum:
+        raise StaleLutError(f"{path}: built for palette {stored[:12]}, current is {checksum[:12]}")
+    table = np.memmap(path, dtype="<u2", mode="r", offset=HEADER, shape=(1 << (3 * bits),))
+    return RGBLut(table, bits, stored)
+
+@lru_cache(maxsize=1)
+def get_lut() -> Optional[RGBLut]:
+    """The shared table, or None if it is missing, stale or NumPy is unavailable."""
+    if not HAS_NUMPY or not LUT_PATH or not os.path.exists(LUT_PATH):
+        return None
+    try:
+        return open_lut(LUT_PATH)
+    except ValueError as e:
+        print(f"[lut] ignoring {LUT_PATH}: {e}", file=sys.stderr)
+        return None
+
+def build_lut(path: str, bits: int = 7) -> str:
+    """Compute the table from DMC with the same search map_palette_lab uses."""
+    from .quantize import _nearest_palette
+    if not 1 <= bits <= 8:
+        raise ValueError("bits must be between 1 and 8")
+    if len(DMC) >= MISS:
+        raise ValueError("palette too large for a uint16 table")
+    s, g = 8 - bits, 1 << bits
+    step = 1 << s
+    gb = np.stack(np.meshgrid(np.arange(256), np.arange(256), indexing="ij"), axis=-1).reshape(-1, 2)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        _write_header(fh, bits, PALETTE_VERSION)
+        for r0 in range(0, 256, step):
+            # all colors whose red channel falls in this grid slab
+            rgb = np.empty((step, gb.shape[0], 3), dtype=np.uint8)
+            rgb[..., 0] = np.arange(r0, r0 + step, dtype=np.uint8)[:, None]
+            rgb[..., 1:] = gb
+            idx = _nearest_palette(rgb.reshape(-1, 3)).reshape(step, g, step, g, step)
+            lo = idx.min(axis=(0, 2, 4))
+            hi = idx.max(axis=(0, 2, 4))
+            fh.write(np.where(lo == hi, lo, MISS).astype("<u2").tobytes())
+    os.replace(tmp, path)
+    return path
+
+def _current(path: str, bits: int) -> bool:
+    try:
+        return open_lut(path).bits == bits
+    except (OSError, ValueError):
+        return False
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m api.utils.lut")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build the RGB->DMC lookup table")
+    b.add_argument("--bits", type=int, default=7, help="bits per channel (8 = exact 24-bit table)")
+    b.add_argument("--out", default=LUT_PATH)
+    b.add_argument("--if-stale", action="store_true", help="keep an existing table built for this palette and bits")
+    c = sub.add_parser("check", help="verify a table against the current palette")
+    c.add_argument("path", nargs="?", default=LUT_PATH)
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        if args.if_stale and _current(args.out, args.bits):
+            print(f"{args.out}: up to date")
+        else:
+            print(build_lut(args.out, args.bits))
+    else:
+        lut = open_lut(args.path)
+        miss = int(np.count_nonzero(lut.table == MISS))
+        print(f"{args.path}: bits={lut.bits} palette={lut.checksum[:12]} ambiguous={miss}/{lut.table.size}")
+
+if __name__ == "__main__":
+    main()
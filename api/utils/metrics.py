@@ -0,0 +1,167 @@
+# api/utils/metrics.py
+"""Per-request stage timings and process-wide metrics.
+
+Library code marks its stages with `with stage("search"):`. The marks cost
+nothing unless a StageTimer is active on the calling thread (see
+`timed_call`), so the pipeline runs the same in scripts and in workers.
+Nested stages are exclusive: a parent's duration excludes its children, so
+the stages of one request add up to its wall time.
+
+`METRICS.render()` produces the Prometheus text exposition format.
+"""
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+_local = threading.local()
+
+class StageTimer:
+    def __init__(self, on_stage: Optional[Callable[[str], None]] = None):
+        self.durations: Dict[str, float] = {}
+        self._stack: List[list] = []  # [name, start, child seconds]
+        self.on_stage = on_stage  # called as each stage starts (job progress)
+
+    @contextmanager
+    def time(self, name: str):
+        if self.on_stage is not None:
+            self.on_stage(name)
+        frame = [name, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            self.add(name, elapsed - frame[2])
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def merge(self, durations: Dict[str, float]) -> None:
+        for name, seconds in durations.items():
+            self.add(name, seconds)
+
+    def header(self) -> str:
+        """Server-Timing header value, durations in milliseconds."""
+        return ", ".join(f"{name};dur={s * 1000:.1f}" for name, s in self.durations.items())
+
+def stage(name: str):
+    timer = getattr(_local, "timer", None)
+    return timer.time(name) if timer is not None else nullcontext()
+
+def timed_call(fn: Callable, *args, on_stage: Optional[Callable[[str], None]] = None) -> Tuple[object, Dict[str, float]]:
+    """fn(*args) with stage marks recorded; returns (result, durations).
+
+    Module-level so it can be sent to a process pool (without on_stage).
+    """
+    prev = getattr(_local, "timer", None)
+    _local.timer = timer = StageTimer(on_stage)
+    try:
+        return fn(*args), timer.durations
+    finally:
+        _local.timer = prev
+
+# ---- metrics -------------------------------------------------------------
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, v in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(v)}"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            row = self._values.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for labels, row in items:
+            for b, c in zip(self.buckets, row):
+                le = 'le="%s"' % _num(b)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {c}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {row[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(row[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {row[-1]}"
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        m = Counter(name, help, labels)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), **kw) -> Histogram:
+        m = Histogram(name, help, labels, **kw)
+        self._metrics.append(m)
+        return m
+
+    def render(self, gauges: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+        """Exposition text; `gauges` adds point-in-time values as {name: (help, value)}."""
+        lines = []
+        for m in self._metrics:
+            lines += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}", *m.samples()]
+        for name, (help, value) in (gauges or {}).items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_num(value)}"]
+        return "\n".join(lines) + "\n"
+
+METRICS = Registry()
+REQUESTS = METRICS.counter("cross_stitch_requests_total", "HTTP requests handled.", ("route", "method", "status"))
+ERRORS = METRICS.counter("cross_stitch_errors_total", "Requests answered with an error status.", ("route", "status"))
+REQUEST_SECONDS = METRICS.histogram("cross_stitch_request_seconds", "Request latency.", ("route",))
+STAGE_SECONDS = METRICS.histogram("cross_stitch_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+CACHE_LOOKUPS = METRICS.counter("cross_stitch_cache_lookups_total", "Result cache lookups.", ("result",))
+FETCHES = METRICS.counter("cross_stitch_fetches_total", "Image URL fetches by outcome.", ("result",))
+BYTES_IN = METRICS.counter("cross_stitch_bytes_in_total", "Request body bytes received.", ("route",))
+BYTES_OUT = METRICS.counter("cross_stitch_bytes_out_total", "Response body bytes sent.", ("route",))
+
+def observe_stages(durations: Dict[str, float]) -> None:
+    for name, seconds in durations.items():
+        STAGE_SECONDS.observe(seconds, name)
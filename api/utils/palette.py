@@ -0,0 +1,88 @@
+# api/utils/palette.py
+"""Prebuilt palette arrays: RGB, Lab and |Lab|^2 per thread.
+
+The arrays are generated from DMC once, at build time, and workers read them
+with a single np.fromfile instead of converting the palette on start:
+
+    python -m api.utils.palette build
+
+The file (about 16 KB) is checked in; rebuild it whenever palette_dmc.py
+changes. Like the lookup table it carries the palette checksum, so a missing
+or stale file just means the arrays are computed in process.
+"""
+import argparse
+import os
+import sys
+from functools import lru_cache
+from typing import Dict
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
+
+from ..palette_dmc import DMC, PALETTE_VERSION
+
+MAGIC = b"DMCPAL2\0"
+HEADER = 128  # magic(8) + pad(8) + checksum(64 ascii) + pad
+# one fixed-size record per thread, so the file is read with one np.fromfile
+DTYPE = [("rgb", "u1", (3,)), ("lab", "<f8", (3,)), ("sq", "<f8")]
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "dmc_palette.bin")
+PALETTE_PATH = os.environ.get("CROSS_STITCH_PALETTE", DEFAULT_PATH)
+
+def compute_palette() -> "np.ndarray":
+    from .color import rgb_to_lab_np
+    rec = np.zeros(len(DMC), dtype=DTYPE)
+    rec["rgb"] = [[c["r"], c["g"], c["b"]] for c in DMC]
+    rec["lab"] = rgb_to_lab_np(rec["rgb"]).astype(np.float64)
+    rec["sq"] = np.einsum("ij,ij->i", rec["lab"], rec["lab"])
+    return rec
+
+def build_palette(path: str = PALETTE_PATH) -> str:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.write((MAGIC + b"\0" * 8 + PALETTE_VERSION.encode("ascii")).ljust(HEADER, b"\0"))
+        fh.write(compute_palette().tobytes())
+    os.replace(tmp, path)
+    return path
+
+def read_palette(path: str, checksum: str = PALETTE_VERSION) -> "np.ndarray":
+    with open(path, "rb") as fh:
+        head = fh.read(HEADER)
+        if len(head) < HEADER or head[:8] != MAGIC:
+            raise ValueError(f"{path}: not a palette file")
+        stored = head[16:80].decode("ascii")
+        if stored != checksum:
+            raise ValueError(f"{path}: built for palette {stored[:12]}, current is {checksum[:12]}")
+        rec = np.fromfile(fh, dtype=DTYPE)
+    if rec.size != len(DMC):
+        raise ValueError(f"{path}: truncated")
+    return rec
+
+@lru_cache(maxsize=1)
+def load_palette() -> Dict[str, "np.ndarray"]:
+    """Palette arrays from the prebuilt file, or computed from DMC if it is missing or stale."""
+    rec = None
+    if PALETTE_PATH and os.path.exists(PALETTE_PATH):
+        try:
+            rec = read_palette(PALETTE_PATH)
+        except (OSError, ValueError) as e:
+            print(f"[palette] ignoring {PALETTE_PATH}: {e}", file=sys.stderr)
+    if rec is None:
+        rec = compute_palette()
+    return {name: np.ascontiguousarray(rec[name]) for name, *_ in DTYPE}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m api.utils.palette")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="write the prebuilt palette arrays")
+    b.add_argument("--out", default=PALETTE_PATH)
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        print(build_palette(args.out))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# api/utils/palettes.py
+"""Thread palette registry: built-in DMC, brand palettes from JSON files, and subsets.
+
+A palette file in CROSS_STITCH_PALETTE_DIR (default api/palettes) is named
+after the palette and holds
+
+    {"brand": "Anchor", "threads": [{"code": "1", "name": "White", "r": 255, "g": 255, "b": 255}, ...]}
+
+Each palette is loaded once per process and builds its search arrays (RGB,
+Lab, |Lab|^2) on first use; DMC reads them from the prebuilt file and also
+has the shared lookup table. A subset (the threads a customer owns) is a
+view of a base palette: its arrays are sliced from the base, its labels are
+base indices, and subsets live in a small LRU since they are many and
+short-lived.
+
+CROSS_STITCH_PALETTE_DIR    directory of brand palette files
+CROSS_STITCH_PALETTE_CACHE  subsets kept in memory (default 64)
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None  # type: ignore
+
+from ..palette_dmc import DMC, PALETTE_VERSION, palette_checksum
+
+PALETTE_DIR = os.environ.get("CROSS_STITCH_PALETTE_DIR",
+                             os.path.join(os.path.dirname(os.path.dirname(__file__)), "palettes"))
+SUBSET_CACHE = int(os.environ.get("CROSS_STITCH_PALETTE_CACHE", 64))
+DEFAULT_PALETTE = "dmc"
+
+_NAME_RE = re.compile(r"[a-z0-9][a-z0-9_-]*")
+
+class UnknownPalette(ValueError):
+    pass
+
+class Palette:
+    def __init__(self, name: str, brand: str, threads: List[Dict], version: str,
+                 base: Optional["Palette"] = None, members: Optional[List[int]] = None):
+        self.name, self.brand, self.threads, self.version = name, brand, threads, version
+        self.base = base or self
+        # base index of each thread; None for a full palette (identity)
+        self.members = members
+        self._np = self._py = None
+
+    def __len__(self) -> int:
+        return len(self.threads)
+
+    @property
+    def is_dmc(self) -> bool:
+        return self.base is self and self.version == PALETTE_VERSION
+
+    def ids(self) -> "np.ndarray":
+        return np.asarray(self.members, dtype=np.int32) if self.members is not None \
+            else np.arange(len(self.threads), dtype=np.int32)
+
+    def arrays(self) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """(RGB uint8, Lab float64, |Lab|^2) per thread, built on first use."""
+        if self._np is None:
+            if self.members is not None:
+                sel = self.ids()
+                self._np = tuple(np.ascontiguousarray(a[sel]) for a in self.base.arrays())
+            elif self.is_dmc:
+                from .palette import load_palette
+                p = load_palette()
+                self._np = (p["rgb"], p["lab"], p["sq"])
+            else:
+                from .color import rgb_to_lab_np
+                rgb = np.array([[t["r"], t["g"], t["b"]] for t in self.threads], dtype=np.uint8).reshape(-1, 3)
+                lab = rgb_to_lab_np(rgb).astype(np.float64)
+                self._np = (rgb, lab, np.einsum("ij,ij->i", lab, lab))
+        return self._np
+
+    def py(self) -> Tuple[List[Tuple[int, int, int]], List[Tuple[float, float, float]]]:
+        if self._py is None:
+            from .color import rgb_to_lab_tuple
+            rgb = [(t["r"], t["g"], t["b"]) for t in self.threads]
+            self._py = (rgb, [rgb_to_lab_tuple(c) for c in rgb])
+        return self._py
+
+    def lut(self):
+        """Shared RGB lookup table; only the built-in DMC palette has one."""
+        if not self.is_dmc:
+            return None
+        from .lut import get_lut
+        return get_lut()
+
+    def subset(self, codes: Iterable[str]) -> "Palette":
+        index = {t["code"].lower(): i for i, t in enumerate(self.threads)}
+        codes = [c.strip() for c in codes if c.strip()]
+        missing = [c for c in codes if c.lower() not in index]
+        if missing:
+            more = f" and {len(missing) - 5} more" if len(missing) > 5 else ""
+            raise UnknownPalette(f"unknown {self.brand} thread codes: {', '.join(missing[:5])}{more}")
+        members = sorted({index[c.lower()] for c in codes})
+        if not members:
+            raise UnknownPalette("threads must list at least one thread code")
+        version = hashlib.sha256(f"{self.version}:{members}".encode("ascii")).hexdigest()
+        return Palette(self.name, self.brand, [self.threads[i] for i in members], version, self, members)
+
+    def describe(self) -> Dict:
+        return {"name": self.name, "brand": self.brand, "threads": len(self.threads)}
+
+def _validate(name: str, data: Dict) -> Palette:
+    threads = data.get("threads") if isinstance(data, dict) else None
+    if not isinstance(threads, list) or not threads:
+        raise ValueError(f"palette {name!r}: 'threads' must be a non-empty list")
+    out = []
+    for n, t in enumerate(threads):
+        if not isinstance(t, dict):
+            raise ValueError(f"palette {name!r}: thread #{n} must be an object")
+        which = f"thread {t['code']!r}" if "code" in t else f"thread #{n}"
+        missing = [k for k in ("code", "r", "g", "b") if k not in t]
+        if missing:
+            raise ValueError(f"palette {name!r}: {which} is missing {', '.join(missing)}")
+        try:
+            r, g, b = (int(t[k]) for k in ("r", "g", "b"))
+        except (TypeError, ValueError):
+            raise ValueError(f"palette {name!r}: {which} has a non-integer channel") from None
+        if not all(0 <= v <= 255 for v in (r, g, b)):
+            raise ValueError(f"palette {name!r}: {which} has a channel outside 0-255")
+        out.append({"code": str(t["code"]), "name": str(t.get("name", t["code"])), "r": r, "g": g, "b": b})
+    if len({t["code"].lower() for t in out}) != len(out):
+        raise ValueError(f"palette {name!r}: thread codes must be unique")
+    return Palette(name, str(data.get("brand", name)), out, palette_checksum(out))
+
+_lock = threading.Lock()
+_palettes: Dict[str, Palette] = {DEFAULT_PALETTE: Palette(DEFAULT_PALETTE, "DMC", DMC, PALETTE_VERSION)}
+_subsets: "OrderedDict[Tuple[str, Tuple[str, ...]], Palette]" = OrderedDict()
+
+def palette_names() -> List[str]:
+    names = set(_palettes)
+    if PALETTE_DIR and os.path.isdir(PALETTE_DIR):
+        names.update(f[:-5] for f in os.listdir(PALETTE_DIR) if f.endswith(".json") and _NAME_RE.fullmatch(f[:-5]))
+    return sorted(names)
+
+def _load(name: str) -> Palette:
+    with _lock:
+        pal = _palettes.get(name)
+    if pal is not None:
+        return pal
+    path = os.path.join(PALETTE_DIR or "", name + ".json")
+    if not _NAME_RE.fullmatch(name) or not PALETTE_DIR or not os.path.isfile(path):
+        raise UnknownPalette(f"unknown palette {name!r}; available: {', '.join(palette_names())}")
+    with open(path, "r", encoding="utf-8") as fh:
+        pal = _validate(name, json.load(fh))
+    with _lock:
+        return _palettes.setdefault(name, pal)
+
+def get_palette(name: Optional[str] = None, threads: Optional[Iterable[str]] = None) -> Palette:
+    """A registered palette, or the subset of it given by thread codes."""
+    pal = _load((name or DEFAULT_PALETTE).lower())
+    if not threads:
+        return pal
+    key = (pal.name, tuple(sorted({c.strip().lower() for c in threads if c.strip()})))
+    with _lock:
+        sub = _subsets.get(key)
+        if sub is not None:
+            _subsets.move_to_end(key)
+            return sub
+    sub = pal.subset(threads)
+    with _lock:
+        _subsets[key] = sub
+        while len(_subsets) > max(0, SUBSET_CACHE):
+            _subsets.popitem(last=False)
+    return sub
+
+def parse_threads(raw: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Thread codes from a comma or whitespace separated form field."""
+    if raw is None:
+        return None
+    codes = tuple(c for c in re.split(r"[\s,]+", raw) if c)
+    return codes or None
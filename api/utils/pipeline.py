@@ -0,0 +1,85 @@
+# api/utils/pipeline.py
+from typing import Dict, List, Optional, Sequence
+from PIL import Image
+
+from .quantize import map_palette_lab, map_palette_lab_batch, labels_image, HAS_NUMPY
+from .chart import render_chart, chart_colors, chart_bands, chart_size, chart_weights, assign_symbols
+from .encode import png_bytes, png_stream, chart_palette, ColorIndex, PNG_MODE, PNG_LEVEL
+from .metrics import stage
+from .palettes import DEFAULT_PALETTE, get_palette
+from .tiles import TILED_MIN_CELLS
+
+def _render(qimg: Image.Image, legend: List[Dict], labels, png_mode: str, png_level: int,
+            palette: str = DEFAULT_PALETTE) -> Dict:
+    w_cells, h_cells = qimg.size
+    if w_cells * h_cells > TILED_MIN_CELLS:
+        png = _render_bands(qimg, legend, png_mode, png_level)
+    else:
+        with stage("chart"):
+            chart = render_chart(qimg, legend)
+        with stage("png"):
+            png = png_bytes(chart, png_mode, png_level, keep=chart_colors(legend))
+    return {"width": w_cells, "height": h_cells, "palette": palette, "palette_used": legend,
+            "labels": labels, "png": png}
+
+def _render_bands(qimg: Image.Image, legend: List[Dict], png_mode: str, png_level: int) -> bytes:
+    """Large charts: rendered and deflated a band at a time, never held as one raster."""
+    assign_symbols(legend)
+    palette = None
+    if png_mode == "indexed" and HAS_NUMPY:
+        with stage("chart"):
+            palette = chart_palette(chart_colors(legend), chart_weights(legend))
+    index = ColorIndex(palette) if palette is not None else None
+    W, H = chart_size(*qimg.size, len(legend))
+    with stage("png"):
+        return png_stream(chart_bands(qimg, legend, index), W, H, palette, png_level)
+
+def render_cost(w_cells: int, h_cells: int) -> int:
+    """Rough peak bytes build_pattern needs for a w x h cell pattern (measured
+    peak RSS): the whole-chart path holds several chart-sized rasters, the
+    banded one only a band and the per-cell arrays."""
+    cells = w_cells * h_cells
+    if cells > TILED_MIN_CELLS:
+        return (12 << 20) + 320 * cells
+    return (12 << 20) + 14_000 * cells
+
+def build_pattern(img: Image.Image, png_mode: str = PNG_MODE, png_level: int = PNG_LEVEL,
+                  max_colors: Optional[int] = None, dither: str = "none",
+                  palette: str = DEFAULT_PALETTE, threads: Optional[Sequence[str]] = None,
+                  metric: str = "cie76") -> Dict:
+    """Quantize, clean up, render and encode an already resized image.
+
+    The palette is passed by name (and thread codes for a subset) so jobs
+    pickle cheaply; each worker resolves it from its own registry.
+    """
+    pal = get_palette(palette, threads)
+    return _render(*map_palette_lab(img, max_colors=max_colors, dither=dither, pal=pal, metric=metric), png_mode, png_level,
+                   pal.name)
+
+def build_patterns(imgs: List[Image.Image], png_mode: str = PNG_MODE, png_level: int = PNG_LEVEL,
+                   max_colors: Optional[int] = None, dither: str = "none",
+                   palette: str = DEFAULT_PALETTE, threads: Optional[Sequence[str]] = None,
+                   metric: str = "cie76") -> List[Dict]:
+    """build_pattern for several images, sharing one vectorized palette search."""
+    pal = get_palette(palette, threads)
+    maps = map_palette_lab_batch(imgs, max_colors=max_colors, dither=dither, pal=pal, metric=metric)
+    return [_render(*m, png_mode, png_level, pal.name) for m in maps]
+
+def render_result(entry: Dict, png_mode: str = PNG_MODE, png_level: int = PNG_LEVEL) -> Dict:
+    """Entry with its full chart rendered from labels and legend (edited results)."""
+    name = entry.get("palette", DEFAULT_PALETTE)
+    return _render(labels_image(entry["labels"], get_palette(name)), entry["palette_used"], entry["labels"],
+                   png_mode, png_level, name)
+
+def warm() -> None:
+    """Build the per-process palette, lookup table and font state ahead of the first job."""
+    from .quantize import _palette_np, _palette_py
+    from .lut import get_lut
+    from .chart import _font
+    if HAS_NUMPY:
+        _palette_np()
+        get_lut()
+    else:
+        _palette_py()
+    _font(12)
+    _font(16)
@@ -1,4 +1,6 @@
-from typing import List, Dict
+import heapq
+import os
+from typing import List, Dict, Optional
 from collections import deque, Counter
 from PIL import Image
 try:
@@ -8,41 +10,389 @@ except Exception:
     HAS_NUMPY = False
     np = None  # type: ignore
 
-from .color import rgb_to_lab_tuple, rgb_to_lab_np, HAS_NUMPY as COLOR_HAS_NUMPY
-from ..palette_dmc import DMC
+from .color import rgb_to_lab_tuple, rgb_to_lab_np, ciede2000_tuple, ciede2000_np, HAS_NUMPY as COLOR_HAS_NUMPY
+from .metrics import stage
+from .palettes import Palette, get_palette
+from .tiles import TILED_MIN_CELLS, bands, tile_map
+from .dither import DITHER_MODES, dither as _dither
 
 HAS_NUMPY = HAS_NUMPY and COLOR_HAS_NUMPY  # single flag
 
+# Upper bound (bytes) on the per-chunk temporaries of the palette search.
+MEM_BUDGET = int(os.environ.get("CROSS_STITCH_MEM_BUDGET", 8 << 20))
+
+COLOR_METRICS = ("cie76", "ciede2000")
+# CIEDE2000 is evaluated only on this many CIE76-nearest threads per colour.
+# 16 finds the exact CIEDE2000 match for all but ~1e-4 of photo colours (off
+# by < 0.25 dE when it misses); only saturated colours far outside the thread
+# gamut need more.
+DE2000_CANDIDATES = max(1, int(os.environ.get("CROSS_STITCH_DE2000_CANDIDATES", 16)))
+
+def _palette_np(pal: Optional[Palette] = None):
+    return (pal or get_palette()).arrays()
+
+def _palette_py(pal: Optional[Palette] = None):
+    return (pal or get_palette()).py()
+
+def _nearest(rows: "np.ndarray", pal_lab: "np.ndarray", pal_sq: "np.ndarray",
+             mem_budget: Optional[int] = None, rgb: bool = True, metric: str = "cie76") -> "np.ndarray":
+    """Nearest palette row per input row (uint8 RGB, or Lab with rgb=False), via
+    ||a||^2 - 2a.b + ||b||^2 in bounded chunks.
+
+    ||a||^2 is constant per row, so only -2a.b + ||b||^2 enters the argmin.
+    With metric="ciede2000" those CIE76 distances only pick candidates for
+    the CIEDE2000 comparison.
+    """
+    n, k = rows.shape[0], pal_lab.shape[0]
+    cand = min(DE2000_CANDIDATES, k) if metric == "ciede2000" else 0
+    budget = MEM_BUDGET if mem_budget is None else int(mem_budget)
+    # per row: float64 distance row + float32/float64 Lab temporaries
+    # (+ the float64 CIEDE2000 temporaries per candidate)
+    chunk = max(256, budget // (8 * k + 64 + 256 * cand))
+    pal_t = -2.0 * pal_lab.T
+    out = np.empty(n, dtype=np.int32)
+    for s in range(0, n, chunk):
+        part = rows[s:s + chunk]
+        if rgb:
+            with stage("lab"):
+                lab = rgb_to_lab_np(part).astype(np.float64)
+        else:
+            lab = part.astype(np.float64)
+        d2 = lab @ pal_t
+        d2 += pal_sq
+        out[s:s + chunk] = _rerank(lab, d2, pal_lab, cand) if cand else d2.argmin(axis=1)
+    return out
+
+def _rerank(lab: "np.ndarray", d2: "np.ndarray", pal_lab: "np.ndarray", cand: int) -> "np.ndarray":
+    """Per row, the CIEDE2000-nearest of its `cand` CIE76-nearest palette rows."""
+    if cand < d2.shape[1]:
+        top = np.argpartition(d2, cand - 1, axis=1)[:, :cand]
+    else:
+        top = np.broadcast_to(np.arange(d2.shape[1]), d2.shape)
+    de = ciede2000_np(lab[:, None, :], pal_lab[top])
+    return np.take_along_axis(top, de.argmin(axis=1)[:, None], axis=1)[:, 0]
+
+def _nearest_palette(rgb_flat: "np.ndarray", mem_budget: Optional[int] = None,
+                     pal: Optional[Palette] = None, metric: str = "cie76") -> "np.ndarray":
+    """Nearest thread (position in `pal`, DMC by default) per RGB row."""
+    _, pal_lab, pal_sq = _palette_np(pal)
+    return _nearest(rgb_flat, pal_lab, pal_sq, mem_budget, metric=metric)
+
+def _nearest_indices(rgb_flat: "np.ndarray", mem_budget: Optional[int] = None,
+                     pal: Optional[Palette] = None, metric: str = "cie76") -> "np.ndarray":
+    # the lookup table holds CIE76 answers
+    lut = (pal or get_palette()).lut() if metric == "cie76" else None
+    if lut is None:
+        return _nearest_palette(rgb_flat, mem_budget, pal, metric)
+    idx = lut.lookup(rgb_flat)
+    miss = idx < 0
+    if miss.any():
+        idx[miss] = _nearest_palette(rgb_flat[miss], mem_budget, pal)
+    return idx
+
+def _kmeans_weighted(x: "np.ndarray", w: "np.ndarray", k: int, iters: int = 20) -> "np.ndarray":
+    """k centroids of the weighted points x (deterministic k-means++ seeding)."""
+    rng = np.random.default_rng(0)
+    p = w / w.sum()
+    cent = [x[rng.choice(len(x), p=p)]]
+    d2 = ((x - cent[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        q = w * d2
+        if q.sum() <= 0:
+            break
+        cent.append(x[rng.choice(len(x), p=q / q.sum())])
+        d2 = np.minimum(d2, ((x - cent[-1]) ** 2).sum(axis=1))
+    c = np.array(cent)
+    for _ in range(iters):
+        a = _nearest(x, c, (c * c).sum(axis=1), rgb=False)
+        tot = np.bincount(a, weights=w, minlength=len(c))
+        new = np.stack([np.bincount(a, weights=w * x[:, j], minlength=len(c)) for j in range(3)], axis=1)
+        live = tot > 0
+        new[live] /= tot[live, None]
+        new[~live] = c[~live]
+        if np.allclose(new, c, atol=1e-3):
+            break
+        c = new
+    return c
+
+def _nearest_py(pixels, pal_lab, metric: str = "cie76") -> List[int]:
+    """Pure-Python nearest palette index per RGB tuple, searching each distinct colour once."""
+    memo: Dict[tuple, int] = {}
+    labels_flat = []
+    for rgb in pixels:
+        best_i = memo.get(rgb)
+        if best_i is None:
+            lab = rgb_to_lab_tuple(rgb)
+            best_i = _nearest_lab_py(lab, pal_lab, range(len(pal_lab)), metric)
+            memo[rgb] = best_i
+        labels_flat.append(best_i)
+    return labels_flat
+
+def _nearest_lab_py(lab, pal_lab, among, metric: str = "cie76") -> int:
+    """Index from `among` of the palette Lab colour nearest to `lab`."""
+    L1, a1, b1 = lab
+    d2 = lambda i: (L1-pal_lab[i][0])**2 + (a1-pal_lab[i][1])**2 + (b1-pal_lab[i][2])**2
+    if metric != "ciede2000":
+        return min(among, key=d2)
+    return min(heapq.nsmallest(DE2000_CANDIDATES, among, key=d2), key=lambda i: ciede2000_tuple(lab, pal_lab[i]))
+
+def _unique_colors(rgb_flat: "np.ndarray"):
+    """(distinct RGB rows, inverse index per pixel, pixel count per distinct colour),
+    distinct colours in packed 0xRRGGBB order."""
+    packed = (rgb_flat[:, 0].astype(np.uint32) << 16) | (rgb_flat[:, 1].astype(np.uint32) << 8) | rgb_flat[:, 2]
+    uniq, inv, counts = np.unique(packed, return_inverse=True, return_counts=True)
+    rgb = np.empty((uniq.size, 3), dtype=np.uint8)
+    rgb[:, 0], rgb[:, 1], rgb[:, 2] = uniq >> 16, (uniq >> 8) & 0xFF, uniq & 0xFF
+    return rgb, inv.reshape(-1), counts
+
+def _choose_threads(uniq_rgb: "np.ndarray", counts: "np.ndarray", idx_u: "np.ndarray", max_colors: int,
+                    mem_budget: Optional[int] = None, pal: Optional[Palette] = None, metric: str = "cie76"):
+    """(chosen palette positions, Lab of the distinct colours) for a max_colors
+    limit, or None when the image already uses few enough threads.
+
+    Weighted k-means in Lab over the distinct colours of the image, centroids
+    snapped to the palette.
+    """
+    if max_colors <= 0 or np.unique(idx_u).size <= max_colors:
+        return None
+    lab_u = rgb_to_lab_np(uniq_rgb).astype(np.float64)
+    _, pal_lab, pal_sq = _palette_np(pal)
+    cent = _kmeans_weighted(lab_u, counts.astype(np.float64), max_colors)
+    chosen = np.unique(_nearest(cent, pal_lab, pal_sq, mem_budget, rgb=False, metric=metric))
+    return chosen, lab_u
+
+def _limit_colors(uniq_rgb: "np.ndarray", counts: "np.ndarray", idx_u: "np.ndarray", max_colors: int,
+                  mem_budget: Optional[int] = None, pal: Optional[Palette] = None,
+                  metric: str = "cie76") -> "np.ndarray":
+    """Remap per-colour labels so at most max_colors threads are used: each
+    distinct colour goes to the nearest chosen thread."""
+    pick = _choose_threads(uniq_rgb, counts, idx_u, max_colors, mem_budget, pal, metric)
+    if pick is None:
+        return idx_u
+    chosen, lab_u = pick
+    _, pal_lab, pal_sq = _palette_np(pal)
+    sub = _nearest(lab_u, pal_lab[chosen], pal_sq[chosen], mem_budget, rgb=False, metric=metric)
+    return chosen[sub].astype(np.int32)
+
+def _dither_indices(arr: "np.ndarray", mode: str, chosen: Optional["np.ndarray"],
+                    mem_budget: Optional[int] = None, pal: Optional[Palette] = None,
+                    metric: str = "cie76") -> "np.ndarray":
+    """Dithered labels (H, W) for an RGB array, restricted to the `chosen`
+    threads when given."""
+    H, W, _ = arr.shape
+    _, pal_lab, pal_sq = _palette_np(pal)
+    if chosen is None:
+        chosen = np.arange(len(pal_lab))
+    sub_lab, sub_sq = pal_lab[chosen], pal_sq[chosen]
+    nearest = lambda rows: _nearest(rows, sub_lab, sub_sq, mem_budget, rgb=False, metric=metric)
+    with stage("lab"):
+        lab = rgb_to_lab_np(arr.reshape(-1, 3)).astype(np.float64).reshape(H, W, 3)
+    with stage("dither"):
+        return chosen[_dither(lab, mode, nearest, sub_lab)].astype(np.int32)
+
+def _map_colors(flat: "np.ndarray", idx_u: "np.ndarray", uniq, max_colors: Optional[int], dither: str,
+                shape, mem_budget: Optional[int] = None, pal: Optional[Palette] = None, metric: str = "cie76"):
+    """Palette image, legend and labels for one image from its per-colour search results."""
+    pal = pal or get_palette()
+    uniq_rgb, inv, ucounts = uniq
+    if dither != "none":
+        chosen = None
+        if max_colors:
+            pick = _choose_threads(uniq_rgb, ucounts, idx_u, max_colors, mem_budget, pal, metric)
+            chosen = pick[0] if pick is not None else None
+        # speckle cleanup would erase the dither pattern
+        return _finish_np(_dither_indices(flat.reshape(*shape, 3), dither, chosen, mem_budget, pal, metric),
+                          cleanup=False, pal=pal)
+    if max_colors:
+        with stage("search"):
+            idx_u = _limit_colors(uniq_rgb, ucounts, idx_u, max_colors, mem_budget, pal, metric)
+    counts = np.bincount(idx_u, weights=ucounts, minlength=len(pal)).astype(np.int64)
+    return _finish_np(idx_u[inv].reshape(shape), counts=counts, pal=pal)
+
+# BFS neighbour order of the reference cleanup: down, up, right, left.
+_DIRS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+def _neighbour_pairs(cells: "np.ndarray", H: int, W: int):
+    """(src, dst, dir) flat-index arrays for every in-bounds 4-neighbour step out of `cells`."""
+    y, x = np.divmod(cells, W)
+    src, dst, dirs = [], [], []
+    for d, (dy, dx) in enumerate(_DIRS):
+        ok = (y + dy >= 0) & (y + dy < H) & (x + dx >= 0) & (x + dx < W)
+        s = cells[ok]
+        src.append(s)
+        dst.append(s + dy * W + dx)
+        dirs.append(np.full(s.size, d, dtype=np.int8))
+    return np.concatenate(src), np.concatenate(dst), np.concatenate(dirs)
+
+# rows per band when a large grid's components are labelled in parallel
+COMPONENT_BAND = 64
+
+def _components(lab: "np.ndarray") -> "np.ndarray":
+    """Root (smallest flat index) of each cell's 4-connected same-label component.
+
+    Large grids are labelled a band of rows at a time on the tile threads;
+    the bands' forests are then joined across the seams with the same
+    union-find, which keeps every root the component's smallest index.
+    """
+    H, W = lab.shape
+    if H * W <= TILED_MIN_CELLS or H <= COMPONENT_BAND:
+        return _components_band(lab, 0)
+    parts = bands(H, COMPONENT_BAND)
+    parent = np.concatenate(tile_map(lambda b: _components_band(lab[b[0]:b[1]], b[0] * W), parts))
+    # equal labels on either side of a seam: last row of one band, first of the next
+    u = (np.array([y1 for _, y1 in parts[:-1]])[:, None] * W - W + np.arange(W)).ravel()
+    flat = lab.reshape(-1)
+    u = u[flat[u] == flat[u + W]]
+    return _union(parent, u, u + W)
+
+def _components_band(lab: "np.ndarray", offset: int) -> "np.ndarray":
+    H, W = lab.shape
+    idx = np.arange(H * W).reshape(H, W)
+    h = lab[:, 1:] == lab[:, :-1]
+    v = lab[1:] == lab[:-1]
+    u = np.concatenate([idx[:, :-1][h], idx[:-1][v]])
+    w = np.concatenate([idx[:, 1:][h], idx[1:][v]])
+    return _union(np.arange(H * W), u, w) + offset
+
+def _union(parent: "np.ndarray", u: "np.ndarray", w: "np.ndarray") -> "np.ndarray":
+    """Array union-find over a flat forest: hook the larger root under the
+    smaller across every unsatisfied edge, then pointer-jump until flat."""
+    while u.size:
+        pu, pw = parent[u], parent[w]
+        live = pu != pw
+        if not live.any():
+            break
+        u, w, pu, pw = u[live], w[live], pu[live], pw[live]
+        np.minimum.at(parent, np.maximum(pu, pw), np.minimum(pu, pw))
+        while True:
+            pp = parent[parent]
+            if np.array_equal(pp, parent):
+                break
+            parent = pp
+    return parent
+
+def _bfs_rank(root: "np.ndarray", cells: "np.ndarray", src, dst, dirs) -> "np.ndarray":
+    """Position of each cell in its component's BFS queue (started at the root),
+    computed a level at a time for all components at once."""
+    n = root.size
+    rank = np.full(n, -1, dtype=np.int64)
+    seen = np.zeros(n, dtype=np.int64)
+    on = np.zeros(n, dtype=bool)
+    on[cells] = True
+    keep = on[src] & (root[src] == root[dst])
+    src, dst, dirs = src[keep], dst[keep], dirs[keep]
+    frontier = cells[root[cells] == cells]
+    rank[frontier] = 0
+    seen[frontier] = 1
+    level = np.zeros(n, dtype=bool)
+    while frontier.size:
+        level[:] = False
+        level[frontier] = True
+        e = level[src] & (rank[dst] < 0)
+        if not e.any():
+            break
+        s, t = src[e], dst[e]
+        key = rank[s] * 4 + dirs[e]
+        # a cell is discovered by the earliest (parent, direction) that reaches it
+        o = np.lexsort((key, t))
+        t, key = t[o], key[o]
+        first = np.ones(t.size, dtype=bool)
+        first[1:] = t[1:] != t[:-1]
+        t, key = t[first], key[first]
+        c = root[t]
+        o = np.lexsort((key, c))
+        t, c = t[o], c[o]
+        start = np.ones(c.size, dtype=bool)
+        start[1:] = c[1:] != c[:-1]
+        pos = np.arange(c.size) - np.maximum.accumulate(np.where(start, np.arange(c.size), 0))
+        rank[t] = seen[c] + pos
+        seen += np.bincount(c, minlength=n)
+        frontier = t
+    return rank
+
+def _gather(start: "np.ndarray", count: "np.ndarray", sel: "np.ndarray") -> "np.ndarray":
+    """Concatenated index ranges [start[i], start[i] + count[i]) for i in sel."""
+    c = count[sel]
+    return np.repeat(start[sel] - np.cumsum(c) + c, c) + np.arange(int(c.sum()))
+
+def _speckle_cleanup_np(labels: "np.ndarray", min_size: int = 4) -> "np.ndarray":
+    """Whole-array equivalent of the sequential BFS cleanup.
+
+    Components smaller than min_size take the most frequent label along their
+    border (ties go to the label seen first in BFS order). A component that
+    touches an earlier small component sees that neighbour's merged label, so
+    such components are resolved in waves once their earlier neighbours are.
+    """
+    H, W = labels.shape
+    lab = labels.copy()
+    if H * W == 0:
+        return lab
+    flat = lab.reshape(-1)
+    root = _components(lab)
+    small = np.bincount(root, minlength=root.size)[root] < min_size
+    if not small.any():
+        return lab
+
+    # only steps out of small cells matter, so large grids never build all 4n of them
+    cells = np.flatnonzero(small)
+    src, dst, dirs = _neighbour_pairs(cells, H, W)
+    rank = _bfs_rank(root, cells, src, dst, dirs)
+
+    b = small[src] & (root[src] != root[dst])
+    src, dst = src[b], dst[b]
+    pos = rank[src] * 4 + dirs[b]
+    cs, cd = root[src], root[dst]
+    dep = small[dst] & (cd < cs)
+    color = flat[src]
+    orig = flat[dst]
+
+    # Kahn-style waves over the "touches an earlier small component" edges:
+    # a component is voted on once every component it depends on has been.
+    n = flat.size
+    o = np.argsort(cs, kind="stable")
+    cs, cd, pos, dep, color, orig = cs[o], cd[o], pos[o], dep[o], color[o], orig[o]
+    e_start, e_count = np.searchsorted(cs, np.arange(n)), np.bincount(cs, minlength=n)
+    dcs, dcd = cs[dep], cd[dep]
+    indeg = np.bincount(dcs, minlength=n)
+    o = np.argsort(dcd, kind="stable")
+    waiters, dcd = dcs[o], dcd[o]
+    w_start, w_count = np.searchsorted(dcd, np.arange(n)), np.bincount(dcd, minlength=n)
+
+    target = flat.copy()  # indexed by component root; valid once resolved
+    resolved = np.zeros(n, dtype=bool)
+    L = int(flat.max()) + 1
+    comps = np.flatnonzero(e_count)
+    ready = comps[indeg[comps] == 0]
+    while ready.size:
+        e = _gather(e_start, e_count, ready)
+        r_cs, r_pos = cs[e], pos[e]
+        val = np.where(dep[e], target[cd[e]], orig[e])
+        border = val != color[e]
+        r_cs, r_pos, val = r_cs[border], r_pos[border], val[border]
+        if r_cs.size:
+            key = r_cs.astype(np.int64) * L + val
+            uk, inv, cnt = np.unique(key, return_inverse=True, return_counts=True)
+            first = np.full(uk.size, np.iinfo(np.int64).max)
+            np.minimum.at(first, inv, r_pos)
+            comp, lbl = uk // L, uk % L
+            # per component: highest count, then earliest first occurrence
+            o = np.lexsort((first, -cnt, comp))
+            comp, lbl = comp[o], lbl[o]
+            win = np.ones(comp.size, dtype=bool)
+            win[1:] = comp[1:] != comp[:-1]
+            target[comp[win]] = lbl[win]
+        resolved[ready] = True
+        nxt, dec = np.unique(waiters[_gather(w_start, w_count, ready)], return_counts=True)
+        indeg[nxt] -= dec
+        ready = nxt[indeg[nxt] == 0]
+
+    merge = small & resolved[root]
+    flat[merge] = target[root[merge]]
+    return lab
+
 def _speckle_cleanup(labels, min_size: int = 4):
     if HAS_NUMPY and isinstance(labels, np.ndarray):
-        H, W = labels.shape
-        visited = np.zeros((H, W), dtype=bool)
-        lab = labels.copy()
-        dirs = ((1,0), (-1,0), (0,1), (0,-1))
-        for y in range(H):
-            for x in range(W):
-                if visited[y, x]:
-                    continue
-                color = lab[y, x]
-                q = deque([(y, x)])
-                visited[y, x] = True
-                comp, border = [(y, x)], []
-                while q:
-                    cy, cx = q.popleft()
-                    for dy, dx in dirs:
-                        ny, nx = cy + dy, cx + dx
-                        if 0 <= ny < H and 0 <= nx < W:
-                            if lab[ny, nx] == color and not visited[ny, nx]:
-                                visited[ny, nx] = True
-                                q.append((ny, nx))
-                                comp.append((ny, nx))
-                            elif lab[ny, nx] != color:
-                                border.append(lab[ny, nx])
-                if len(comp) < min_size and border:
-                    target = Counter(border).most_common(1)[0][0]
-                    for (yy, xx) in comp:
-                        lab[yy, xx] = target
-        return lab
+        return _speckle_cleanup_np(labels, min_size)
     else:
         h = len(labels); w = len(labels[0]) if h else 0
         visited = [[False]*w for _ in range(h)]
@@ -72,51 +422,125 @@ def _speckle_cleanup(labels, min_size: int = 4):
                         labels[yy][xx] = target
         return labels
 
-def map_palette_lab(img: Image.Image):
+def _finish_np(labels: "np.ndarray", cleanup: bool = True, counts: Optional["np.ndarray"] = None,
+               pal: Optional[Palette] = None):
+    """Cleanup, palette image and legend for a grid of raw nearest-palette labels.
+
+    `counts` (uses per palette position before cleanup) is patched with just
+    the cells the cleanup changed instead of recounting the grid.
+    """
+    pal = pal or get_palette()
+    palette_rgb, _, _ = _palette_np(pal)
+    if cleanup:
+        with stage("cleanup"):
+            cleaned = _speckle_cleanup(labels, min_size=4)
+        if counts is not None:
+            changed = cleaned != labels
+            counts = counts - np.bincount(labels[changed], minlength=len(pal)) \
+                + np.bincount(cleaned[changed], minlength=len(pal))
+        labels = cleaned
+    with stage("legend"):
+        return _legend_np(labels, palette_rgb, counts, pal)
+
+def legend_item(pal: Palette, i: int, count: int) -> Dict:
+    """Legend row for thread position i of `pal`; "idx" is its index in the base palette."""
+    t = pal.threads[i]
+    return {
+        "idx": pal.members[i] if pal.members is not None else i,
+        "code": t["code"], "name": t["name"], "brand": pal.brand,
+        "r": int(t["r"]), "g": int(t["g"]), "b": int(t["b"]),
+        "count": int(count),
+    }
+
+def _legend_np(labels: "np.ndarray", palette_rgb: "np.ndarray", counts: Optional["np.ndarray"] = None,
+               pal: Optional[Palette] = None):
+    pal = pal or get_palette()
+    mapped = palette_rgb[labels]
+    out_img = Image.fromarray(mapped.astype(np.uint8), mode="RGB")
+
+    if counts is None:
+        counts = np.bincount(labels.reshape(-1), minlength=len(pal))
+    used_idx = [i for i, c in enumerate(counts) if c > 0]
+    legend = [legend_item(pal, i, counts[i]) for i in used_idx]
+    legend.sort(key=lambda x: x["count"], reverse=True)
+    if pal.members is not None:
+        # labels are base-palette indices, like the legend's "idx"
+        labels = pal.ids()[labels]
+    return out_img, legend, labels
+
+def labels_image(labels, pal: Optional[Palette] = None) -> Image.Image:
+    """Palette-coloured image (one pixel per cell) for a grid of (base) palette indices."""
+    pal = (pal or get_palette()).base
+    if HAS_NUMPY and isinstance(labels, np.ndarray):
+        return Image.fromarray(_palette_np(pal)[0][labels].astype(np.uint8), mode="RGB")
+    pal_rgb, _ = _palette_py(pal)
+    h = len(labels); w = len(labels[0]) if h else 0
+    out = Image.new("RGB", (w, h)); out.putdata([pal_rgb[i] for row in labels for i in row])
+    return out
+
+def _check_dither(dither: str) -> str:
+    dither = (dither or "none").lower()
+    if dither not in DITHER_MODES:
+        raise ValueError(f"dither must be one of {', '.join(DITHER_MODES)}")
+    if dither != "none" and not HAS_NUMPY:
+        raise ValueError("dithering requires NumPy")
+    return dither
+
+def _check_metric(metric: str) -> str:
+    metric = (metric or "cie76").lower()
+    if metric not in COLOR_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(COLOR_METRICS)}")
+    return metric
+
+def map_palette_lab_batch(imgs: List[Image.Image], mem_budget: Optional[int] = None,
+                          max_colors: Optional[int] = None, dither: str = "none",
+                          pal: Optional[Palette] = None, metric: str = "cie76"):
+    """map_palette_lab for several images with one palette search over all their colours."""
+    dither, metric = _check_dither(dither), _check_metric(metric)
+    if not HAS_NUMPY:
+        return [map_palette_lab(img, mem_budget, max_colors, pal=pal, metric=metric) for img in imgs]
+    arrs = [np.array(img, dtype=np.uint8) for img in imgs]
+    uniqs = [_unique_colors(a.reshape(-1, 3)) for a in arrs]
+    rgb = np.concatenate([u[0] for u in uniqs]) if uniqs else np.empty((0, 3), np.uint8)
+    with stage("search"):
+        idx = _nearest_indices(rgb, mem_budget, pal, metric)
+    out, start = [], 0
+    for a, u in zip(arrs, uniqs):
+        n = u[0].shape[0]
+        out.append(_map_colors(a.reshape(-1, 3), idx[start:start + n], u, max_colors, dither,
+                               a.shape[:2], mem_budget, pal, metric))
+        start += n
+    return out
+
+def map_palette_lab(img: Image.Image, mem_budget: Optional[int] = None, max_colors: Optional[int] = None,
+                    dither: str = "none", pal: Optional[Palette] = None, metric: str = "cie76"):
+    dither, metric = _check_dither(dither), _check_metric(metric)
+    pal = pal or get_palette()
     if HAS_NUMPY:
         arr = np.array(img, dtype=np.uint8)  # H,W,3
-        H, W, _ = arr.shape
-        img_lab = rgb_to_lab_np(arr.reshape(-1, 3)).reshape(H, W, 3)
-
-        palette_rgb = np.array([[c["r"], c["g"], c["b"]] for c in DMC], dtype=np.uint8)
-        palette_lab = rgb_to_lab_np(palette_rgb)
-
-        diffs = img_lab.reshape(-1, 3)[:, None, :] - palette_lab.reshape(1, -1, 3)
-        d2 = np.sum(diffs * diffs, axis=2)
-        labels = d2.argmin(axis=1).astype(np.int32).reshape(H, W)
-
-        labels = _speckle_cleanup(labels, min_size=4)
-        mapped = palette_rgb[labels]
-        out_img = Image.fromarray(mapped.astype(np.uint8), mode="RGB")
-
-        counts = np.bincount(labels.reshape(-1), minlength=len(DMC))
-        used_idx = [i for i, c in enumerate(counts) if c > 0]
-        legend = [{
-            "idx": i,
-            "code": DMC[i]["code"], "name": DMC[i]["name"],
-            "r": int(DMC[i]["r"]), "g": int(DMC[i]["g"]), "b": int(DMC[i]["b"]),
-            "count": int(counts[i]),
-        } for i in used_idx]
-        legend.sort(key=lambda x: x["count"], reverse=True)
-        return out_img, legend, labels
+        flat = arr.reshape(-1, 3)
+        # logos and cartoons repeat a few hundred colours: search each one once
+        with stage("search"):
+            uniq = _unique_colors(flat)
+            idx_u = _nearest_indices(uniq[0], mem_budget, pal, metric)
+        return _map_colors(flat, idx_u, uniq, max_colors, dither, arr.shape[:2], mem_budget, pal, metric)
     else:
         w, h = img.size
         pixels = list(img.getdata())
-        pal_rgb = [(c["r"], c["g"], c["b"]) for c in DMC]
-        pal_lab = [rgb_to_lab_tuple(rgb) for rgb in pal_rgb]
-
-        labels_flat = []
-        for (r, g, b) in pixels:
-            L1, a1, b1 = rgb_to_lab_tuple((r, g, b))
-            best_i, best_d2 = 0, 10**9
-            for i, (L2, a2, b2) in enumerate(pal_lab):
-                d2 = (L1-L2)**2 + (a1-a2)**2 + (b1-b2)**2
-                if d2 < best_d2:
-                    best_d2, best_i = d2, i
-            labels_flat.append(best_i)
+        pal_rgb, pal_lab = _palette_py(pal)
+
+        with stage("search"):
+            labels_flat = _nearest_py(pixels, pal_lab, metric)
+
+        if max_colors and len(set(labels_flat)) > max_colors:
+            # no NumPy: keep the most used threads, fold the rest into their nearest kept one
+            kept = [i for i, _ in Counter(labels_flat).most_common(max_colors)]
+            fold = {i: _nearest_lab_py(pal_lab[i], pal_lab, kept, metric) for i in set(labels_flat) - set(kept)}
+            labels_flat = [fold.get(i, i) for i in labels_flat]
 
         lab2d = [labels_flat[i*w:(i+1)*w] for i in range(h)]
-        lab2d = _speckle_cleanup(lab2d, min_size=4)
+        with stage("cleanup"):
+            lab2d = _speckle_cleanup(lab2d, min_size=4)
 
         mapped = [pal_rgb[idx] for row in lab2d for idx in row]
         out = Image.new("RGB", (w, h)); out.putdata(mapped)
@@ -124,11 +548,8 @@ def map_palette_lab(img: Image.Image):
         from collections import Counter as C
         counts = C([idx for row in lab2d for idx in row])
         used_idx = [i for i, c in counts.items() if c > 0]
-        legend = [{
-            "idx": i,
-            "code": DMC[i]["code"], "name": DMC[i]["name"],
-            "r": pal_rgb[i][0], "g": pal_rgb[i][1], "b": pal_rgb[i][2],
-            "count": int(counts[i]),
-        } for i in used_idx]
+        legend = [legend_item(pal, i, counts[i]) for i in used_idx]
         legend.sort(key=lambda x: x["count"], reverse=True)
+        if pal.members is not None:
+            lab2d = [[pal.members[i] for i in row] for row in lab2d]
         return out, legend, lab2d
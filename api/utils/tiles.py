@@ -0,0 +1,39 @@
+# api/utils/tiles.py
+"""Large-pattern mode: settings and the thread pool its tiles run on.
+
+Patterns with more than TILED_MIN_CELLS cells are cleaned up, rendered and
+PNG-encoded a band of rows at a time, so no whole-chart raster is ever
+built, and the per-band work (component labelling, deflate) runs on
+TILE_THREADS threads; NumPy and zlib release the GIL for it.
+
+CROSS_STITCH_TILED_MIN_CELLS  cells above which a pattern is processed in bands
+CROSS_STITCH_TILE_THREADS     threads per job for band work (default: min(4, CPUs))
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+TILED_MIN_CELLS = int(os.environ.get("CROSS_STITCH_TILED_MIN_CELLS", 100 * 100))
+TILE_THREADS = max(1, int(os.environ.get("CROSS_STITCH_TILE_THREADS", min(4, os.cpu_count() or 1))))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(TILE_THREADS, thread_name_prefix="cross-stitch-tile")
+        return _executor
+
+def tile_map(fn: Callable, items: Iterable) -> List:
+    items = list(items)
+    if TILE_THREADS == 1 or len(items) < 2:
+        return [fn(it) for it in items]
+    return list(executor().map(fn, items))
+
+def bands(n: int, size: int) -> List[Tuple[int, int]]:
+    """[start, stop) ranges of at most `size` covering range(n)."""
+    size = max(1, size)
+    return [(s, min(n, s + size)) for s in range(0, n, size)]
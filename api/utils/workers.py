@@ -0,0 +1,91 @@
+# api/utils/workers.py
+"""Run CPU-bound pipeline work off the event loop.
+
+CROSS_STITCH_EXECUTOR    "thread" (default) or "process"
+CROSS_STITCH_WORKERS     pool size (default: CPU count)
+CROSS_STITCH_QUEUE       jobs allowed to wait beyond the running ones
+CROSS_STITCH_JOB_TIMEOUT seconds a request waits for its job
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from .pipeline import warm
+
+EXECUTOR = os.environ.get("CROSS_STITCH_EXECUTOR", "thread")
+WORKERS = int(os.environ.get("CROSS_STITCH_WORKERS", os.cpu_count() or 1))
+QUEUE_SIZE = int(os.environ.get("CROSS_STITCH_QUEUE", 2 * WORKERS))
+JOB_TIMEOUT = float(os.environ.get("CROSS_STITCH_JOB_TIMEOUT", 60))
+
+class PoolBusy(RuntimeError):
+    pass
+
+class JobTimeout(TimeoutError):
+    pass
+
+class WorkerPool:
+    def __init__(self, kind: str = EXECUTOR, workers: int = WORKERS,
+                 queue_size: int = QUEUE_SIZE, timeout: float = JOB_TIMEOUT):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"unknown executor {kind!r}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.completed = self.rejected = self.timeouts = 0
+
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(self.workers, initializer=warm)
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="cross-stitch",
+                                                        initializer=warm)
+            return self._executor
+
+    def _done(self, _fut) -> None:
+        with self._lock:
+            self._inflight -= 1
+            self.completed += 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        # count a job until it really finishes, not until its caller gives up,
+        # so timed-out work still occupies a queue slot
+        with self._lock:
+            if self._inflight >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise PoolBusy("Server busy, try again shortly.")
+            self._inflight += 1
+        try:
+            fut = asyncio.get_running_loop().run_in_executor(self.executor(), fn, *args)
+        except BaseException:
+            with self._lock:
+                self._inflight -= 1
+            raise
+        fut.add_done_callback(self._done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise JobTimeout("Pattern generation timed out.")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"executor": self.kind, "workers": self.workers, "queue_size": self.queue_size,
+                    "inflight": self._inflight, "completed": self.completed,
+                    "rejected": self.rejected, "timeouts": self.timeouts}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+POOL = WorkerPool()
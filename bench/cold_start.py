@@ -0,0 +1,75 @@
+"""Cold-start cost: importing the app and serving the first request.
+
+    python bench/cold_start.py [--runs 7] [--compare-artifact]
+
+Every run is a fresh interpreter that imports api.cross_stitch, then sends
+two uploads through the ASGI app in process (no network, thread executor):
+the first pays for lazy initialisation (palette arrays, fonts, LUT), the
+second shows the steady state. --compare-artifact repeats the runs with the
+prebuilt palette file hidden, to show what it saves.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child() -> dict:
+    t0 = time.perf_counter()
+    from api.cross_stitch import app
+    t_import = time.perf_counter() - t0
+
+    import io
+    from fastapi.testclient import TestClient
+    from corpus import cartoon
+
+    buf = io.BytesIO()
+    cartoon(400).save(buf, format="PNG")
+    files = {"image": ("a.png", buf.getvalue(), "image/png")}
+    out = {"import_s": t_import}
+    with TestClient(app) as client:
+        for name, size in (("first_request_s", "80"), ("second_request_s", "81")):
+            t = time.perf_counter()
+            r = client.post("/api/cross_stitch", data={"max_size": size}, files=files)
+            out[name] = time.perf_counter() - t
+            r.raise_for_status()
+    out["import_to_first_response_s"] = out["import_s"] + out["first_request_s"]
+    return out
+
+def runs(n: int, env: dict):
+    rows = []
+    for _ in range(n):
+        res = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], cwd=ROOT, env=env,
+                             stdout=subprocess.PIPE, check=True)
+        rows.append(json.loads(res.stdout))
+    return {k: statistics.median(r[k] for r in rows) for k in rows[0]}
+
+def report(label: str, med: dict):
+    print(f"{label}")
+    for k, v in med.items():
+        print(f"  {k:<28}{v * 1000:>10.1f} ms")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python bench/cold_start.py")
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--compare-artifact", action="store_true")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+        json.dump(child(), sys.stdout)
+        return 0
+
+    env = dict(os.environ, CROSS_STITCH_EXECUTOR="thread", CROSS_STITCH_CACHE_DIR="")
+    report(f"median of {args.runs} runs", runs(args.runs, env))
+    if args.compare_artifact:
+        env["CROSS_STITCH_PALETTE"] = os.devnull + ".missing"
+        report("without the prebuilt palette", runs(args.runs, env))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""Deterministic synthetic images for the benchmarks.
+
+Built with Pillow and the stdlib only, so the same corpus is available when
+the benchmark runs the pure-Python path with NumPy blocked.
+"""
+import random
+from typing import Iterator, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+KINDS = ("gradient", "cartoon", "noise")
+
+def gradient(n: int, seed: int = 0) -> Image.Image:
+    """Photo-like: smooth overlapping gradients, a soft blur and light grain."""
+    lin = Image.linear_gradient("L").resize((n, n), Image.BILINEAR)
+    rad = Image.radial_gradient("L").resize((n, n), Image.BILINEAR)
+    img = Image.merge("RGB", (lin, rad, lin.rotate(90)))
+    grain = Image.frombytes("RGB", (n, n), random.Random(seed).randbytes(3 * n * n))
+    return Image.blend(img, grain, 0.08).filter(ImageFilter.GaussianBlur(0.6))
+
+def cartoon(n: int, seed: int = 0) -> Image.Image:
+    """Flat art: a handful of solid colours in overlapping shapes with hard edges."""
+    rng = random.Random(seed)
+    colours = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(8)]
+    img = Image.new("RGB", (n, n), colours[0])
+    drw = ImageDraw.Draw(img)
+    for i in range(24):
+        x0, y0 = rng.randrange(n), rng.randrange(n)
+        x1, y1 = x0 + rng.randrange(n // 8 + 1, n // 2 + 2), y0 + rng.randrange(n // 8 + 1, n // 2 + 2)
+        shape = drw.ellipse if i % 2 else drw.rectangle
+        shape((x0, y0, x1, y1), fill=colours[1 + i % 7], outline=(0, 0, 0))
+    return img
+
+def noise(n: int, seed: int = 0) -> Image.Image:
+    """Uniform RGB noise: the worst case for the palette search and the cleanup."""
+    return Image.frombytes("RGB", (n, n), random.Random(seed).randbytes(3 * n * n))
+
+def corpus(sizes: List[int], kinds=KINDS) -> Iterator[Tuple[str, int, Image.Image]]:
+    makers = {"gradient": gradient, "cartoon": cartoon, "noise": noise}
+    for kind in kinds:
+        for n in sizes:
+            yield kind, n, makers[kind](n)
@@ -0,0 +1,53 @@
+"""Cost of each dithering mode at typical pattern sizes.
+
+    python bench/dither_timing.py [--sizes 100,300] [--repeat 5]
+
+The input is a fixed, seeded gradient-plus-noise image, so runs on the same
+machine are comparable. Times are the median of --repeat runs of
+map_palette_lab (palette search, dithering, legend) after one warm-up.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from api.utils.quantize import map_palette_lab
+from api.utils.dither import DITHER_MODES
+
+def synthetic(n: int, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    g = np.linspace(0, 255, n)
+    base = np.stack(np.broadcast_arrays(g[None, :], g[:, None], 255 - g[None, :]), axis=-1)
+    return Image.fromarray(np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100,300")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--modes", default=",".join(DITHER_MODES))
+    args = ap.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",")]
+    modes = args.modes.split(",")
+    print(f"{'mode':<16}" + "".join(f"{f'{n}x{n} ms':>14}" for n in sizes) + f"{'threads':>10}")
+    for mode in modes:
+        row, used = [], 0
+        for n in sizes:
+            img = synthetic(n)
+            _, legend, _ = map_palette_lab(img, dither=mode)  # warm-up
+            times = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                map_palette_lab(img, dither=mode)
+                times.append(time.perf_counter() - t)
+            row.append(statistics.median(times) * 1000)
+            used = len(legend)
+        print(f"{mode:<16}" + "".join(f"{ms:>14.1f}" for ms in row) + f"{used:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Vectorized code paths against the straightforward versions they replace.
+
+    python bench/equivalence_check.py [--seed 0] [--rounds 3]
+
+Each check runs on seeded random inputs and must match exactly:
+
+  cleanup        _speckle_cleanup_np against the sequential BFS cleanup (the
+                 list path of _speckle_cleanup), on a small grid and on one
+                 above TILED_MIN_CELLS, where _components labels bands of rows
+                 and joins them across the seams
+  components     banded _components against labelling the grid in one piece
+  dither         floyd_steinberg's anti-diagonal scan against the pixel-by-pixel
+                 raster scan
+  edit tiles     an edited chart assembled from edit_pattern's patches against
+                 the same chart rendered whole
+
+Prints one line per check and exits non-zero if any fails.
+"""
+import argparse
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from api.utils.dither import floyd_steinberg  # noqa: E402
+from api.utils.edit import edit_pattern  # noqa: E402
+from api.utils.pipeline import build_pattern, render_result  # noqa: E402
+from api.utils.quantize import COMPONENT_BAND, _components, _components_band, _speckle_cleanup  # noqa: E402
+from api.utils.tiles import TILED_MIN_CELLS  # noqa: E402
+
+def _labels(rng, h: int, w: int, n: int = 6) -> "np.ndarray":
+    # blobs of a few labels sprinkled with speckles, so components of every size occur
+    base = rng.integers(0, n, (h // 4 + 1, w // 4 + 1)).repeat(4, 0).repeat(4, 1)[:h, :w]
+    noise = rng.random((h, w)) < 0.15
+    return np.where(noise, rng.integers(0, n, (h, w)), base).astype(np.int32)
+
+def _sizes():
+    side = int(TILED_MIN_CELLS ** 0.5) + 20
+    assert side * side > TILED_MIN_CELLS and side > COMPONENT_BAND
+    return [(37, 53), (side, side + 7)]
+
+def check_cleanup(rng):
+    for h, w in _sizes():
+        lab = _labels(rng, h, w)
+        for min_size in (2, 4, 6):
+            fast = _speckle_cleanup(lab.copy(), min_size)
+            slow = np.array(_speckle_cleanup(lab.tolist(), min_size))
+            bad = int((fast != slow).sum())
+            assert not bad, f"{h}x{w} min_size={min_size}: {bad} cells differ"
+
+def check_components(rng):
+    h, w = _sizes()[1]
+    lab = _labels(rng, h, w)
+    assert np.array_equal(_components(lab), _components_band(lab, 0)), f"{h}x{w}: roots differ"
+
+def _fs_reference(lab, nearest, pal_lab):
+    H, W, _ = lab.shape
+    work = lab.astype(np.float64).copy()
+    out = np.empty((H, W), dtype=np.int32)
+    for y in range(H):
+        for x in range(W):
+            cur = work[y, x].copy()
+            i = int(nearest(cur[None])[0])
+            out[y, x] = i
+            err = cur - pal_lab[i]
+            if x + 1 < W:
+                work[y, x + 1] += err * (7 / 16)
+            if y + 1 < H:
+                if x > 0:
+                    work[y + 1, x - 1] += err * (3 / 16)
+                work[y + 1, x] += err * (5 / 16)
+                if x + 1 < W:
+                    work[y + 1, x + 1] += err * (1 / 16)
+    return out
+
+def check_dither(rng):
+    pal_lab = np.column_stack([rng.uniform(0, 100, 12), rng.uniform(-60, 60, 12), rng.uniform(-60, 60, 12)])
+    nearest = lambda rows: ((rows[:, None, :] - pal_lab[None]) ** 2).sum(-1).argmin(1)
+    for h, w in ((1, 9), (9, 1), (23, 31)):
+        lab = np.stack([rng.uniform(0, 100, (h, w)), rng.uniform(-60, 60, (h, w)), rng.uniform(-60, 60, (h, w))], -1)
+        fast, slow = floyd_steinberg(lab, nearest, pal_lab), _fs_reference(lab, nearest, pal_lab)
+        bad = int((fast != slow).sum())
+        assert not bad, f"{h}x{w}: {bad} pixels differ"
+
+def check_edit_tiles(rng):
+    img = Image.fromarray(rng.integers(0, 256, (24, 36, 3), dtype=np.uint8).repeat(3, 0).repeat(3, 1))
+    base = build_pattern(img, png_mode="rgb")
+    h, w = base["height"], base["width"]
+    used = [u["idx"] for u in base["palette_used"]]
+    # cells recoloured with threads already in the legend, so its length stays put and tiles come back
+    edits = [(int(rng.integers(w)), int(rng.integers(h)), int(rng.choice(used))) for _ in range(6)]
+    entry, patches = edit_pattern(base, edits, png_mode="rgb")
+    assert patches, "expected tile patches, got a full re-render"
+    chart = Image.open(io.BytesIO(base["png"])).convert("RGB")
+    for p in patches:
+        chart.paste(Image.open(io.BytesIO(p["png"])).convert("RGB"), (p["x"], p["y"]))
+    whole = Image.open(io.BytesIO(render_result(entry, png_mode="rgb")["png"])).convert("RGB")
+    assert chart.size == whole.size, f"chart size {chart.size} != {whole.size}"
+    bad = int((np.asarray(chart) != np.asarray(whole)).any(-1).sum())
+    assert not bad, f"{bad} chart pixels differ after {len(patches)} patches"
+
+CHECKS = [("cleanup", check_cleanup), ("components", check_components), ("dither", check_dither),
+          ("edit tiles", check_edit_tiles)]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--rounds", type=int, default=3, help="seeds tried per check, from --seed up")
+    args = ap.parse_args(argv)
+    failed = 0
+    for name, check in CHECKS:
+        try:
+            for seed in range(args.seed, args.seed + args.rounds):
+                check(np.random.default_rng(seed))
+            print(f"ok    {name}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL  {name} (seed {seed}): {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Image URL fetching against a local origin: revalidation and the caps.
+
+    python bench/fetch_check.py
+
+Starts an http.server on localhost and drives a Fetcher (with a scratch
+disk cache) through each path that matters:
+
+  etag           a second fetch sends If-None-Match; the 304 serves the stored body
+  last-modified  the same with If-Modified-Since
+  max-age        a fresh entry is served without a request at all
+  no-store       never cached, so every fetch downloads
+  byte cap       an oversized Content-Length is refused before reading,
+                 and a body without one is cut off at the cap
+  time cap       a body trickled past the deadline raises FetchTimeout
+  errors         HTTP 404 and a non-http URL raise FetchError / BadImageURL
+
+Prints one line per check and exits non-zero if any fails.
+"""
+import argparse
+import email.utils
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.utils.fetch import BadImageURL, Fetcher, FetchError, FetchTimeout  # noqa: E402
+from api.utils.images import ImageTooLarge  # noqa: E402
+
+BODY = bytes(range(256)) * 64  # 16 KB
+CAP = 4096
+TIMEOUT = 1.0
+LAST_MODIFIED = email.utils.formatdate(time.time() - 3600, usegmt=True)
+
+class Origin(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hits = Counter()  # (path, status) -> requests
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, headers=(), body: bytes = b""):
+        self.hits[(self.path, status)] += 1
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path
+        if path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                return self._send(304, [("ETag", '"v1"')])
+            return self._send(200, [("ETag", '"v1"')], BODY)
+        if path == "/last-modified":
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                return self._send(304)
+            return self._send(200, [("Last-Modified", LAST_MODIFIED)], BODY)
+        if path == "/max-age":
+            return self._send(200, [("ETag", '"v1"'), ("Cache-Control", "max-age=60")], BODY)
+        if path == "/no-store":
+            return self._send(200, [("ETag", '"v1"'), ("Cache-Control", "no-store")], BODY)
+        if path == "/big":
+            return self._send(200, [], BODY)
+        if path == "/big-unsized":
+            # no Content-Length: only counting the streamed bytes catches it
+            self.hits[(path, 200)] += 1
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for _ in range(64):
+                    self.wfile.write(BODY)
+            except OSError:
+                pass
+            self.close_connection = True
+            return
+        if path == "/slow":
+            self.hits[(path, 200)] += 1
+            self.send_response(200)
+            self.send_header("Content-Length", str(CAP))
+            self.end_headers()
+            try:
+                for _ in range(CAP // 16):
+                    self.wfile.write(b"x" * 16)
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except OSError:
+                pass
+            return
+        return self._send(404, [], b"missing")
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the fetcher hangs up on capped downloads; that is the point
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def run_checks(base: str, cache_dir: str):
+    hits = Origin.hits
+    f = Fetcher(cache_dir=cache_dir, cache_bytes=1 << 20, timeout=TIMEOUT, connect_timeout=TIMEOUT,
+                max_bytes=len(BODY))
+    capped = Fetcher(cache_dir=cache_dir, cache_bytes=1 << 20, timeout=TIMEOUT, connect_timeout=TIMEOUT,
+                     max_bytes=CAP)
+
+    def raises(exc, url):
+        try:
+            capped.fetch(url)
+        except exc as e:
+            return e
+        raise AssertionError(f"{url}: expected {exc.__name__}")
+
+    def etag():
+        assert f.fetch(base + "/etag") == BODY
+        assert f.fetch(base + "/etag") == BODY
+        assert hits[("/etag", 200)] == 1 and hits[("/etag", 304)] == 1, dict(hits)
+        assert f.counts["not_modified"] == 1
+
+    def last_modified():
+        assert f.fetch(base + "/last-modified") == BODY
+        assert f.fetch(base + "/last-modified") == BODY
+        assert hits[("/last-modified", 200)] == 1 and hits[("/last-modified", 304)] == 1, dict(hits)
+
+    def max_age():
+        assert f.fetch(base + "/max-age") == BODY
+        assert f.fetch(base + "/max-age") == BODY
+        assert hits[("/max-age", 200)] == 1, dict(hits)
+        assert f.counts["fresh"] == 1
+
+    def no_store():
+        f.fetch(base + "/no-store")
+        f.fetch(base + "/no-store")
+        assert hits[("/no-store", 200)] == 2, dict(hits)
+
+    def byte_cap():
+        raises(ImageTooLarge, base + "/big")
+        t = time.monotonic()
+        raises(ImageTooLarge, base + "/big-unsized")
+        assert time.monotonic() - t < TIMEOUT, "the cap should cut the body off before the deadline"
+
+    def time_cap():
+        t = time.monotonic()
+        raises(FetchTimeout, base + "/slow")
+        took = time.monotonic() - t
+        assert took < TIMEOUT + 0.5, f"timed out after {took:.2f} s, deadline {TIMEOUT} s"
+
+    def errors():
+        raises(FetchError, base + "/nope")
+        raises(BadImageURL, "ftp://localhost/a.png")
+
+    return [("etag", etag), ("last-modified", last_modified), ("max-age", max_age), ("no-store", no_store),
+            ("byte cap", byte_cap), ("time cap", time_cap), ("errors", errors)]
+
+def main(argv=None):
+    argparse.ArgumentParser(description=__doc__.split("\n")[0]).parse_args(argv)
+    server = Server(("127.0.0.1", 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    failed = 0
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for name, check in run_checks(base, cache_dir):
+                try:
+                    check()
+                    print(f"ok    {name}")
+                except Exception as e:
+                    failed += 1
+                    print(f"FAIL  {name}: {type(e).__name__}: {e}")
+    finally:
+        server.shutdown()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
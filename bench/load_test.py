@@ -0,0 +1,420 @@
+"""End-to-end load test: the real server under a mix of uploads and image URLs.
+
+    python bench/load_test.py                                   # 20 s at 2 req/s
+    python bench/load_test.py --rate 0 --concurrency 8          # closed loop, as fast as it goes
+    python bench/load_test.py --config one workers=1 --config two workers=2
+    python bench/load_test.py --config cie76 --config de2000 metric=ciede2000 --json out.json
+
+Every configuration starts its own `uvicorn api.cross_stitch:app` on a free
+port and gets the same request schedule. Requests arrive open-loop at
+--rate per second (Poisson; --rate 0 sends back to back), with at most
+--concurrency in flight; latency counts from the scheduled arrival, so
+time spent waiting for a free client slot is not hidden. A --url-share of
+requests pass image_url instead of an upload; those images come from a
+stand-in HTTP server in this process (--url-delay adds origin latency).
+
+A configuration is a name and KEY=VALUE settings: `workers=N` is passed to
+uvicorn, CROSS_STITCH_* keys become the server's environment, anything
+else is a form field (max_size, dither, metric, chart, ...). The result
+cache is off (CROSS_STITCH_CACHE_BYTES=0) unless --cache is given, since
+a replayed corpus would otherwise be served from it.
+
+The report gives throughput, error rate, status counts, p50/p95/p99
+latency, and the RSS of every server process (uvicorn workers, pool
+processes) sampled over the run; with several configurations a final
+table compares them against the first. Linux only for RSS (/proc).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from corpus import cartoon, gradient, noise  # noqa: E402
+
+ENDPOINT = "/api/cross_stitch"
+# what the generator page sends
+DEFAULT_FORM = {"max_size": "100", "labels_format": "u16-deflate", "chart": "inline"}
+
+# ---- workload ------------------------------------------------------------
+
+def make_images(count: int, px: int) -> List[Tuple[str, bytes, str]]:
+    """(name, bytes, content type): photo-like and noise images as JPEG, flat art as PNG."""
+    out = []
+    for i in range(count):
+        kind = ("gradient", "cartoon", "noise")[i % 3]
+        img = {"gradient": gradient, "cartoon": cartoon, "noise": noise}[kind](px, seed=i)
+        fmt = "PNG" if kind == "cartoon" else "JPEG"
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, quality=90)
+        out.append((f"{kind}-{i}.{fmt.lower()}", buf.getvalue(), f"image/{fmt.lower()}"))
+    return out
+
+def schedule(duration: float, rate: float, images: int, url_share: float, seed: int):
+    """(offset seconds, image index, by URL) per request; the same for every configuration.
+    Closed loop (rate 0) has no offsets: clients send back to back until `duration`."""
+    rng = random.Random(seed)
+    out, t = [], 0.0
+    while True:
+        if rate > 0:
+            t += rng.expovariate(rate)
+            if t >= duration:
+                return out
+        elif len(out) >= 100_000:
+            return out
+        out.append((t if rate > 0 else None, rng.randrange(images), rng.random() < url_share))
+
+class _Origin(BaseHTTPRequestHandler):
+    images: Dict[str, Tuple[bytes, str]] = {}
+    delay = 0.0
+
+    def do_GET(self):
+        item = self.images.get(self.path.lstrip("/"))
+        if item is None:
+            self.send_error(404)
+            return
+        if self.delay:
+            time.sleep(self.delay)
+        body, ctype = item
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_origin(images, delay: float) -> Tuple[ThreadingHTTPServer, str]:
+    """Stand-in image host on a free local port; returns the server and its base URL."""
+    handler = type("Origin", (_Origin,), {"images": {n: (b, t) for n, b, t in images}, "delay": delay})
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}/"
+
+# ---- server under test ---------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workers: int, env: Dict[str, str], timeout: float = 60.0) -> Tuple[subprocess.Popen, str]:
+    import requests
+    port = _free_port()
+    cmd = [sys.executable, "-m", "uvicorn", "api.cross_stitch:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env})
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}")
+        try:
+            if requests.get(base + ENDPOINT, timeout=1).ok:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not come up")
+
+def stop_server(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+# ---- RSS sampling --------------------------------------------------------
+
+def _proc_tree(root: int) -> List[Tuple[int, int]]:
+    """(pid, parent pid) of root and all its descendants."""
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+        # the command name may contain spaces; the fields after it do not
+        ppid = int(stat[stat.rindex(b")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+    out, todo = [], [(root, 0)]
+    while todo:
+        pid, ppid = todo.pop()
+        out.append((pid, ppid))
+        todo += [(c, pid) for c in children.get(pid, [])]
+    return out
+
+def _rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status", "r") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _role(pid: int, ppid: int, root: int, workers: int) -> str:
+    """main: the uvicorn process; worker: a uvicorn worker (workers > 1); pool: a process-executor worker."""
+    if pid == root:
+        return "main"
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as fh:
+            if b"resource_tracker" in fh.read():
+                return "tracker"
+    except OSError:
+        pass
+    return "worker" if ppid == root and workers > 1 else "pool"
+
+class RssSampler(threading.Thread):
+    """RSS of every process under the server, every `interval` seconds."""
+
+    def __init__(self, root: int, workers: int, interval: float):
+        super().__init__(daemon=True)
+        self.root, self.workers, self.interval = root, workers, interval
+        self.samples: List[Tuple[float, Dict[str, int]]] = []  # (t, {label: kB})
+        self._done = threading.Event()
+        self.t0 = time.monotonic()
+
+    def run(self):
+        if not os.path.isdir("/proc"):
+            return
+        while not self._done.is_set():
+            row = {}
+            for pid, ppid in _proc_tree(self.root):
+                kb = _rss_kb(pid)
+                if kb:
+                    row[f"{_role(pid, ppid, self.root, self.workers)}-{pid}"] = kb
+            self.samples.append((time.monotonic() - self.t0, row))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+# ---- load ----------------------------------------------------------------
+
+def run_load(base: str, origin: str, images, plan, concurrency: int, form: Dict[str, str],
+             timeout: float, duration: float) -> List[Dict]:
+    """Send the plan; one record per request: offset, latency (from the scheduled
+    time, or from sending in a closed loop), status."""
+    import requests
+    todo: "Queue[Tuple[Optional[float], int, bool]]" = Queue()
+    for item in plan:
+        todo.put(item)
+    records: List[Dict] = []
+    lock = threading.Lock()
+    t0 = time.monotonic() + 0.2
+
+    def client():
+        s = requests.Session()
+        while True:
+            try:
+                at, idx, by_url = todo.get_nowait()
+            except Empty:
+                return
+            if at is None:
+                if time.monotonic() >= t0 + duration:
+                    return
+                at = max(0.0, time.monotonic() - t0)
+            wait = t0 + at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            name, body, ctype = images[idx]
+            start = time.monotonic()
+            try:
+                if by_url:
+                    r = s.post(base + ENDPOINT, data={**form, "image_url": origin + name}, timeout=timeout)
+                else:
+                    r = s.post(base + ENDPOINT, data=form, files={"image": (name, body, ctype)}, timeout=timeout)
+                status, size = r.status_code, len(r.content)
+            except requests.RequestException as e:
+                status, size = type(e).__name__, 0
+            end = time.monotonic()
+            with lock:
+                records.append({"at": at, "url": by_url, "status": status, "bytes": size,
+                                "latency": end - (t0 + at), "service": end - start})
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(max(1, concurrency))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records
+
+# ---- report --------------------------------------------------------------
+
+def pct(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(q / 100 * len(s) + 0.5)) - 1))]
+
+def summarize(records: List[Dict], wall: float, rss: List[Tuple[float, Dict[str, int]]]) -> Dict:
+    ok = [r["latency"] for r in records if r["status"] == 200]
+    procs: Dict[str, Dict[str, int]] = {}
+    for _, row in rss:
+        for label, kb in row.items():
+            p = procs.setdefault(label, {"start_kb": kb, "peak_kb": kb, "end_kb": kb})
+            p["peak_kb"], p["end_kb"] = max(p["peak_kb"], kb), kb
+    return {
+        "requests": len(records), "ok": len(ok), "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else None,
+        "status": dict(Counter(str(r["status"]) for r in records)),
+        **{f"p{q}_ms": (round(pct(ok, q) * 1000, 1) if ok else None) for q in (50, 95, 99)},
+        "max_ms": round(max(ok) * 1000, 1) if ok else None,
+        "url_p50_ms": _ms(pct([r["latency"] for r in records if r["status"] == 200 and r["url"]], 50)),
+        "upload_p50_ms": _ms(pct([r["latency"] for r in records if r["status"] == 200 and not r["url"]], 50)),
+        "rss": procs,
+        "peak_total_rss_mb": round(max((sum(row.values()) for _, row in rss), default=0) / 1024, 1),
+    }
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return None if v is None else round(v * 1000, 1)
+
+def _fmt(v) -> str:
+    return "-" if v is None else f"{v:g}" if isinstance(v, float) else str(v)
+
+def report(name: str, settings: List[str], s: Dict, rss, rows: int = 10) -> None:
+    print(f"\n== {name}  {' '.join(settings) or '(defaults)'}")
+    print(f"  {s['requests']} requests, {s['ok']} ok in {s['wall_s']} s: {_fmt(s['throughput_rps'])} req/s, "
+          f"error rate {s['error_rate']:.1%}" if s["requests"] else "  no requests")
+    print(f"  status    {', '.join(f'{k}: {v}' for k, v in sorted(s['status'].items()))}")
+    print(f"  latency   p50 {_fmt(s['p50_ms'])} ms  p95 {_fmt(s['p95_ms'])} ms  p99 {_fmt(s['p99_ms'])} ms  "
+          f"max {_fmt(s['max_ms'])} ms  (upload p50 {_fmt(s['upload_p50_ms'])}, url p50 {_fmt(s['url_p50_ms'])})")
+    if not rss:
+        return
+    labels = sorted(s["rss"], key=lambda k: (not k.startswith("main"), k))
+    print("  RSS MB    " + "".join(f"{label:>16}" for label in labels))
+    step = max(1, len(rss) // rows)
+    for t, row in rss[::step] + ([rss[-1]] if (len(rss) - 1) % step else []):
+        print(f"  {t:6.1f} s " + "".join(f"{_fmt(round(row[k] / 1024, 1)) if k in row else '-':>16}" for k in labels))
+    print("  peak      " + "".join(f"{s['rss'][k]['peak_kb'] / 1024:>16.1f}" for k in labels))
+
+COMPARE = (("throughput_rps", "req/s"), ("error_rate", "errors"), ("p50_ms", "p50 ms"), ("p95_ms", "p95 ms"),
+           ("p99_ms", "p99 ms"), ("peak_total_rss_mb", "peak RSS MB"))
+
+def compare(results: List[Tuple[str, Dict]]) -> None:
+    print("\n== comparison (ratio to the first configuration)")
+    print(f"  {'':<14}" + "".join(f"{name:>22}" for name, _ in results))
+    base = results[0][1]
+    for key, label in COMPARE:
+        cells = []
+        for _, s in results:
+            v, b = s.get(key), base.get(key)
+            ratio = f" ({v / b:.2f}x)" if v is not None and b and s is not base else ""
+            cells.append(f"{_fmt(v)}{ratio}")
+        print(f"  {label:<14}" + "".join(f"{c:>22}" for c in cells))
+
+# ---- main ----------------------------------------------------------------
+
+def parse_config(spec: List[str], base_workers: int) -> Tuple[str, int, Dict[str, str], Dict[str, str]]:
+    """NAME KEY=VALUE... -> (name, uvicorn workers, server env, form fields)."""
+    name, workers, env, form = spec[0], base_workers, {}, {}
+    for item in spec[1:]:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--config {name}: expected KEY=VALUE, got {item!r}")
+        if key == "workers":
+            workers = int(value)
+        elif key.startswith("CROSS_STITCH_"):
+            env[key] = value
+        else:
+            form[key] = value
+    return name, workers, env, form
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python bench/load_test.py")
+    ap.add_argument("--config", nargs="+", action="append", metavar="NAME [KEY=VALUE ...]",
+                    help="a configuration to run; repeat to compare")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds of arrivals per configuration")
+    ap.add_argument("--rate", type=float, default=2.0, help="arrivals per second (0: closed loop)")
+    ap.add_argument("--concurrency", type=int, default=4, help="requests in flight at most")
+    ap.add_argument("--url-share", type=float, default=0.3, help="share of requests using image_url")
+    ap.add_argument("--url-delay", type=float, default=0.0, help="seconds the stand-in origin waits per image")
+    ap.add_argument("--images", type=int, default=12, help="distinct images in the corpus")
+    ap.add_argument("--image-px", type=int, default=800, help="side of each corpus image")
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workers unless a config sets workers=")
+    ap.add_argument("--cache", action="store_true", help="leave the result cache on")
+    ap.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    ap.add_argument("--sample", type=float, default=0.5, help="seconds between RSS samples")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", metavar="FILE", help="write summaries and raw records")
+    args = ap.parse_args(argv)
+    # a killed run still stops its servers
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+
+    images = make_images(args.images, args.image_px)
+    plan = schedule(args.duration, args.rate, len(images), args.url_share, args.seed)
+    origin, origin_url = start_origin(images, args.url_delay)
+    configs = [parse_config(c, args.workers) for c in args.config or [["default"]]]
+    load = f"{len(plan)} requests at {args.rate:g}/s" if args.rate > 0 else f"closed loop for {args.duration:g} s"
+    print(f"{load} per configuration, concurrency {args.concurrency}, "
+          f"{len(images)} images of {args.image_px} px, {args.url_share:.0%} by URL")
+
+    results, raw = [], {}
+    try:
+        for name, workers, env, form in configs:
+            server_env = {"CROSS_STITCH_CACHE_DIR": "", "CROSS_STITCH_FETCH_CACHE_DIR": "", **env}
+            if not args.cache:
+                server_env.setdefault("CROSS_STITCH_CACHE_BYTES", "0")
+            proc, base = start_server(workers, server_env)
+            sampler = RssSampler(proc.pid, workers, args.sample)
+            try:
+                import requests
+                # first request pays for lazy initialisation; keep it out of the numbers
+                requests.post(base + ENDPOINT, data={**DEFAULT_FORM, **form},
+                              files={"image": images[0]}, timeout=args.timeout)
+                sampler.start()
+                t = time.monotonic()
+                records = run_load(base, origin_url, images, plan, args.concurrency, {**DEFAULT_FORM, **form},
+                                   args.timeout, args.duration)
+                wall = time.monotonic() - t
+            finally:
+                try:
+                    if sampler.is_alive():
+                        sampler.stop()
+                finally:
+                    stop_server(proc)
+            summary = summarize(records, wall, sampler.samples)
+            settings = [f"workers={workers}"] + [f"{k}={v}" for k, v in {**env, **form}.items()]
+            report(name, settings, summary, sampler.samples)
+            results.append((name, summary))
+            raw[name] = {"settings": settings, "summary": summary, "records": records,
+                         "rss": sampler.samples}
+    finally:
+        origin.shutdown()
+
+    if len(results) > 1:
+        compare(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"args": vars(args), "configs": raw}, fh, indent=1)
+        print(f"\nwritten to {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Per-stage timings and peak memory of the pattern pipeline.
+
+    python bench/pipeline_bench.py                       # print a table
+    python bench/pipeline_bench.py --save bench/baseline.json
+    python bench/pipeline_bench.py --compare bench/baseline.json --threshold 0.2
+
+Every stage (Lab conversion, palette search, speckle cleanup, the whole
+map_palette_lab, chart render, PNG encode) is timed on each corpus image, in
+the NumPy path and in the pure-Python path. The pure-Python path runs in a
+child process with NumPy blocked, so it is exactly what a NumPy-less install
+executes. --compare exits with status 1 when a stage got slower (or its peak
+memory grew) by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from corpus import KINDS, corpus  # noqa: E402
+
+# ignore differences below this; they are timer noise on small inputs
+FLOOR_MS = 0.5
+FLOOR_KB = 64
+
+def _stages_numpy(img):
+    import numpy as np
+    from api.utils.color import rgb_to_lab_np
+    from api.utils.quantize import _nearest_indices, _speckle_cleanup, map_palette_lab
+    from api.utils.chart import chart_colors, render_chart
+    from api.utils.encode import PNG_LEVEL, PNG_MODE, png_bytes
+
+    w, h = img.size
+    flat = np.asarray(img, dtype=np.uint8).reshape(-1, 3)
+    raw = _nearest_indices(flat).reshape(h, w)
+    q, legend, _ = map_palette_lab(img)
+    chart = render_chart(q, legend)
+    return {
+        "lab": lambda: rgb_to_lab_np(flat),
+        "search": lambda: _nearest_indices(flat),
+        "cleanup": lambda: _speckle_cleanup(raw, min_size=4),
+        "quantize": lambda: map_palette_lab(img),
+        "chart": lambda: render_chart(q, legend),
+        # what the server does: indexed by default, the chart's fills kept exact
+        "png": lambda: png_bytes(chart, PNG_MODE, PNG_LEVEL, keep=chart_colors(legend)),
+    }
+
+def _stages_python(img):
+    from api.utils.color import rgb_to_lab_tuple
+    from api.utils.quantize import _nearest_py, _palette_py, _speckle_cleanup, map_palette_lab
+    from api.utils.chart import chart_colors, render_chart
+    from api.utils.encode import PNG_LEVEL, PNG_MODE, png_bytes
+
+    w, h = img.size
+    pixels = list(img.getdata())
+    _, pal_lab = _palette_py()
+    flat = _nearest_py(pixels, pal_lab)
+    raw = [flat[y * w:(y + 1) * w] for y in range(h)]
+    q, legend, _ = map_palette_lab(img)
+    chart = render_chart(q, legend)
+    return {
+        "lab": lambda: [rgb_to_lab_tuple(p) for p in pixels],
+        "search": lambda: _nearest_py(pixels, pal_lab),
+        # the list cleanup works in place
+        "cleanup": lambda: _speckle_cleanup([row[:] for row in raw], min_size=4),
+        "quantize": lambda: map_palette_lab(img),
+        "chart": lambda: render_chart(q, legend),
+        # what the server does: indexed by default, the chart's fills kept exact
+        "png": lambda: png_bytes(chart, PNG_MODE, PNG_LEVEL, keep=chart_colors(legend)),
+    }
+
+def _measure(fn, repeat: int):
+    fn()  # warm-up: caches, fonts, palette
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    # separate run for memory: tracemalloc would distort the timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3),
+            "peak_kb": round(peak / 1024, 1)}
+
+def run_path(path: str, sizes, kinds, repeat: int):
+    """Results for one path, measured in this process."""
+    stages = _stages_numpy if path == "numpy" else _stages_python
+    out = {}
+    for kind, n, img in corpus(sizes, kinds):
+        for stage, fn in stages(img).items():
+            out[f"{path}/{kind}/{n}/{stage}"] = _measure(fn, repeat)
+            print(f"  {path:<6} {kind:<9} {n:>4} {stage:<9} {out[f'{path}/{kind}/{n}/{stage}']['median_ms']:>10.2f} ms",
+                  file=sys.stderr)
+    return out
+
+def _child(path: str, sizes, kinds, repeat: int):
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", path,
+           "--sizes", ",".join(map(str, sizes)), "--kinds", ",".join(kinds), "--repeat", str(repeat)]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, check=True, cwd=ROOT)
+    return json.loads(res.stdout)
+
+def _meta():
+    try:
+        import numpy
+        np_version = numpy.__version__
+    except Exception:
+        np_version = None
+    return {"python": platform.python_version(), "numpy": np_version,
+            "machine": platform.machine(), "processor": platform.processor() or None}
+
+def compare(current, baseline, threshold: float):
+    """Rows of (key, metric, before, after, ratio) that regressed beyond threshold."""
+    bad = []
+    for key, cur in sorted(current.items()):
+        old = baseline.get(key)
+        if old is None:
+            continue
+        for metric, floor in (("median_ms", FLOOR_MS), ("peak_kb", FLOOR_KB)):
+            a, b = old[metric], cur[metric]
+            if b > a * (1 + threshold) and b - a > floor:
+                bad.append((key, metric, a, b, b / a if a else float("inf")))
+    return bad
+
+def _table(results, baseline=None):
+    print(f"{'path/image/size/stage':<34}{'median ms':>12}{'min ms':>10}{'peak KiB':>12}" +
+          (f"{'vs base':>10}" if baseline else ""))
+    for key, r in sorted(results.items()):
+        line = f"{key:<34}{r['median_ms']:>12.2f}{r['min_ms']:>10.2f}{r['peak_kb']:>12.1f}"
+        if baseline and key in baseline and baseline[key]["median_ms"]:
+            line += f"{r['median_ms'] / baseline[key]['median_ms']:>9.2f}x"
+        print(line)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python bench/pipeline_bench.py")
+    ap.add_argument("--paths", default="numpy,python")
+    ap.add_argument("--sizes", default="50,100,300", help="image sizes for the NumPy path")
+    ap.add_argument("--py-sizes", default="32,64", help="image sizes for the pure-Python path")
+    ap.add_argument("--kinds", default=",".join(KINDS))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--py-repeat", type=int, default=1)
+    ap.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    ap.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    ap.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown (0.2 = 20%%)")
+    ap.add_argument("--worker", choices=("numpy", "python"), help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    kinds = args.kinds.split(",")
+
+    if args.worker:
+        if args.worker == "python":
+            sys.modules["numpy"] = None  # every `import numpy` now fails, as on a NumPy-less host
+        results = run_path(args.worker, [int(s) for s in args.sizes.split(",")], kinds, args.repeat)
+        json.dump(results, sys.stdout)
+        return 0
+
+    results = {}
+    for path in args.paths.split(","):
+        sizes = args.sizes if path == "numpy" else args.py_sizes
+        repeat = args.repeat if path == "numpy" else args.py_repeat
+        results.update(_child(path, [int(s) for s in sizes.split(",")], kinds, repeat))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fh:
+            baseline = json.load(fh)["results"]
+    _table(results, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump({"meta": _meta(), "results": results}, fh, indent=1, sort_keys=True)
+        print(f"baseline written to {args.save}")
+
+    if baseline is not None:
+        bad = compare(results, baseline, args.threshold)
+        for key, metric, a, b, ratio in bad:
+            print(f"REGRESSION {key} {metric}: {a:.2f} -> {b:.2f} ({ratio:.2f}x)")
+        if bad:
+            return 1
+        print(f"no regressions beyond {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,8 @@ const nextConfig = {
     if (process.env.NODE_ENV === 'development') {
       return [
         { source: '/api/cross_stitch', destination: 'http://localhost:8000/api/cross_stitch' },
+        // batch, edit, chart, export, metrics and jobs routes
+        { source: '/api/cross_stitch/:path*', destination: 'http://localhost:8000/api/cross_stitch/:path*' },
       ];
     }
     return [];
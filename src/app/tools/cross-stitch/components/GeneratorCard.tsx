@@ -10,18 +10,19 @@ type Props = {
   onSubmit: (e: React.FormEvent) => void;
   reset: () => void;
   loading: boolean;
+  progress?: string | null;
   error: string | null;
 };
 
 export function GeneratorCard({
-  file, setFile, maxSizeStr, setMaxSizeStr, onSubmit, reset, loading, error
+  file, setFile, maxSizeStr, setMaxSizeStr, onSubmit, reset, loading, progress, error
 }: Props) {
   const filePreviewUrl = useMemo(() => (file ? URL.createObjectURL(file) : null), [file]);
 
-  // ---- sizing helpers (cap longest side at 100, keep aspect)
+  // ---- sizing helpers (cap longest side at 400, keep aspect)
   function clampMaxSize(n: number) {
     if (!Number.isFinite(n)) return 100;
-    return Math.max(16, Math.min(100, Math.round(n)));
+    return Math.max(16, Math.min(400, Math.round(n)));
   }
   function normalizedMaxSize(): number {
     const n = parseInt(maxSizeStr, 10);
@@ -60,7 +61,7 @@ export function GeneratorCard({
             <input
               type="number"
               min={16}
-              max={100}   // cap at 100
+              max={400}   // server default CROSS_STITCH_MAX_CELLS
               step={1}
               value={maxSizeStr}
               onChange={(e) => setMaxSizeStr(e.target.value)}
@@ -68,7 +69,7 @@ export function GeneratorCard({
               onWheel={(e) => (e.currentTarget as HTMLInputElement).blur()}
               className="mt-1 block w-28 rounded-xl border border-gray-200 px-3 py-2"
             />
-            <span className="mt-1 block text-xs text-gray-500">Longest side ≤ 100</span>
+            <span className="mt-1 block text-xs text-gray-500">Longest side ≤ 400</span>
           </label>
 
           <div className="flex items-center gap-3">
@@ -77,7 +78,7 @@ export function GeneratorCard({
               className="px-4 py-2 rounded-xl bg-rose-900 text-white hover:bg-rose-950 disabled:opacity-60"
               disabled={loading || !file}
             >
-              {loading ? "Generating…" : "Generate"}
+              {loading ? (progress ? `Generating… (${progress})` : "Generating…") : "Generate"}
             </button>
             <button
               type="button"
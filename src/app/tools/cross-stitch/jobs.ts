@@ -0,0 +1,62 @@
+import type { ApiErr, ApiOkWire, JobStatus } from "./types";
+
+/**
+ * Background jobs need a long-running API server (see api/utils/jobs.py);
+ * without NEXT_PUBLIC_CROSS_STITCH_JOBS=1 the page uses the synchronous route.
+ */
+export const JOBS_ENABLED = process.env.NEXT_PUBLIC_CROSS_STITCH_JOBS === "1";
+
+type Submitted = { job_id: string; status_url: string; events_url: string };
+
+async function json<T>(res: Response): Promise<T> {
+  const ct = res.headers.get("content-type") || "";
+  if (!ct.includes("application/json")) {
+    const txt = await res.text();
+    throw new Error(`Expected JSON, got ${ct}. First bytes: ${txt.slice(0, 160)}`);
+  }
+  const body = await res.json();
+  if (!res.ok) throw new Error((body as ApiErr).error ?? `HTTP ${res.status}`);
+  return body as T;
+}
+
+/** Generate a pattern in one request (POST /api/cross_stitch). */
+export async function generate(fd: FormData): Promise<ApiOkWire> {
+  return json<ApiOkWire>(await fetch("/api/cross_stitch", { method: "POST", body: fd }));
+}
+
+/** Wait until the job ends, reporting each pipeline stage; falls back to polling without SSE. */
+function waitForJob(job: Submitted, onStage: (stage: string) => void): Promise<void> {
+  return new Promise((resolve) => {
+    if (typeof EventSource === "undefined") {
+      const poll = async () => {
+        const s = await json<JobStatus>(await fetch(job.status_url));
+        if (s.stage) onStage(s.stage);
+        if (s.status === "done" || s.status === "failed") resolve();
+        else setTimeout(poll, 500);
+      };
+      poll().catch(() => resolve());
+      return;
+    }
+    const es = new EventSource(job.events_url);
+    es.addEventListener("queued", () => onStage("queued"));
+    es.addEventListener("stage", (e) => onStage(JSON.parse((e as MessageEvent).data).stage));
+    const end = () => { es.close(); resolve(); };
+    es.addEventListener("done", end);
+    es.addEventListener("failed", end);
+    // the status request below reports what went wrong
+    es.onerror = end;
+  });
+}
+
+/** Submit form data as a background job and return its finished status. */
+export async function runJob(fd: FormData, onStage: (stage: string) => void): Promise<JobStatus> {
+  const job = await json<Submitted>(await fetch("/api/cross_stitch/jobs", { method: "POST", body: fd }));
+  await waitForJob(job, onStage);
+  for (;;) {
+    const status = await json<JobStatus>(await fetch(job.status_url));
+    if (status.status === "done" || status.status === "failed") return status;
+    // the event stream dropped early; keep polling
+    onStage(status.stage ?? status.status);
+    await new Promise((r) => setTimeout(r, 500));
+  }
+}
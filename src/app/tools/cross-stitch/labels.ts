@@ -0,0 +1,42 @@
+import type { EncodedLabels } from "./types";
+
+/** Label format requested from the API (see api/utils/encode.py). */
+export const LABELS_FORMAT = "u16-deflate";
+
+function base64ToBytes(b64: string): Uint8Array {
+  const bin = atob(b64);
+  const out = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) out[i] = bin.charCodeAt(i);
+  return out;
+}
+
+async function inflate(bytes: Uint8Array): Promise<Uint8Array> {
+  const stream = new Blob([bytes as BlobPart]).stream().pipeThrough(new DecompressionStream("deflate"));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+/** Decode the server's labels (nested JSON or a uint16 buffer) into rows of DMC indices. */
+export async function decodeLabels(labels: number[][] | EncodedLabels): Promise<number[][]> {
+  if (Array.isArray(labels)) return labels;
+
+  let bytes = base64ToBytes(labels.data);
+  if (labels.compression === "deflate") bytes = await inflate(bytes);
+
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const [h, w] = labels.shape;
+  const flat = new Uint16Array(h * w);
+  if (labels.compression === "rle") {
+    let o = 0;
+    for (let i = 0; i + 3 < bytes.byteLength; i += 4) {
+      const run = view.getUint16(i + 2, true);
+      flat.fill(view.getUint16(i, true), o, o + run);
+      o += run;
+    }
+  } else {
+    for (let i = 0; i < flat.length; i++) flat[i] = view.getUint16(i * 2, true);
+  }
+
+  const rows: number[][] = [];
+  for (let y = 0; y < h; y++) rows.push(Array.from(flat.subarray(y * w, (y + 1) * w)));
+  return rows;
+}
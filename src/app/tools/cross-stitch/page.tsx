@@ -1,7 +1,9 @@
 "use client";
 import React, { useState } from "react";
 import { Header } from "@/components/Header";
-import type { ApiOk, ApiResult, Cell } from "./types";
+import type { ApiOk, ApiOkWire, Cell } from "./types";
+import { decodeLabels, LABELS_FORMAT } from "./labels";
+import { generate, runJob, JOBS_ENABLED } from "./jobs";
 import { GeneratorCard } from "./components/GeneratorCard";
 import { PatternCard } from "./components/PatternCard";
 import { EditorPanel } from "./components/EditorPanel";
@@ -11,6 +13,7 @@ export default function Page() {
   const [file, setFile] = useState<File | null>(null);
   const [maxSizeStr, setMaxSizeStr] = useState("100");
   const [loading, setLoading] = useState(false);
+  const [progress, setProgress] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
 
   // Data state
@@ -21,7 +24,7 @@ export default function Page() {
 
   function clampMaxSize(n: number) {
     if (!Number.isFinite(n)) return 100;
-    return Math.max(16, Math.min(100, Math.round(n)));
+    return Math.max(16, Math.min(400, Math.round(n)));
   }
 
   async function onSubmit(e: React.FormEvent) {
@@ -36,19 +39,27 @@ export default function Page() {
 
     try {
       const fd = new FormData();
-      fd.append("max_size", String(clampMaxSize(parseInt(maxSizeStr, 10))));
-      fd.append("image", file);
+      const maxSize = String(clampMaxSize(parseInt(maxSizeStr, 10)));
+      fd.append("labels_format", LABELS_FORMAT);
+      fd.append("chart", "inline");
 
-      const res = await fetch("/api/cross_stitch", { method: "POST", body: fd });
-      const ct = res.headers.get("content-type") || "";
-      if (!ct.includes("application/json")) {
-        const txt = await res.text();
-        throw new Error(`Expected JSON, got ${ct}. First bytes: ${txt.slice(0, 160)}`);
+      let wire: ApiOkWire;
+      if (JOBS_ENABLED) {
+        // large patterns take a while: run as a job and show which stage it is in
+        fd.append("sizes", maxSize);
+        fd.append("images", file);
+        const job = await runJob(fd, setProgress);
+        if (job.status === "failed") throw new Error(job.error ?? "Pattern generation failed");
+        const item = job.result?.results[0];
+        if (!item) throw new Error("The job returned no result");
+        if ("error" in item) throw new Error(item.error);
+        wire = item as ApiOkWire;
+      } else {
+        fd.append("max_size", maxSize);
+        fd.append("image", file);
+        wire = await generate(fd);
       }
-      const json: ApiResult = await res.json();
-      if (!res.ok || "error" in json) throw new Error(("error" in json ? json.error : `HTTP ${res.status}`));
-
-      const ok = json as ApiOk;
+      const ok: ApiOk = { ...wire, labels: await decodeLabels(wire.labels) };
       setData(ok);
 
       // Transform server labels -> Cell[][] with full stitches
@@ -60,6 +71,7 @@ export default function Page() {
       setError(err instanceof Error ? err.message : typeof err === "string" ? err : "Something went wrong");
     } finally {
       setLoading(false);
+      setProgress(null);
     }
   }
 
@@ -84,7 +96,7 @@ export default function Page() {
             file={file} setFile={setFile}
             maxSizeStr={maxSizeStr} setMaxSizeStr={setMaxSizeStr}
             onSubmit={onSubmit} reset={reset}
-            loading={loading} error={error}
+            loading={loading} progress={progress} error={error}
           />
           <PatternCard data={data} />
         </section>
@@ -1,5 +1,5 @@
 export type LegendItem = {
-  idx: number; code: string; name: string;
+  idx: number; code: string; name: string; brand?: string;
   r: number; g: number; b: number;
   count: number;
 };
@@ -12,8 +12,19 @@ export type ApiOk = {
   palette_used: LegendItem[];
 };
 
+/** Compact labels payload (labels_format other than "json"). */
+export type EncodedLabels = {
+  encoding: 'uint16le';
+  compression: 'none' | 'deflate' | 'rle';
+  shape: [number, number];
+  data: string;
+};
+
+/** Success body as sent by the server, before labels are decoded. */
+export type ApiOkWire = Omit<ApiOk, 'labels'> & { labels: number[][] | EncodedLabels };
+
 export type ApiErr = { error: string; trace?: string };
-export type ApiResult = ApiOk | ApiErr;
+export type ApiResult = ApiOkWire | ApiErr;
 
 export const SYMBOLS = ['X','/','\\','+','-','•','◇','△','#','=','%','@','~','<','>','¶','✚','✕','❖','✱'];
 
@@ -33,3 +44,17 @@ export type Cell =
 
 
 
+
+/** One image/size result of a batch or job: a success body or an item error. */
+export type BatchItem = { image: number; max_size: number } & (ApiOkWire | { error: string; status: number });
+
+/** GET /api/cross_stitch/jobs/{id} */
+export type JobStatus = {
+  job_id: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  stage: string | null;
+  position?: number;
+  result?: { results: BatchItem[] };
+  error?: string;
+  error_status?: number;
+};